@@ -40,6 +40,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "telegram_auth.middleware.outbound_deadline_middleware",
     "django_prometheus.middleware.PrometheusAfterMiddleware",
 ]
 
@@ -1,6 +1,15 @@
 from django.contrib import admin
 
-from .models import AuthIdentity, ChatMessage, ChatModerationAction, ChatReadMarker, ChatUserProfile, PaymentProof, UserNotification
+from .models import (
+    AuthIdentity,
+    ChatMessage,
+    ChatModerationAction,
+    ChatReadMarker,
+    ChatUserProfile,
+    PaymentProof,
+    RemnawaveUserSnapshot,
+    UserNotification,
+)
 
 
 @admin.register(PaymentProof)
@@ -50,3 +59,9 @@ class UserNotificationAdmin(admin.ModelAdmin):
     list_display = ("id", "user_id", "kind", "title", "is_read", "created_at", "read_at")
     list_filter = ("kind", "is_read", "created_at")
     search_fields = ("user_id", "title", "body")
+
+
+@admin.register(RemnawaveUserSnapshot)
+class RemnawaveUserSnapshotAdmin(admin.ModelAdmin):
+    list_display = ("uuid", "email", "telegram_id", "telegram_username", "fetched_at")
+    search_fields = ("uuid", "email", "telegram_id", "telegram_username")
@@ -0,0 +1,444 @@
+import asyncio
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+from django.conf import settings
+from prometheus_client import Histogram
+
+from .outbound import AsyncSingleFlight
+from .services import aget_telegram_avatar_ref, aopen_telegram_file
+from .telegram_client import TELEGRAM_CLIENT, TELEGRAM_FILE_TIMEOUT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_AVATAR_CACHE_TTL_SECONDS = max(0.0, float(os.getenv("TELEGRAM_AVATAR_CACHE_TTL_SECONDS", "3600")))
+TELEGRAM_AVATAR_CACHE_NEGATIVE_TTL_SECONDS = max(
+    0.0, float(os.getenv("TELEGRAM_AVATAR_CACHE_NEGATIVE_TTL_SECONDS", "600"))
+)
+TELEGRAM_AVATAR_MAX_BYTES = max(1, int(os.getenv("TELEGRAM_AVATAR_MAX_BYTES", str(5 * 1024 * 1024))))
+TELEGRAM_AVATAR_STREAM_CHUNK_BYTES = max(1024, int(os.getenv("TELEGRAM_AVATAR_STREAM_CHUNK_BYTES", "65536")))
+TELEGRAM_AVATAR_STREAMING = os.getenv("TELEGRAM_AVATAR_STREAMING", "True").lower() in ("1", "true", "yes", "on")
+TELEGRAM_AVATAR_CACHE_SUBDIR = "telegram_avatars"
+
+_META_FILE_NAME = "meta.json"
+_UNSAFE_FILE_CHARS = re.compile(r"[^A-Za-z0-9_-]")
+
+# Revalidations run on the outbound loop; concurrent requests for one user share a single one.
+TELEGRAM_AVATAR_REVALIDATIONS = AsyncSingleFlight()
+
+TELEGRAM_AVATAR_FETCH_SECONDS = Histogram(
+    "telegram_avatar_fetch_seconds",
+    "Time spent revalidating a Telegram avatar against the Bot API.",
+    ["result"],
+)
+
+
+@dataclass(frozen=True, slots=True)
+class CachedTelegramAvatar:
+    path: Path
+    content_type: str
+    etag: str
+
+
+def _write_atomic(path: Path, content: bytes) -> None:
+    # Readers in other workers must never see a half-written file.
+    descriptor, temp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(descriptor, "wb") as handle:
+            handle.write(content)
+        os.replace(temp_name, path)
+    except BaseException:
+        Path(temp_name).unlink(missing_ok=True)
+        raise
+
+
+class _AvatarDownload:
+    """One upstream avatar body being written into the cache directory; lives on the outbound loop.
+
+    The first caller to ``claim`` pulls the chunks (streaming them to its client as they arrive);
+    everyone else awaits ``wait``. Only one chunk is held in memory at a time, whatever the image size.
+    """
+
+    def __init__(
+        self,
+        cache: "TelegramAvatarCache",
+        telegram_id: int,
+        file_unique_id: str,
+        response: Any,
+        *,
+        fallback: CachedTelegramAvatar | None,
+        started: float,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        self.content_type = response.content_type or "image/jpeg"
+        self.content_length: int | None = response.content_length
+        self._cache = cache
+        self._telegram_id = telegram_id
+        self._file_unique_id = file_unique_id
+        self._response = response
+        self._fallback = fallback
+        self._started = started
+        self._claimed = False
+        self._lock = asyncio.Lock()
+        self._received = 0
+        self._digest = hashlib.sha256()
+        self._handle: Any = None
+        self._temp_path: Path | None = None
+        self.done: asyncio.Future[CachedTelegramAvatar | None] = loop.create_future()
+        self._watchdog = loop.call_later(
+            TELEGRAM_FILE_TIMEOUT_SECONDS,
+            lambda: loop.create_task(self.abort("timed out")),
+        )
+
+    def claim(self) -> bool:
+        if self._claimed:
+            return False
+        self._claimed = True
+        return True
+
+    async def read_chunk(self) -> bytes | None:
+        """Next chunk of the body, already written to the temp file; None once the download has ended."""
+        async with self._lock:
+            if self.done.done():
+                return None
+            try:
+                chunk = await self._response.content.read(TELEGRAM_AVATAR_STREAM_CHUNK_BYTES)
+                if not chunk:
+                    await self._complete()
+                    return None
+                self._received += len(chunk)
+                if self._received > TELEGRAM_AVATAR_MAX_BYTES:
+                    await self._fail("too_large", f"larger than {TELEGRAM_AVATAR_MAX_BYTES} bytes")
+                    return None
+                self._digest.update(chunk)
+                await asyncio.to_thread(self._write, chunk)
+            except Exception as exc:
+                await self._fail("error", exc.__class__.__name__)
+                return None
+            return chunk
+
+    async def drain(self) -> None:
+        while await self.read_chunk() is not None:
+            pass
+
+    async def wait(self) -> CachedTelegramAvatar | None:
+        if self.claim():
+            await self.drain()
+        return await asyncio.shield(self.done)
+
+    async def abort(self, reason: str) -> None:
+        # Closing the response wakes a reader blocked on it; that reader then records the failure.
+        self._response.close()
+        async with self._lock:
+            if not self.done.done():
+                await self._fail("error", reason)
+
+    def _write(self, chunk: bytes) -> None:
+        if self._handle is None:
+            user_dir = self._cache._user_dir(self._telegram_id)
+            user_dir.mkdir(parents=True, exist_ok=True)
+            descriptor, temp_name = tempfile.mkstemp(dir=user_dir, prefix=".tmp-")
+            self._handle = os.fdopen(descriptor, "wb")
+            self._temp_path = Path(temp_name)
+        self._handle.write(chunk)
+
+    def _discard_temp(self) -> None:
+        if self._handle is not None:
+            self._handle.close()
+        if self._temp_path is not None:
+            self._temp_path.unlink(missing_ok=True)
+
+    async def _complete(self) -> None:
+        if self._temp_path is None or (self.content_length is not None and self._received != self.content_length):
+            await self._fail("error", "truncated body")
+            return
+        self._handle.close()
+        self._handle = None
+        stored = await asyncio.to_thread(
+            self._cache._store_file,
+            self._telegram_id,
+            self._file_unique_id,
+            self._temp_path,
+            self.content_type,
+            self._digest.hexdigest(),
+            self._cache._clock(),
+        )
+        self._finish("downloaded", stored)
+
+    async def _fail(self, result: str, reason: str) -> None:
+        logger.warning("Telegram avatar download for telegram_id=%s failed: %s", self._telegram_id, reason)
+        await asyncio.to_thread(self._discard_temp)
+        self._finish(result, self._fallback)
+
+    def _finish(self, result: str, avatar: CachedTelegramAvatar | None) -> None:
+        self._watchdog.cancel()
+        self._response.release()
+        if self._cache._downloads.get(self._telegram_id) is self:
+            del self._cache._downloads[self._telegram_id]
+        TELEGRAM_AVATAR_FETCH_SECONDS.labels(result=result).observe(time.perf_counter() - self._started)
+        self.done.set_result(avatar)
+
+
+class TelegramAvatarStream:
+    """Avatar body streamed to one client while it is written to the cache; iterate from any event loop."""
+
+    def __init__(self, download: _AvatarDownload) -> None:
+        self.content_type = download.content_type
+        self.content_length = download.content_length
+        self._download = download
+
+    async def chunks(self):
+        finished = False
+        try:
+            while (chunk := await TELEGRAM_CLIENT.run(self._download.read_chunk())) is not None:
+                yield chunk
+            finished = True
+        finally:
+            if not finished:
+                # The client went away mid-stream: finish the download so the cache still gets the file.
+                TELEGRAM_CLIENT.submit(self._download.drain())
+
+
+class TelegramAvatarCache:
+    """On-disk avatar cache under ``MEDIA_ROOT/telegram_avatars/<telegram_id>/``.
+
+    Image files are named after Telegram's ``file_unique_id``, so an unchanged photo is never
+    downloaded twice. After ``ttl`` seconds one getUserProfilePhotos call revalidates the entry;
+    users without a photo are remembered for ``negative_ttl``. When Telegram is unreachable the
+    last stored image keeps being served.
+    """
+
+    def __init__(
+        self,
+        *,
+        ttl: float,
+        negative_ttl: float,
+        root: Path | None = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._root = root
+        self._clock = clock
+        # Downloads in progress, touched only from the outbound loop.
+        self._downloads: dict[int, _AvatarDownload] = {}
+
+    @property
+    def root(self) -> Path:
+        if self._root is not None:
+            return self._root
+        return Path(settings.MEDIA_ROOT) / TELEGRAM_AVATAR_CACHE_SUBDIR
+
+    def _user_dir(self, telegram_id: int) -> Path:
+        return self.root / str(int(telegram_id))
+
+    def _read_meta(self, telegram_id: int) -> dict[str, Any] | None:
+        try:
+            meta = json.loads((self._user_dir(telegram_id) / _META_FILE_NAME).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        return meta if isinstance(meta, dict) else None
+
+    def _write_meta(self, telegram_id: int, meta: dict[str, Any]) -> None:
+        user_dir = self._user_dir(telegram_id)
+        user_dir.mkdir(parents=True, exist_ok=True)
+        _write_atomic(user_dir / _META_FILE_NAME, json.dumps(meta).encode("utf-8"))
+
+    def _avatar_from_meta(self, telegram_id: int, meta: dict[str, Any] | None) -> CachedTelegramAvatar | None:
+        if not meta or not meta.get("file_name"):
+            return None
+        path = self._user_dir(telegram_id) / str(meta["file_name"])
+        if not path.is_file():
+            return None
+        return CachedTelegramAvatar(
+            path=path,
+            content_type=str(meta.get("content_type") or "image/jpeg"),
+            etag=f'"{meta.get("sha256", "")}"',
+        )
+
+    def _remove_stale_files(self, telegram_id: int, keep: str = "") -> None:
+        for path in self._user_dir(telegram_id).iterdir():
+            if path.name not in (_META_FILE_NAME, keep) and not path.name.startswith(".tmp-"):
+                path.unlink(missing_ok=True)
+
+    def _load(self, telegram_id: int) -> tuple[dict[str, Any] | None, CachedTelegramAvatar | None]:
+        meta = self._read_meta(telegram_id)
+        return meta, self._avatar_from_meta(telegram_id, meta)
+
+    def _fresh(self, telegram_id: int) -> tuple[bool, CachedTelegramAvatar | None]:
+        """Answer from disk without touching Telegram while the entry is within its TTL.
+
+        Reads and stats files: async callers run it in a thread like the rest of the file I/O.
+        """
+        meta, cached = self._load(telegram_id)
+        if meta is None:
+            return False, None
+        age = self._clock() - float(meta.get("checked_at") or 0)
+        if cached is not None and age < self.ttl:
+            return True, cached
+        if not meta.get("file_unique_id") and age < self.negative_ttl:
+            return True, None
+        return False, None
+
+    async def aget(self, telegram_id: int) -> CachedTelegramAvatar | None:
+        fresh, cached = await asyncio.to_thread(self._fresh, telegram_id)
+        if fresh:
+            return cached
+        return await TELEGRAM_CLIENT.run(self._resolve(telegram_id))
+
+    async def aopen(self, telegram_id: int) -> CachedTelegramAvatar | TelegramAvatarStream | None:
+        """Like ``aget``, but a cold download is streamed to the caller while it is being cached."""
+        fresh, cached = await asyncio.to_thread(self._fresh, telegram_id)
+        if fresh:
+            return cached
+        return await TELEGRAM_CLIENT.run(self._open(telegram_id))
+
+    async def arefresh(self, telegram_id: int) -> CachedTelegramAvatar | None:
+        """Revalidate against Telegram even if the entry is still within its TTL."""
+        return await TELEGRAM_CLIENT.run(self._resolve(telegram_id, force=True))
+
+    def checked_at_by_id(self) -> dict[int, float]:
+        """Last revalidation time of every cached user, for least-recently-fetched refresh passes."""
+        if not self.root.is_dir():
+            return {}
+        checked_at: dict[int, float] = {}
+        for user_dir in self.root.iterdir():
+            if user_dir.name.isdigit():
+                meta = self._read_meta(int(user_dir.name)) or {}
+                checked_at[int(user_dir.name)] = float(meta.get("checked_at") or 0)
+        return checked_at
+
+    async def _resolve(self, telegram_id: int, *, force: bool = False) -> CachedTelegramAvatar | None:
+        result = await self._shared_revalidate(telegram_id, force=force)
+        if isinstance(result, _AvatarDownload):
+            return await result.wait()
+        return result
+
+    async def _open(self, telegram_id: int) -> CachedTelegramAvatar | TelegramAvatarStream | None:
+        result = await self._shared_revalidate(telegram_id)
+        if not isinstance(result, _AvatarDownload):
+            return result
+        if TELEGRAM_AVATAR_STREAMING and result.claim():
+            return TelegramAvatarStream(result)
+        return await result.wait()
+
+    async def _shared_revalidate(
+        self,
+        telegram_id: int,
+        *,
+        force: bool = False,
+    ) -> CachedTelegramAvatar | _AvatarDownload | None:
+        download = self._downloads.get(telegram_id)
+        if download is not None:
+            return download
+        return await TELEGRAM_AVATAR_REVALIDATIONS.do(telegram_id, lambda: self._revalidate(telegram_id, force=force))
+
+    async def _revalidate(
+        self,
+        telegram_id: int,
+        *,
+        force: bool = False,
+    ) -> CachedTelegramAvatar | _AvatarDownload | None:
+        if not force:
+            fresh, cached = await asyncio.to_thread(self._fresh, telegram_id)
+            if fresh:
+                return cached
+        started = time.perf_counter()
+        result, avatar = "error", None
+        try:
+            result, avatar = await self._fetch(telegram_id, started)
+        except OSError as exc:
+            logger.warning("Telegram avatar cache failed for telegram_id=%s: %s", telegram_id, exc)
+        finally:
+            # Downloads record their own latency once the body has been written.
+            if result != "downloading":
+                TELEGRAM_AVATAR_FETCH_SECONDS.labels(result=result).observe(time.perf_counter() - started)
+        return avatar
+
+    async def _fetch(
+        self,
+        telegram_id: int,
+        started: float,
+    ) -> tuple[str, CachedTelegramAvatar | _AvatarDownload | None]:
+        meta, cached = await asyncio.to_thread(self._load, telegram_id)
+        now = self._clock()
+
+        avatar_ref, definitive = await aget_telegram_avatar_ref(telegram_id)
+        if avatar_ref is None:
+            if not definitive:
+                return "error", cached
+            await asyncio.to_thread(self._store_missing, telegram_id, now)
+            return "missing", None
+
+        if cached is not None and meta.get("file_unique_id") == avatar_ref.file_unique_id:
+            await asyncio.to_thread(self._write_meta, telegram_id, {**meta, "checked_at": now})
+            return "unchanged", cached
+
+        response = await aopen_telegram_file(avatar_ref.file_id, f"avatar download telegram_id={telegram_id}")
+        if response is None:
+            return "error", cached
+        if response.content_length is not None and response.content_length > TELEGRAM_AVATAR_MAX_BYTES:
+            response.close()
+            logger.warning(
+                "Telegram avatar for telegram_id=%s is %s bytes, over the %s byte limit",
+                telegram_id,
+                response.content_length,
+                TELEGRAM_AVATAR_MAX_BYTES,
+            )
+            return "too_large", cached
+        download = _AvatarDownload(
+            self,
+            telegram_id,
+            avatar_ref.file_unique_id,
+            response,
+            fallback=cached,
+            started=started,
+        )
+        self._downloads[telegram_id] = download
+        return "downloading", download
+
+    def _store_missing(self, telegram_id: int, now: float) -> None:
+        self._write_meta(telegram_id, {"file_unique_id": "", "checked_at": now})
+        self._remove_stale_files(telegram_id)
+
+    def _store_file(
+        self,
+        telegram_id: int,
+        file_unique_id: str,
+        temp_path: Path,
+        content_type: str,
+        sha256: str,
+        now: float,
+    ) -> CachedTelegramAvatar | None:
+        extension = mimetypes.guess_extension(content_type) or ".jpg"
+        file_name = _UNSAFE_FILE_CHARS.sub("_", file_unique_id)[:128] + extension
+        os.replace(temp_path, self._user_dir(telegram_id) / file_name)
+        meta = {
+            "file_unique_id": file_unique_id,
+            "file_name": file_name,
+            "content_type": content_type,
+            "sha256": sha256,
+            "checked_at": now,
+        }
+        self._write_meta(telegram_id, meta)
+        self._remove_stale_files(telegram_id, keep=file_name)
+        return self._avatar_from_meta(telegram_id, meta)
+
+
+TELEGRAM_AVATAR_CACHE = TelegramAvatarCache(
+    ttl=TELEGRAM_AVATAR_CACHE_TTL_SECONDS,
+    negative_ttl=TELEGRAM_AVATAR_CACHE_NEGATIVE_TTL_SECONDS,
+)
+
+
+async def aopen_telegram_avatar(telegram_id: int) -> CachedTelegramAvatar | TelegramAvatarStream | None:
+    return await TELEGRAM_AVATAR_CACHE.aopen(telegram_id)
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import threading
+
+from prometheus_client import Gauge
+
+from .avatar_cache import TELEGRAM_AVATAR_CACHE
+from .outbound import OUTBOUND_LOOP, BackgroundLoop, detach_deadline
+from .services import has_telegram_config
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_AVATAR_PREFETCH_CONCURRENCY = max(1, int(os.getenv("TELEGRAM_AVATAR_PREFETCH_CONCURRENCY", "4")))
+TELEGRAM_AVATAR_PREFETCH_MAX_PENDING = max(1, int(os.getenv("TELEGRAM_AVATAR_PREFETCH_MAX_PENDING", "10000")))
+
+TELEGRAM_AVATAR_PREFETCH_QUEUE_DEPTH = Gauge(
+    "telegram_avatar_prefetch_queue_depth",
+    "Telegram avatars waiting for (or being) prefetched in this process.",
+)
+
+
+class AvatarPrefetchQueue:
+    """Deduplicating queue that warms the avatar disk cache from the outbound loop.
+
+    ``enqueue`` is safe to call from any thread; at most ``concurrency`` revalidations run at once.
+    IDs already waiting are not queued twice, and once ``max_pending`` are waiting new ones are dropped.
+    """
+
+    def __init__(self, background_loop: BackgroundLoop, *, concurrency: int, max_pending: int) -> None:
+        self._background_loop = background_loop
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending: set[int] = set()
+        self._queue: asyncio.Queue[int] | None = None
+        self._queue_loop: asyncio.AbstractEventLoop | None = None
+        self._workers = 0
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def enqueue(self, telegram_id: int) -> bool:
+        with self._lock:
+            if telegram_id in self._pending or len(self._pending) >= self.max_pending:
+                return False
+            self._pending.add(telegram_id)
+            TELEGRAM_AVATAR_PREFETCH_QUEUE_DEPTH.set(len(self._pending))
+        self._background_loop.get_loop().call_soon_threadsafe(self._put, telegram_id)
+        return True
+
+    def wait_idle(self, timeout: float | None = None) -> bool:
+        """Block until every queued avatar has been processed; False if ``timeout`` ran out first."""
+        try:
+            self._background_loop.run_sync(self._join(), timeout=timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    async def _join(self) -> None:
+        if self._queue is not None:
+            await self._queue.join()
+
+    def _put(self, telegram_id: int) -> None:
+        loop = asyncio.get_running_loop()
+        if self._queue is None or self._queue_loop is not loop:
+            self._queue = asyncio.Queue()
+            self._queue_loop = loop
+            self._workers = 0
+        self._queue.put_nowait(telegram_id)
+        # Workers exit once the queue drains, so an idle process keeps no tasks around.
+        if self._workers < self.concurrency:
+            self._workers += 1
+            loop.create_task(self._worker(self._queue))
+
+    async def _worker(self, queue: asyncio.Queue[int]) -> None:
+        # Workers are started from whichever request first enqueued; they must not inherit its deadline.
+        detach_deadline()
+        try:
+            while not queue.empty():
+                telegram_id = queue.get_nowait()
+                try:
+                    await TELEGRAM_AVATAR_CACHE.arefresh(telegram_id)
+                except Exception as exc:
+                    logger.warning("Avatar prefetch failed for telegram_id=%s: %s", telegram_id, exc)
+                finally:
+                    with self._lock:
+                        self._pending.discard(telegram_id)
+                        TELEGRAM_AVATAR_PREFETCH_QUEUE_DEPTH.set(len(self._pending))
+                    queue.task_done()
+        finally:
+            if queue is self._queue:
+                self._workers -= 1
+
+
+AVATAR_PREFETCH_QUEUE = AvatarPrefetchQueue(
+    OUTBOUND_LOOP,
+    concurrency=TELEGRAM_AVATAR_PREFETCH_CONCURRENCY,
+    max_pending=TELEGRAM_AVATAR_PREFETCH_MAX_PENDING,
+)
+
+
+def enqueue_avatar_prefetch(telegram_id: int | None) -> bool:
+    if telegram_id is None or not has_telegram_config():
+        return False
+    return AVATAR_PREFETCH_QUEUE.enqueue(int(telegram_id))
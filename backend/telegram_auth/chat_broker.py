@@ -0,0 +1,251 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import connections
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+CHAT_BROKER_BACKEND = os.getenv("CHAT_BROKER_BACKEND", "auto").strip().lower()
+CHAT_BROKER_CHANNEL = os.getenv("CHAT_BROKER_CHANNEL", "chat_events").strip() or "chat_events"
+CHAT_BROKER_RECONNECT_MAX_SECONDS = max(1.0, float(os.getenv("CHAT_BROKER_RECONNECT_MAX_SECONDS", "30")))
+# Postgres rejects NOTIFY payloads of 8000 bytes or more.
+POSTGRES_NOTIFY_MAX_BYTES = 7999
+# Django-only OPTIONS that psycopg.connect() does not understand.
+_DJANGO_ONLY_DB_OPTIONS = frozenset({"isolation_level", "pool", "server_side_binding", "assume_role"})
+
+CHAT_EVENTS_ENQUEUED = Counter(
+    "chat_events_enqueued_total",
+    "Chat events this process handed to the broker without waiting for delivery.",
+)
+CHAT_EVENTS_DELIVERED = Counter(
+    "chat_events_delivered_total",
+    "Chat events this process's broker handed to its realtime hub.",
+)
+
+ChatEventHandler = Callable[[dict[str, Any]], Awaitable[None]]
+# Called when events may have been lost, so the subscriber can tell its clients to reload.
+ChatGapHandler = Callable[[], None]
+
+
+def encode_chat_event(event: dict[str, Any]) -> str:
+    return json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+
+
+class InProcessChatBroker:
+    """Delivers events to the hub of the publishing process only (tests, single-worker runs)."""
+
+    def __init__(self) -> None:
+        self._handler: ChatEventHandler | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._pending: deque[dict[str, Any]] = deque()
+        self._pending_lock = threading.Lock()
+        self._draining = False
+
+    async def start(self, handler: ChatEventHandler, *, on_gap: ChatGapHandler | None = None) -> None:
+        # Nothing is lost between publish and delivery in-process, so on_gap is never called.
+        self._handler = handler
+        self._loop = asyncio.get_running_loop()
+
+    async def publish(self, event: dict[str, Any]) -> None:
+        if self._handler is not None:
+            await self._handler(event)
+            CHAT_EVENTS_DELIVERED.inc()
+
+    def publish_sync(self, event: dict[str, Any]) -> None:
+        async_to_sync(self.publish)(event)
+
+    def publish_threadsafe(self, event: dict[str, Any]) -> bool:
+        """Queue ``event`` for the hub's loop and return at once; False if no hub is listening yet.
+
+        Events published while a drain is pending join its batch, so a burst costs one loop wake-up.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed() or self._handler is None:
+            return False
+        with self._pending_lock:
+            self._pending.append(event)
+            CHAT_EVENTS_ENQUEUED.inc()
+            if self._draining:
+                return True
+            self._draining = True
+        try:
+            asyncio.run_coroutine_threadsafe(self._drain(), loop)
+        except RuntimeError:
+            # The loop closed between the check and the call.
+            with self._pending_lock:
+                self._pending.clear()
+                self._draining = False
+            return False
+        return True
+
+    async def _drain(self) -> None:
+        while True:
+            with self._pending_lock:
+                if not self._pending:
+                    self._draining = False
+                    return
+                batch = list(self._pending)
+                self._pending.clear()
+            for event in batch:
+                if self._handler is None:
+                    continue
+                try:
+                    await self._handler(event)
+                except Exception as exc:
+                    logger.warning("Chat event delivery failed: %s", exc)
+                    continue
+                CHAT_EVENTS_DELIVERED.inc()
+
+    async def close(self) -> None:
+        self._handler = None
+        self._loop = None
+
+
+class PostgresChatBroker:
+    """Fans events out to every worker process through Postgres LISTEN/NOTIFY.
+
+    Publishing uses Django's own database connection, so a NOTIFY issued inside a transaction
+    reaches listeners only once that transaction commits. Each process that calls ``start`` keeps
+    one extra connection LISTENing on ``channel`` and reconnects with backoff if it drops;
+    the publishing process receives its own events through that connection as well.
+    NOTIFYs sent while the listener is reconnecting are lost, so ``on_gap`` is called once it
+    is LISTENing again.
+    """
+
+    def __init__(self, *, channel: str = CHAT_BROKER_CHANNEL, database: str = "default") -> None:
+        self.channel = channel
+        self.database = database
+        self._handler: ChatEventHandler | None = None
+        self._on_gap: ChatGapHandler | None = None
+        self._listener: asyncio.Task[None] | None = None
+        self._ready: asyncio.Event | None = None
+
+    def _conninfo(self) -> dict[str, Any]:
+        settings_dict = connections[self.database].settings_dict
+        params: dict[str, Any] = {
+            "dbname": settings_dict.get("NAME"),
+            "user": settings_dict.get("USER"),
+            "password": settings_dict.get("PASSWORD"),
+            "host": settings_dict.get("HOST"),
+            "port": settings_dict.get("PORT"),
+        }
+        options = settings_dict.get("OPTIONS") or {}
+        params.update({key: value for key, value in options.items() if key not in _DJANGO_ONLY_DB_OPTIONS})
+        return {key: value for key, value in params.items() if value not in (None, "")}
+
+    async def start(self, handler: ChatEventHandler, *, on_gap: ChatGapHandler | None = None) -> None:
+        self._handler = handler
+        self._on_gap = on_gap
+        loop = asyncio.get_running_loop()
+        if self._listener is not None and not self._listener.done() and self._listener.get_loop() is loop:
+            return
+        self._ready = asyncio.Event()
+        self._listener = loop.create_task(self._listen(self._ready))
+
+    async def wait_ready(self, timeout: float) -> bool:
+        if self._ready is None:
+            return False
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    async def _listen(self, ready: asyncio.Event) -> None:
+        import psycopg
+        from psycopg import sql
+
+        backoff = 1.0
+        listened = False
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(autocommit=True, **self._conninfo()) as connection:
+                    await connection.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+                    backoff = 1.0
+                    ready.set()
+                    if listened:
+                        self._report_gap()
+                    listened = True
+                    async for notify in connection.notifies():
+                        await self._dispatch(notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                ready.clear()
+                logger.warning("Chat broker lost LISTEN %s: %s; reconnecting in %.0fs", self.channel, exc, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, CHAT_BROKER_RECONNECT_MAX_SECONDS)
+
+    def _report_gap(self) -> None:
+        logger.warning("Chat broker re-LISTENed on %s; events sent meanwhile were lost", self.channel)
+        if self._on_gap is None:
+            return
+        try:
+            self._on_gap()
+        except Exception as exc:
+            logger.warning("Chat broker gap handler failed: %s", exc)
+
+    async def _dispatch(self, payload: str) -> None:
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.warning("Chat broker ignored a malformed payload on %s", self.channel)
+            return
+        if isinstance(event, dict) and self._handler is not None:
+            try:
+                await self._handler(event)
+            except Exception as exc:
+                logger.warning("Chat event delivery failed: %s", exc)
+                return
+            CHAT_EVENTS_DELIVERED.inc()
+
+    def publish_sync(self, event: dict[str, Any]) -> None:
+        payload = encode_chat_event(event)
+        if len(payload.encode("utf-8")) > POSTGRES_NOTIFY_MAX_BYTES and "message" in event:
+            # Long messages travel without the embedded copy; clients refetch them instead.
+            payload = encode_chat_event({key: value for key, value in event.items() if key != "message"})
+        if len(payload.encode("utf-8")) > POSTGRES_NOTIFY_MAX_BYTES:
+            logger.warning("Chat event %s is too large for NOTIFY and was dropped", event.get("event"))
+            return
+        with connections[self.database].cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [self.channel, payload])
+
+    async def publish(self, event: dict[str, Any]) -> None:
+        await sync_to_async(self.publish_sync)(event)
+
+    def publish_threadsafe(self, event: dict[str, Any]) -> bool:
+        # NOTIFY is one statement on the caller's own connection, with no hop onto an event loop,
+        # and it has to stay there to be sent only when the caller's transaction commits.
+        CHAT_EVENTS_ENQUEUED.inc()
+        self.publish_sync(event)
+        return True
+
+    async def close(self) -> None:
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.cancel()
+            await asyncio.gather(listener, return_exceptions=True)
+        self._handler = None
+        self._on_gap = None
+
+
+ChatBroker = InProcessChatBroker | PostgresChatBroker
+
+
+def build_chat_broker(backend: str = CHAT_BROKER_BACKEND) -> ChatBroker:
+    """``postgres`` or ``inprocess``; ``auto`` picks Postgres whenever the default database is Postgres."""
+    if backend == "auto":
+        backend = "postgres" if connections["default"].vendor == "postgresql" else "inprocess"
+    if backend == "postgres":
+        return PostgresChatBroker()
+    if backend != "inprocess":
+        logger.warning("Unknown CHAT_BROKER_BACKEND=%s, using the in-process broker", backend)
+    return InProcessChatBroker()
@@ -1,17 +1,75 @@
 import asyncio
 import json
+import logging
 import os
-from dataclasses import dataclass
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Iterable
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from typing import Any
 from urllib.parse import parse_qs
 
-from asgiref.sync import async_to_sync
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
+from django.db import close_old_connections
+from prometheus_client import Counter, Gauge
+
+from .chat_broker import ChatBroker, build_chat_broker, encode_chat_event
+
+logger = logging.getLogger(__name__)
 
 PING_INTERVAL_SECONDS = 25
-MAX_QUEUE_SIZE = 128
 WS_CHAT_PATH = "/ws/chat/"
+CHAT_REPLAY_BUFFER_SIZE = max(0, int(os.getenv("CHAT_REPLAY_BUFFER_SIZE", "1024")))
+CHAT_WS_QUEUE_MAX_BYTES = max(4096, int(os.getenv("CHAT_WS_QUEUE_MAX_BYTES", str(512 * 1024))))
+CHAT_WS_SLOW_CONSUMER_SECONDS = max(0.0, float(os.getenv("CHAT_WS_SLOW_CONSUMER_SECONDS", "30")))
+WS_CLOSE_SLOW_CONSUMER = 4008
+# Upper bound for the coalescing window a client may ask for with ?coalesce_ms=.
+CHAT_WS_COALESCE_MAX_MS = max(0, int(os.getenv("CHAT_WS_COALESCE_MAX_MS", "500")))
+
+# Topics a socket can subscribe to; "private:<peer_id>" narrows "private" to one conversation.
+TOPIC_GLOBAL = "global"
+TOPIC_PRIVATE = "private"
+TOPIC_NOTIFICATIONS = "notifications"
+TOPIC_MODERATION = "moderation"
+MAX_TOPICS_PER_CONNECTION = 64
+
+# Chat actions a socket may send instead of calling the HTTP API; each frame carries a request_id.
+CHAT_WS_OPERATIONS = frozenset({"send_message", "edit_message", "delete_message", "mark_read"})
+CHAT_WS_OPERATION_THREADS = max(1, int(os.getenv("CHAT_WS_OPERATION_THREADS", "4")))
+# Socket operations of all connections share these threads instead of asgiref's single sync thread.
+CHAT_WS_OPERATION_EXECUTOR = ThreadPoolExecutor(
+    max_workers=CHAT_WS_OPERATION_THREADS,
+    thread_name_prefix="chat-ws-operation",
+)
+
+CHAT_WS_DROPPED_FRAMES = Counter(
+    "chat_ws_dropped_frames_total",
+    "Queued WebSocket frames dropped because a client fell behind its byte budget.",
+)
+CHAT_WS_FORCED_DISCONNECTS = Counter(
+    "chat_ws_forced_disconnects_total",
+    "WebSocket clients disconnected for staying over their queue budget.",
+)
+CHAT_WS_COALESCED_EVENTS = Counter(
+    "chat_ws_coalesced_events_total",
+    "Read-marker events replaced by a newer one for the same marker within a coalescing window.",
+)
+CHAT_WS_CONNECTIONS = Gauge("chat_ws_connections", "Open chat WebSocket connections in this process.")
+CHAT_WS_QUEUED_FRAMES = Gauge("chat_ws_queued_frames", "Frames waiting to be written to chat WebSockets.")
+CHAT_WS_QUEUED_BYTES = Gauge("chat_ws_queued_bytes", "Bytes waiting to be written to chat WebSockets.")
+
+# A queued frame with its UTF-8 size; one tuple is shared by every recipient of an event.
+QueuedFrame = tuple[str, int]
+
+
+def _queued_frame(payload: dict[str, Any]) -> QueuedFrame:
+    text = encode_chat_event(payload)
+    return text, len(text.encode("utf-8"))
 
 
 def _parse_optional_int(value: str | None) -> int | None:
@@ -63,82 +121,435 @@ def is_chat_ws_path(path: str) -> bool:
 class ChatWsConnection:
     user_id: int
     is_admin: bool
-    queue: asyncio.Queue[dict[str, Any]]
+    # Frames are JSON-encoded before they are queued, so one encoding serves every recipient.
+    queue: deque[QueuedFrame] = field(default_factory=deque)
+    # Replies to the client itself (ack, error, pong, subscribed, ping): sent first and never dropped.
+    control: deque[QueuedFrame] = field(default_factory=deque)
+    # Set whenever a frame is queued; the sender clears it before waiting.
+    frames_ready: asyncio.Event = field(default_factory=asyncio.Event)
+    queued_bytes: int = 0
+    # Frames dropped since the client was last told so with an events_missed frame.
+    missed_frames: int = 0
+    over_budget_since: float | None = None
+    # Evicts the client if it is still over budget once the slow-consumer window runs out.
+    slow_consumer_check: asyncio.TimerHandle | None = None
+    evicted: asyncio.Event = field(default_factory=asyncio.Event)
+    # None until the client subscribes: it then receives everything its role allows.
+    topics: frozenset[str] | None = None
+    # With a window, events wait this long and leave together as one chat_events frame.
+    coalesce_seconds: float = 0.0
+    batch: dict[str, QueuedFrame] = field(default_factory=dict)
+    batch_flush: asyncio.TimerHandle | None = None
+
+
+def _default_topics(is_admin: bool) -> frozenset[str]:
+    topics = {TOPIC_GLOBAL, TOPIC_PRIVATE, TOPIC_NOTIFICATIONS}
+    if is_admin:
+        topics.add(TOPIC_MODERATION)
+    return frozenset(topics)
+
+
+def normalize_topics(raw: Iterable[Any], *, is_admin: bool) -> frozenset[str]:
+    """Keep the known topics from ``raw``; moderation is dropped for non-admins."""
+    topics: set[str] = set()
+    for value in raw:
+        topic = str(value).strip().lower()
+        if topic in (TOPIC_GLOBAL, TOPIC_PRIVATE, TOPIC_NOTIFICATIONS) or (topic == TOPIC_MODERATION and is_admin):
+            topics.add(topic)
+        elif topic.startswith("private:") and topic[len("private:") :].isdigit():
+            topics.add(f"private:{int(topic[len('private:'):])}")
+        if len(topics) >= MAX_TOPICS_PER_CONNECTION:
+            break
+    return frozenset(topics)
+
+
+def _subscribed(connection: ChatWsConnection, topic: str) -> bool:
+    if topic == TOPIC_MODERATION and not connection.is_admin:
+        return False
+    return connection.topics is None or topic in connection.topics
+
+
+def _follows_conversation(connection: ChatWsConnection, peer_id: int | None) -> bool:
+    if _subscribed(connection, TOPIC_PRIVATE):
+        return True
+    return peer_id is not None and _subscribed(connection, f"private:{peer_id}")
 
 
 def _can_receive_event(connection: ChatWsConnection, event: dict[str, Any]) -> bool:
     scope = str(event.get("scope", "")).strip()
     if scope == "notification":
         target_user_id = _parse_optional_int(str(event.get("user_id", "")).strip())
-        return target_user_id == connection.user_id
+        return target_user_id == connection.user_id and _subscribed(connection, TOPIC_NOTIFICATIONS)
+    if scope == "read_marker":
+        reader_id = _parse_optional_int(str(event.get("user_id", "")).strip())
+        if str(event.get("chat_scope", "")).strip() != "private":
+            return connection.user_id == reader_id and _subscribed(connection, TOPIC_GLOBAL)
+        peer_id = _parse_optional_int(str(event.get("peer_id", "")).strip())
+        if connection.user_id == reader_id:
+            return _follows_conversation(connection, peer_id)
+        return connection.user_id == peer_id and _follows_conversation(connection, reader_id)
     if scope != "private":
-        return True
-    if connection.is_admin:
+        return _subscribed(connection, TOPIC_GLOBAL)
+    if connection.is_admin and _subscribed(connection, TOPIC_MODERATION):
         return True
 
     sender_id = _parse_optional_int(str(event.get("sender_id", "")).strip())
     recipient_id = _parse_optional_int(str(event.get("recipient_id", "")).strip())
     if sender_id is None and recipient_id is None:
         return False
-    return connection.user_id in {sender_id, recipient_id}
+    if connection.user_id == sender_id:
+        return _follows_conversation(connection, recipient_id)
+    return connection.user_id == recipient_id and _follows_conversation(connection, sender_id)
+
+
+def _batch_key(seq: int, event: dict[str, Any]) -> str:
+    # Only the newest state of a read marker matters, so markers share a key per reader and chat.
+    if event.get("scope") == "read_marker":
+        return f"read_marker:{event.get('chat_scope')}:{event.get('user_id')}:{event.get('peer_id')}"
+    return f"seq:{seq}"
+
+
+@dataclass(frozen=True, slots=True)
+class _ReplayEntry:
+    seq: int
+    event: dict[str, Any]
+    frame: str
 
 
 class ChatRealtimeHub:
-    def __init__(self) -> None:
-        self._lock = asyncio.Lock()
+    """WebSocket connections of this worker process.
+
+    Events travel through the broker: with the Postgres backend every worker receives every
+    published event and fans it out to its own connections.
+
+    Delivered events are numbered (``seq``) within an ``epoch`` that is unique to this hub, and the
+    last ``replay_size`` of them are kept so a reconnecting client can ask for just the ones it missed.
+    Sequence numbers are per process: a client that reconnects to another worker is told to resync.
+    A new epoch also starts whenever the broker reports that events may have been lost.
+    """
+
+    def __init__(
+        self,
+        broker: ChatBroker | None = None,
+        *,
+        replay_size: int = CHAT_REPLAY_BUFFER_SIZE,
+        queue_max_bytes: int = CHAT_WS_QUEUE_MAX_BYTES,
+        slow_consumer_seconds: float = CHAT_WS_SLOW_CONSUMER_SECONDS,
+    ) -> None:
+        # A plain lock: it is held only for set updates and snapshots, never across an await.
+        self._lock = threading.Lock()
         self._connections: set[ChatWsConnection] = set()
-
-    async def register(self, connection: ChatWsConnection) -> None:
-        async with self._lock:
-            self._connections.add(connection)
+        self._by_user: dict[int, set[ChatWsConnection]] = {}
+        # Admins following the moderation feed, i.e. every private event.
+        self._moderators: set[ChatWsConnection] = set()
+        self._global_subscribers: set[ChatWsConnection] = set()
+        # Snapshot of _global_subscribers for broadcast events; rebuilt lazily after any change.
+        self._broadcast: tuple[ChatWsConnection, ...] | None = ()
+        self.queue_max_bytes = queue_max_bytes
+        self.slow_consumer_seconds = slow_consumer_seconds
+        self.epoch = secrets.token_hex(8)
+        self._seq = 0
+        self._replay: deque[_ReplayEntry] = deque(maxlen=replay_size)
+        self._broker = broker
+        self._broker_loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def broker(self) -> ChatBroker:
+        # Built lazily: the backend depends on the database settings.
+        if self._broker is None:
+            self._broker = build_chat_broker()
+        return self._broker
+
+    def connection_count(self) -> int:
+        return len(self._connections)
+
+    def queued_frames(self) -> int:
+        return sum(len(connection.queue) + len(connection.control) for connection in tuple(self._connections))
+
+    def queued_bytes(self) -> int:
+        return sum(connection.queued_bytes for connection in tuple(self._connections))
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    async def register(
+        self,
+        connection: ChatWsConnection,
+        *,
+        since: int | None = None,
+        epoch: str | None = None,
+    ) -> tuple[int, list[str] | None]:
+        """Add ``connection``; return the current seq and, with ``since``, the frames missed after it.
+
+        The frame list is None when the gap cannot be replayed (another epoch or events already
+        evicted); the client must then reload its state. Later events go to the queue as usual.
+        """
+        registered = self.add_connection(connection, since=since, epoch=epoch)
+        await self._ensure_subscribed()
+        return registered
 
     async def unregister(self, connection: ChatWsConnection) -> None:
-        async with self._lock:
+        self.remove_connection(connection)
+
+    def add_connection(
+        self,
+        connection: ChatWsConnection,
+        *,
+        since: int | None = None,
+        epoch: str | None = None,
+    ) -> tuple[int, list[str] | None]:
+        with self._lock:
+            self._connections.add(connection)
+            self._by_user.setdefault(connection.user_id, set()).add(connection)
+            self._index_topics(connection)
+            # Taken under the same lock as the index update, so no event is both replayed and queued.
+            return self._seq, self._missed_frames(connection, since, epoch) if since is not None else []
+
+    def _missed_frames(self, connection: ChatWsConnection, since: int, epoch: str | None) -> list[str] | None:
+        if epoch != self.epoch or since > self._seq:
+            return None
+        if since == self._seq:
+            return []
+        if not self._replay or self._replay[0].seq > since + 1:
+            return None
+        return [
+            entry.frame
+            for entry in self._replay
+            if entry.seq > since and _can_receive_event(connection, entry.event)
+        ]
+
+    def remove_connection(self, connection: ChatWsConnection) -> None:
+        with self._lock:
+            if connection not in self._connections:
+                return
             self._connections.discard(connection)
-
-    async def publish(self, event: dict[str, Any]) -> None:
+            user_connections = self._by_user.get(connection.user_id)
+            if user_connections is not None:
+                user_connections.discard(connection)
+                if not user_connections:
+                    del self._by_user[connection.user_id]
+            self._moderators.discard(connection)
+            self._global_subscribers.discard(connection)
+            self._broadcast = None
+        if connection.batch_flush is not None:
+            connection.batch_flush.cancel()
+            connection.batch_flush = None
+        connection.batch.clear()
+        self._cancel_slow_consumer_check(connection)
+
+    def update_topics(
+        self,
+        connection: ChatWsConnection,
+        topics: Iterable[Any],
+        *,
+        unsubscribe: bool = False,
+    ) -> frozenset[str]:
+        """Add (or with ``unsubscribe`` remove) topics for ``connection``; returns its new topic set."""
+        requested = normalize_topics(topics, is_admin=connection.is_admin)
+        with self._lock:
+            current = connection.topics if connection.topics is not None else _default_topics(connection.is_admin)
+            connection.topics = current - requested if unsubscribe else current | requested
+            if connection in self._connections:
+                self._index_topics(connection)
+            return connection.topics
+
+    def _index_topics(self, connection: ChatWsConnection) -> None:
+        for index, topic in ((self._moderators, TOPIC_MODERATION), (self._global_subscribers, TOPIC_GLOBAL)):
+            if _subscribed(connection, topic):
+                index.add(connection)
+            else:
+                index.discard(connection)
+        self._broadcast = None
+
+    def recipients(self, event: dict[str, Any]) -> tuple[ChatWsConnection, ...]:
+        """Connections allowed to see ``event``; same rules as ``_can_receive_event``, without a full scan."""
+        with self._lock:
+            return self._recipients(event)
+
+    def _recipients(self, event: dict[str, Any]) -> tuple[ChatWsConnection, ...]:
+        scope = str(event.get("scope", "")).strip()
+        if scope not in ("notification", "read_marker", "private"):
+            if self._broadcast is None:
+                self._broadcast = tuple(self._global_subscribers)
+            return self._broadcast
+
+        # Targeted events: only the sessions of the users involved are checked against their topics.
+        if scope == "notification":
+            targets: set[ChatWsConnection] = set()
+            keys: tuple[str, ...] = ("user_id",)
+        elif scope == "read_marker":
+            targets, keys = set(), ("user_id", "peer_id")
+        else:
+            targets, keys = set(self._moderators), ("sender_id", "recipient_id")
+        for key in keys:
+            participant_id = _parse_optional_int(str(event.get(key, "")).strip())
+            if participant_id is None:
+                continue
+            targets.update(
+                connection
+                for connection in self._by_user.get(participant_id, ())
+                if connection not in targets and _can_receive_event(connection, event)
+            )
+        return tuple(targets)
+
+    async def _ensure_subscribed(self) -> None:
+        # Subscribe on the loop serving this worker's sockets; workers without sockets never listen.
+        loop = asyncio.get_running_loop()
+        if self._broker_loop is not loop:
+            self._broker_loop = loop
+            await self.broker.start(self.deliver, on_gap=self.resync)
+
+    @staticmethod
+    def _stamp(event: dict[str, Any]) -> dict[str, Any]:
         event_payload = dict(event)
         event_payload.setdefault("at", _ws_now())
-        envelope = {"type": "chat_event", "event": event_payload}
+        return event_payload
 
-        async with self._lock:
+    async def publish(self, event: dict[str, Any]) -> None:
+        await self.broker.publish(self._stamp(event))
+
+    def publish_sync(self, event: dict[str, Any]) -> None:
+        self.broker.publish_sync(self._stamp(event))
+
+    def publish_threadsafe(self, event: dict[str, Any]) -> bool:
+        """Publish from any thread without waiting for delivery (sync views)."""
+        return self.broker.publish_threadsafe(self._stamp(event))
+
+    async def deliver(self, event_payload: dict[str, Any]) -> None:
+        """Fan an event received from the broker out to the matching local connections."""
+        with self._lock:
+            self._seq += 1
+            envelope = _queued_frame({"type": "chat_event", "seq": self._seq, "event": event_payload})
+            self._replay.append(_ReplayEntry(self._seq, event_payload, envelope[0]))
+            recipients = self._recipients(event_payload)
+            batch_key = _batch_key(self._seq, event_payload)
+
+        for connection in recipients:
+            if connection.coalesce_seconds > 0:
+                self._add_to_batch(connection, batch_key, envelope)
+            else:
+                self.enqueue(connection, envelope)
+
+    def resync(self) -> None:
+        """Start a new epoch after the broker may have lost events and tell every client to reload.
+
+        Replaying across the gap would skip the lost events silently, so the buffer is dropped too.
+        """
+        with self._lock:
+            self.epoch = secrets.token_hex(8)
+            self._replay.clear()
+            frame = _queued_frame({"type": "resync_required", "epoch": self.epoch, "seq": self._seq})
             connections = tuple(self._connections)
-
         for connection in connections:
-            if not _can_receive_event(connection, event_payload):
-                continue
-            try:
-                connection.queue.put_nowait(envelope)
-            except asyncio.QueueFull:
-                try:
-                    _ = connection.queue.get_nowait()
-                except asyncio.QueueEmpty:
-                    pass
-                try:
-                    connection.queue.put_nowait(envelope)
-                except asyncio.QueueFull:
-                    # Connection is too slow; keep processing other clients.
-                    continue
+            self.enqueue(connection, frame, control=True)
+
+    def _add_to_batch(self, connection: ChatWsConnection, key: str, frame: QueuedFrame) -> None:
+        if connection.batch.pop(key, None) is not None:
+            CHAT_WS_COALESCED_EVENTS.inc()
+        connection.batch[key] = frame
+        if connection.batch_flush is None:
+            loop = asyncio.get_running_loop()
+            connection.batch_flush = loop.call_later(connection.coalesce_seconds, self.flush_batch, connection)
+
+    def flush_batch(self, connection: ChatWsConnection) -> None:
+        """Queue the events collected during the window, as one frame when there are several."""
+        connection.batch_flush = None
+        frames, connection.batch = list(connection.batch.values()), {}
+        if len(frames) == 1:
+            self.enqueue(connection, frames[0])
+        elif frames:
+            # Envelopes are already encoded; joining them avoids decoding and re-encoding every event.
+            text = '{"type":"chat_events","events":[' + ",".join(frame[0] for frame in frames) + "]}"
+            self.enqueue(connection, (text, len(text.encode("utf-8"))))
+
+    def enqueue(self, connection: ChatWsConnection, frame: QueuedFrame, *, control: bool = False) -> bool:
+        """Queue ``frame`` within the connection's byte budget.
+
+        Over budget, the oldest event frames are dropped to make room and counted in ``missed_frames``;
+        ``control`` frames are never dropped, since the client is waiting for them. A client that stays
+        over budget for ``slow_consumer_seconds`` is evicted, whether or not more frames arrive.
+        """
+        if connection.evicted.is_set():
+            return False
+        size = frame[1]
+        if connection.queued_bytes + size > self.queue_max_bytes:
+            now = time.monotonic()
+            if connection.over_budget_since is None:
+                connection.over_budget_since = now
+                self._schedule_slow_consumer_check(connection)
+            elif now - connection.over_budget_since >= self.slow_consumer_seconds:
+                self.evict(connection)
+                return False
+            while connection.queued_bytes + size > self.queue_max_bytes and connection.queue:
+                _, dropped_size = connection.queue.popleft()
+                connection.queued_bytes -= dropped_size
+                connection.missed_frames += 1
+                CHAT_WS_DROPPED_FRAMES.inc()
+        (connection.control if control else connection.queue).append(frame)
+        connection.queued_bytes += size
+        connection.frames_ready.set()
+        return True
+
+    async def next_frame(self, connection: ChatWsConnection) -> QueuedFrame:
+        """Wait for the next frame to write, control frames first."""
+        while not connection.control and not connection.queue:
+            connection.frames_ready.clear()
+            await connection.frames_ready.wait()
+        return connection.control.popleft() if connection.control else connection.queue.popleft()
+
+    def frame_sent(self, connection: ChatWsConnection, frame: QueuedFrame) -> None:
+        connection.queued_bytes -= frame[1]
+        # Back under half the budget counts as caught up.
+        if connection.over_budget_since is not None and connection.queued_bytes <= self.queue_max_bytes // 2:
+            connection.over_budget_since = None
+            self._cancel_slow_consumer_check(connection)
+
+    def _schedule_slow_consumer_check(self, connection: ChatWsConnection) -> None:
+        # A stalled socket gets no more traffic once it stops reading, so the check cannot wait for one.
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._cancel_slow_consumer_check(connection)
+        connection.slow_consumer_check = loop.call_later(
+            self.slow_consumer_seconds, self._evict_if_still_slow, connection
+        )
+
+    def _cancel_slow_consumer_check(self, connection: ChatWsConnection) -> None:
+        if connection.slow_consumer_check is not None:
+            connection.slow_consumer_check.cancel()
+            connection.slow_consumer_check = None
+
+    def _evict_if_still_slow(self, connection: ChatWsConnection) -> None:
+        connection.slow_consumer_check = None
+        if connection.over_budget_since is not None and not connection.evicted.is_set():
+            self.evict(connection)
+
+    def evict(self, connection: ChatWsConnection) -> None:
+        self.remove_connection(connection)
+        connection.queue.clear()
+        connection.control.clear()
+        connection.queued_bytes = 0
+        connection.evicted.set()
+        CHAT_WS_FORCED_DISCONNECTS.inc()
+        logger.warning("Disconnecting slow chat WebSocket client user_id=%s", connection.user_id)
 
 
 CHAT_REALTIME_HUB = ChatRealtimeHub()
+CHAT_WS_CONNECTIONS.set_function(CHAT_REALTIME_HUB.connection_count)
+CHAT_WS_QUEUED_FRAMES.set_function(CHAT_REALTIME_HUB.queued_frames)
+CHAT_WS_QUEUED_BYTES.set_function(CHAT_REALTIME_HUB.queued_bytes)
 
 
 def publish_chat_event(event: dict[str, Any]) -> None:
     try:
-        async_to_sync(CHAT_REALTIME_HUB.publish)(event)
+        CHAT_REALTIME_HUB.publish_threadsafe(event)
     except Exception:
         # Realtime delivery must never break the primary HTTP request.
         return
 
 
-def _build_json_message(payload: dict[str, Any]) -> dict[str, str]:
-    return {
-        "type": "websocket.send",
-        "text": json.dumps(payload, ensure_ascii=False, separators=(",", ":")),
-    }
-
-
 async def _resolve_websocket_user(query: dict[str, list[str]]) -> tuple[int | None, bool]:
     user_id = _parse_optional_int((query.get("user_id") or [""])[0])
     if user_id is None:
@@ -170,20 +581,64 @@ async def _resolve_websocket_user(query: dict[str, list[str]]) -> tuple[int | No
 
 async def _sender_loop(send, connection: ChatWsConnection) -> None:
     while True:
-        payload = await connection.queue.get()
-        await send(_build_json_message(payload))
+        frame = await CHAT_REALTIME_HUB.next_frame(connection)
+        CHAT_REALTIME_HUB.frame_sent(connection, frame)
+        if connection.missed_frames:
+            # Everything still queued is newer than what was dropped; the client should resync.
+            missed, connection.missed_frames = connection.missed_frames, 0
+            marker = {"type": "events_missed", "count": missed, "epoch": CHAT_REALTIME_HUB.epoch, "ts": _ws_now()}
+            await send({"type": "websocket.send", "text": encode_chat_event(marker)})
+        await send({"type": "websocket.send", "text": frame[0]})
 
 
 async def _ping_loop(connection: ChatWsConnection) -> None:
     while True:
         await asyncio.sleep(PING_INTERVAL_SECONDS)
-        try:
-            connection.queue.put_nowait({"type": "ping", "ts": _ws_now()})
-        except asyncio.QueueFull:
-            try:
-                _ = connection.queue.get_nowait()
-            except asyncio.QueueEmpty:
-                pass
+        CHAT_REALTIME_HUB.enqueue(connection, _queued_frame({"type": "ping", "ts": _ws_now()}), control=True)
+
+
+async def _close_when_evicted(send, connection: ChatWsConnection, sender_task: asyncio.Task[None]) -> None:
+    await connection.evicted.wait()
+    sender_task.cancel()
+    await send({"type": "websocket.close", "code": WS_CLOSE_SLOW_CONSUMER, "reason": "slow consumer"})
+
+
+def _run_chat_operation_sync(
+    operation: str,
+    payload: dict[str, Any],
+    *,
+    user_id: int,
+    is_admin: bool,
+) -> tuple[dict[str, Any], int]:
+    # views imports this module for publish_chat_event.
+    from .views import run_chat_ws_operation
+
+    # No request_started/finished signals fire for socket frames: drop broken or expired
+    # connections around each operation the way they do around a request.
+    close_old_connections()
+    try:
+        return run_chat_ws_operation(operation, payload, user_id=user_id, is_admin=is_admin)
+    finally:
+        close_old_connections()
+
+
+async def _run_chat_operation(connection: ChatWsConnection, operation: str, payload: dict[str, Any]) -> None:
+    request_id = str(payload.get("request_id", ""))[:64]
+    try:
+        result, status = await sync_to_async(
+            _run_chat_operation_sync,
+            thread_sensitive=False,
+            executor=CHAT_WS_OPERATION_EXECUTOR,
+        )(operation, payload, user_id=connection.user_id, is_admin=connection.is_admin)
+    except Exception as exc:
+        logger.warning("Chat WebSocket %s failed for user %s: %s", operation, connection.user_id, exc)
+        result, status = {"error": "Internal error"}, 500
+    reply: dict[str, Any] = {"request_id": request_id, "operation": operation, "status": status}
+    if status < 400:
+        reply.update({"type": "ack", "data": result})
+    else:
+        reply.update({"type": "error", "error": result.get("error", "Request failed")})
+    CHAT_REALTIME_HUB.enqueue(connection, _queued_frame(reply), control=True)
 
 
 async def chat_ws_app(scope, receive, send) -> None:
@@ -195,23 +650,44 @@ async def chat_ws_app(scope, receive, send) -> None:
         return
 
     await send({"type": "websocket.accept"})
-    connection = ChatWsConnection(
-        user_id=user_id,
-        is_admin=is_admin,
-        queue=asyncio.Queue(maxsize=MAX_QUEUE_SIZE),
-    )
-    await CHAT_REALTIME_HUB.register(connection)
+    connection = ChatWsConnection(user_id=user_id, is_admin=is_admin)
+    if query.get("topics"):
+        # Subscribing in the URL also filters the replay below.
+        connection.topics = normalize_topics(",".join(query["topics"]).split(","), is_admin=is_admin)
+    coalesce_ms = _parse_optional_int((query.get("coalesce_ms") or [""])[0])
+    if coalesce_ms is not None:
+        connection.coalesce_seconds = max(0, min(coalesce_ms, CHAT_WS_COALESCE_MAX_MS)) / 1000
+    since = _parse_optional_int((query.get("since") or [""])[0])
+    epoch = (query.get("epoch") or [""])[0].strip() or None
+    seq, missed = await CHAT_REALTIME_HUB.register(connection, since=since, epoch=epoch)
+
+    # Written before the sender starts, so they precede everything queued after registration.
+    frames = [
+        encode_chat_event(
+            {
+                "type": "ready",
+                "user_id": user_id,
+                "is_admin": is_admin,
+                "epoch": CHAT_REALTIME_HUB.epoch,
+                "seq": seq,
+                "ts": _ws_now(),
+            }
+        )
+    ]
+    if missed is None:
+        frames.append(encode_chat_event({"type": "resync_required", "epoch": CHAT_REALTIME_HUB.epoch, "seq": seq}))
+    else:
+        frames.extend(missed)
+    try:
+        for frame in frames:
+            await send({"type": "websocket.send", "text": frame})
+    except Exception:
+        await CHAT_REALTIME_HUB.unregister(connection)
+        raise
 
     sender_task = asyncio.create_task(_sender_loop(send, connection))
     ping_task = asyncio.create_task(_ping_loop(connection))
-    await connection.queue.put(
-        {
-            "type": "ready",
-            "user_id": user_id,
-            "is_admin": is_admin,
-            "ts": _ws_now(),
-        }
-    )
+    evict_task = asyncio.create_task(_close_when_evicted(send, connection, sender_task))
 
     try:
         while True:
@@ -229,11 +705,25 @@ async def chat_ws_app(scope, receive, send) -> None:
                 payload = json.loads(text)
             except json.JSONDecodeError:
                 continue
+            if not isinstance(payload, dict):
+                continue
 
-            if str(payload.get("type", "")).strip().lower() == "ping":
-                await connection.queue.put({"type": "pong", "ts": _ws_now()})
+            frame_type = str(payload.get("type", "")).strip().lower()
+            if frame_type == "ping":
+                CHAT_REALTIME_HUB.enqueue(connection, _queued_frame({"type": "pong", "ts": _ws_now()}), control=True)
+            elif frame_type in ("subscribe", "unsubscribe") and isinstance(payload.get("topics"), list):
+                topics = CHAT_REALTIME_HUB.update_topics(
+                    connection, payload["topics"], unsubscribe=frame_type == "unsubscribe"
+                )
+                CHAT_REALTIME_HUB.enqueue(
+                    connection, _queued_frame({"type": "subscribed", "topics": sorted(topics)}), control=True
+                )
+            elif frame_type in CHAT_WS_OPERATIONS:
+                # One at a time, so a client's edit never overtakes the send it refers to.
+                await _run_chat_operation(connection, frame_type, payload)
     finally:
         await CHAT_REALTIME_HUB.unregister(connection)
         sender_task.cancel()
         ping_task.cancel()
-        await asyncio.gather(sender_task, ping_task, return_exceptions=True)
+        evict_task.cancel()
+        await asyncio.gather(sender_task, ping_task, evict_task, return_exceptions=True)
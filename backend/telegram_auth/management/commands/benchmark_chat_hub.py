@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from telegram_auth.chat_broker import InProcessChatBroker
+from telegram_auth.chat_realtime import ChatRealtimeHub, ChatWsConnection, _can_receive_event
+
+
+class Command(BaseCommand):
+    help = "Compare indexed chat event routing with a full scan of simulated WebSocket connections."
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--connections", type=int, default=10000, help="Simulated WebSocket connections.")
+        parser.add_argument("--iterations", type=int, default=200, help="Routed events per mode and scope.")
+        parser.add_argument("--admins", type=int, default=10, help="How many of the connections belong to admins.")
+
+    def handle(self, *args, **options) -> None:
+        total = max(1, options["connections"])
+        iterations = max(1, options["iterations"])
+        hub = ChatRealtimeHub(InProcessChatBroker())
+        connections = [ChatWsConnection(user_id=index + 1, is_admin=index < options["admins"]) for index in range(total)]
+        for connection in connections:
+            hub.add_connection(connection)
+
+        events = (
+            ("global", {"event": "message_created", "scope": "global", "message_id": 1}),
+            ("private", {"event": "message_created", "scope": "private", "sender_id": total, "recipient_id": total // 2}),
+            ("notification", {"event": "notification_created", "scope": "notification", "user_id": total // 3 or 1}),
+        )
+        for label, event in events:
+            scanned = {connection for connection in connections if _can_receive_event(connection, event)}
+            if set(hub.recipients(event)) != scanned:
+                raise CommandError(f"Indexed routing disagrees with the full scan for {label} events")
+
+            modes = (
+                ("full scan", lambda: [c for c in tuple(connections) if _can_receive_event(c, event)]),
+                ("indexed", lambda: hub.recipients(event)),
+            )
+            for mode, route in modes:
+                started = time.perf_counter()
+                for _ in range(iterations):
+                    route()
+                per_call_us = (time.perf_counter() - started) / iterations * 1_000_000
+                self.stdout.write(
+                    f"connections={total:<6} {label:<13} {mode:<10} {len(scanned):>6} recipients {per_call_us:11.2f} us/event"
+                )
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import aiohttp
+from django.core.management.base import BaseCommand, CommandError
+
+from telegram_auth.remnawave_client import REMNAWAVE_CACHE, get_remnawave_user_sync, normalize_remnawave_user
+
+
+def _legacy_lookup(base_url: str, email: str) -> dict | None:
+    """Lookup as it was done before the pooled client: new event loop and new session per call."""
+
+    async def _fetch() -> dict | None:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(
+                f"{base_url}/api/users/by-email/{email}",
+                headers={"Authorization": "Bearer stub-token"},
+                cookies={"session": "stub"},
+            ) as response:
+                if response.status != 200:
+                    return None
+                data = await response.json()
+                return normalize_remnawave_user(data.get("response"))
+
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(_fetch())
+    finally:
+        loop.close()
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = "Compare per-call Remnawave sessions against the pooled client on a local stub server."
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--requests", type=int, default=300, help="Lookups per mode.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Threads issuing lookups concurrently.")
+        parser.add_argument("--latency-ms", type=float, default=0.0, help="Artificial stub server latency.")
+
+    def handle(self, *args, **options) -> None:
+        total_requests = max(1, options["requests"])
+        concurrency = max(1, options["concurrency"])
+        try:
+            # Test support lives outside the app and is not shipped in the production image.
+            from testing.remnawave_stub import RemnawaveStubServer, build_stub_user
+        except ImportError as exc:
+            raise CommandError("This benchmark needs the backend/testing package of a source checkout") from exc
+        users = [build_stub_user(index) for index in range(total_requests)]
+
+        with RemnawaveStubServer(users, latency_seconds=options["latency_ms"] / 1000) as stub:
+            with patch.dict(os.environ, stub.env()):
+                modes = (
+                    ("legacy (session per call)", lambda email: _legacy_lookup(stub.base_url, email)),
+                    ("pooled client", lambda email: get_remnawave_user_sync(email=email)),
+                )
+                for workers in sorted({1, concurrency}):
+                    for label, lookup in modes:
+                        stub.reset_stats()
+                        # Measure the transport, not the lookup cache.
+                        REMNAWAVE_CACHE.clear()
+                        self._run_mode(f"{label}, {workers} thread(s)", lookup, users, workers, stub)
+
+    def _run_mode(self, label: str, lookup, users: list[dict], workers: int, stub) -> None:
+        latencies: list[float] = []
+
+        def _timed(email: str) -> None:
+            started = time.perf_counter()
+            result = lookup(email)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if result is None:
+                raise RuntimeError(f"Stub lookup failed for {email}")
+
+        started = time.perf_counter()
+        emails = [str(user["email"]) for user in users]
+        if workers == 1:
+            for email in emails:
+                _timed(email)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(_timed, emails))
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"{label:<40} total={elapsed:7.3f}s  rps={len(emails) / elapsed:8.1f}  "
+            f"mean={statistics.fmean(latencies):6.2f}ms  p50={_percentile(latencies, 50):6.2f}ms  "
+            f"p95={_percentile(latencies, 95):6.2f}ms  connections={stub.connection_count}"
+        )
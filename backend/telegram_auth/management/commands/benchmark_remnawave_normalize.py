@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from telegram_auth.remnawave_client import (
+    _normalize_remnawave_user_fast,
+    _normalize_remnawave_user_generic,
+    normalize_remnawave_user,
+)
+
+
+class Command(BaseCommand):
+    help = "Compare the generic nested-dict normalizer with the schema fast path on large Remnawave payloads."
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--iterations", type=int, default=2000, help="Normalizations per mode and payload.")
+        parser.add_argument(
+            "--history-days",
+            type=int,
+            nargs="+",
+            default=[0, 30, 365],
+            help="Traffic history sizes to benchmark.",
+        )
+
+    def handle(self, *args, **options) -> None:
+        iterations = max(1, options["iterations"])
+        try:
+            # Test support lives outside the app and is not shipped in the production image.
+            from testing.remnawave_stub import build_stub_user
+        except ImportError as exc:
+            raise CommandError("This benchmark needs the backend/testing package of a source checkout") from exc
+        for history_days in options["history_days"]:
+            payload = {"response": build_stub_user(1, traffic_history_days=history_days)}
+            user = payload["response"]
+            if _normalize_remnawave_user_fast(user) != _normalize_remnawave_user_generic(user):
+                raise CommandError(f"Fast path disagrees with the generic normalizer (history_days={history_days})")
+
+            modes = (
+                ("generic DFS", lambda: _normalize_remnawave_user_generic(user)),
+                ("normalize_remnawave_user", lambda: normalize_remnawave_user(payload["response"])),
+            )
+            for label, normalize in modes:
+                started = time.perf_counter()
+                for _ in range(iterations):
+                    normalize()
+                per_call_us = (time.perf_counter() - started) / iterations * 1_000_000
+                self.stdout.write(f"history_days={history_days:<4} {label:<26} {per_call_us:9.2f} us/call")
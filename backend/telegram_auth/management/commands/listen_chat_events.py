@@ -0,0 +1,44 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from telegram_auth.chat_broker import PostgresChatBroker, build_chat_broker, encode_chat_event
+
+
+class Command(BaseCommand):
+    help = "Print chat events fanned out through the chat broker (one JSON object per line)."
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--count", type=int, default=0, help="Exit after N events (0 listens forever).")
+        parser.add_argument("--timeout", type=float, default=0.0, help="Give up after N seconds (0 waits forever).")
+
+    def handle(self, *args, **options) -> None:
+        broker = build_chat_broker()
+        if not isinstance(broker, PostgresChatBroker):
+            raise CommandError("The chat broker is in-process; set CHAT_BROKER_BACKEND=postgres with a Postgres DATABASE_URL")
+        try:
+            asyncio.run(self._listen(broker, count=max(0, options["count"]), timeout=options["timeout"] or None))
+        except TimeoutError as exc:
+            raise CommandError("Timed out waiting for chat events") from exc
+
+    async def _listen(self, broker: PostgresChatBroker, *, count: int, timeout: float | None) -> None:
+        received = 0
+        done = asyncio.Event()
+
+        async def _print(event: dict) -> None:
+            nonlocal received
+            self.stdout.write(encode_chat_event(event))
+            self.stdout.flush()
+            received += 1
+            if count and received >= count:
+                done.set()
+
+        await broker.start(_print)
+        try:
+            if not await broker.wait_ready(timeout or 30):
+                raise CommandError(f"Could not LISTEN on {broker.channel}")
+            self.stderr.write(f"Listening on {broker.channel}")
+            self.stderr.flush()
+            await asyncio.wait_for(done.wait(), timeout)
+        finally:
+            await broker.close()
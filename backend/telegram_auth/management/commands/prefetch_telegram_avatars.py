@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from telegram_auth.avatar_cache import TELEGRAM_AVATAR_CACHE
+from telegram_auth.avatar_prefetch import AVATAR_PREFETCH_QUEUE
+from telegram_auth.models import ChatUserProfile
+from telegram_auth.services import has_telegram_config
+
+
+class Command(BaseCommand):
+    help = "Warm the Telegram avatar disk cache: uncached users first, then the least recently fetched ones."
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--limit", type=int, default=500, help="Avatars to fetch per pass.")
+        parser.add_argument(
+            "--refresh-after",
+            type=float,
+            default=TELEGRAM_AVATAR_CACHE.ttl * 0.8,
+            help="Refresh cached avatars last fetched more than N seconds ago (default: 80%% of the cache TTL).",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0.0,
+            help="Repeat the pass every N seconds (0 runs it once).",
+        )
+
+    def handle(self, *args, **options) -> None:
+        if not has_telegram_config():
+            raise CommandError("TELEGRAM_BOT_TOKEN is not configured")
+        interval = max(0.0, options["interval"])
+        limit = max(1, options["limit"])
+        while True:
+            started = time.perf_counter()
+            checked_at = TELEGRAM_AVATAR_CACHE.checked_at_by_id()
+            known_ids = ChatUserProfile.objects.filter(telegram_id__isnull=False).values_list("telegram_id", flat=True)
+            cold = [telegram_id for telegram_id in known_ids.iterator() if telegram_id not in checked_at][:limit]
+            stale_before = time.time() - options["refresh_after"]
+            stale = sorted(
+                (last_checked, telegram_id) for telegram_id, last_checked in checked_at.items() if last_checked < stale_before
+            )
+            batch = cold + [telegram_id for _, telegram_id in stale[: limit - len(cold)]]
+
+            for telegram_id in batch:
+                AVATAR_PREFETCH_QUEUE.enqueue(telegram_id)
+            AVATAR_PREFETCH_QUEUE.wait_idle()
+            self.stdout.write(
+                f"Prefetched {len(batch)} Telegram avatars ({len(cold)} uncached, {len(batch) - len(cold)} refreshed) "
+                f"in {time.perf_counter() - started:.2f}s"
+            )
+            if not interval:
+                return
+            time.sleep(interval)
@@ -0,0 +1,76 @@
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+from telegram_auth.remnawave_sync import (
+    REMNAWAVE_WEBHOOK_SIGNATURE_HEADER,
+    remnawave_webhook_secret,
+    sign_remnawave_webhook,
+)
+
+DEFAULT_WEBHOOK_URL = "http://127.0.0.1:8000/api/remnawave/webhook/"
+
+
+class Command(BaseCommand):
+    help = "Sign Remnawave webhook events with REMNAWAVE_WEBHOOK_SECRET and POST them to a running backend."
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("files", nargs="*", help="JSON files with one event object or a list of events.")
+        parser.add_argument("--url", default=DEFAULT_WEBHOOK_URL, help="Webhook endpoint to post to.")
+        parser.add_argument("--secret", default="", help="Signing secret (defaults to REMNAWAVE_WEBHOOK_SECRET).")
+        parser.add_argument(
+            "--stub-user",
+            type=int,
+            action="append",
+            default=[],
+            help="Also send an event for build_stub_user(N); may be repeated.",
+        )
+        parser.add_argument("--event", default="user.modified", help="Event name used with --stub-user.")
+
+    def handle(self, *args, **options) -> None:
+        secret = options["secret"] or remnawave_webhook_secret()
+        if not secret:
+            raise CommandError("Pass --secret or set REMNAWAVE_WEBHOOK_SECRET")
+
+        events: list[dict] = []
+        for file_name in options["files"]:
+            try:
+                loaded = json.loads(Path(file_name).read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError) as exc:
+                raise CommandError(f"Cannot read {file_name}: {exc}") from exc
+            events.extend(loaded if isinstance(loaded, list) else [loaded])
+        if options["stub_user"]:
+            try:
+                # Test support lives outside the app and is not shipped in the production image.
+                from testing.remnawave_stub import build_stub_user
+            except ImportError as exc:
+                raise CommandError("--stub-user needs the backend/testing package of a source checkout") from exc
+            sent_at = datetime.now(timezone.utc).isoformat()
+            events.extend(
+                {"event": options["event"], "data": build_stub_user(index), "timestamp": sent_at}
+                for index in options["stub_user"]
+            )
+        if not events:
+            raise CommandError("Nothing to replay: pass event files or --stub-user")
+
+        for event in events:
+            body = json.dumps(event).encode("utf-8")
+            request = Request(
+                options["url"],
+                data=body,
+                method="POST",
+                headers={
+                    "Content-Type": "application/json",
+                    REMNAWAVE_WEBHOOK_SIGNATURE_HEADER: sign_remnawave_webhook(body, secret),
+                },
+            )
+            try:
+                with urlopen(request, timeout=10) as response:  # noqa: S310
+                    status, answer = response.status, response.read().decode("utf-8")
+            except HTTPError as exc:
+                status, answer = exc.code, exc.read().decode("utf-8")
+            self.stdout.write(f"{event.get('event', '?')}: HTTP {status} {answer}")
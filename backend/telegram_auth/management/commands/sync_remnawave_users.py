@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from telegram_auth.remnawave_client import REMNAWAVE_SYNC_CONCURRENCY, REMNAWAVE_SYNC_PAGE_SIZE
+from telegram_auth.remnawave_sync import sync_remnawave_snapshots
+
+
+class Command(BaseCommand):
+    help = "Mirror Remnawave users into the local RemnawaveUserSnapshot table."
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--page-size", type=int, default=REMNAWAVE_SYNC_PAGE_SIZE, help="Users per API page.")
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=REMNAWAVE_SYNC_CONCURRENCY,
+            help="Pages fetched in parallel.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0.0,
+            help="Repeat the sync every N seconds (0 runs it once).",
+        )
+
+    def handle(self, *args, **options) -> None:
+        interval = max(0.0, options["interval"])
+        while True:
+            started = time.perf_counter()
+            result = sync_remnawave_snapshots(page_size=options["page_size"], concurrency=options["concurrency"])
+            if result is None:
+                if not interval:
+                    raise CommandError("Remnawave sync failed, mirror left unchanged")
+                self.stderr.write("Remnawave sync failed, mirror left unchanged")
+            else:
+                self.stdout.write(
+                    f"Synced {result.stored} Remnawave users ({result.fetched} fetched, {result.pruned} pruned) "
+                    f"in {time.perf_counter() - started:.2f}s"
+                )
+            if not interval:
+                return
+            time.sleep(interval)
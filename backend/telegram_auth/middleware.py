@@ -0,0 +1,22 @@
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from .outbound import OUTBOUND_REQUEST_BUDGET_SECONDS, deadline_scope
+
+
+@sync_and_async_middleware
+def outbound_deadline_middleware(get_response):
+    """Give every request one shared budget for its Remnawave and Telegram calls."""
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            with deadline_scope(OUTBOUND_REQUEST_BUDGET_SECONDS):
+                return await get_response(request)
+
+    else:
+
+        def middleware(request):
+            with deadline_scope(OUTBOUND_REQUEST_BUDGET_SECONDS):
+                return get_response(request)
+
+    return middleware
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("telegram_auth", "0009_usernotification"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RemnawaveUserSnapshot",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("uuid", models.CharField(max_length=64, unique=True)),
+                ("email", models.CharField(blank=True, db_index=True, default="", max_length=255)),
+                ("telegram_id", models.BigIntegerField(blank=True, db_index=True, null=True)),
+                ("telegram_username", models.CharField(blank=True, default="", max_length=255)),
+                ("photo", models.CharField(blank=True, default="", max_length=2048)),
+                ("subscription_url", models.CharField(blank=True, default="", max_length=2048)),
+                ("fetched_at", models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
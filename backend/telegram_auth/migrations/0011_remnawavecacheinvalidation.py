@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("telegram_auth", "0010_remnawaveusersnapshot"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RemnawaveCacheInvalidation",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("key", models.CharField(max_length=300, unique=True)),
+                ("invalidated_at", models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("telegram_auth", "0011_remnawavecacheinvalidation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RemnawaveSyncState",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("synced_at", models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -197,3 +197,41 @@ class UserNotification(models.Model):
 
     def __str__(self) -> str:
         return f"{self.user_id}:{self.kind}:{self.title}"
+
+
+class RemnawaveUserSnapshot(models.Model):
+    uuid = models.CharField(max_length=64, unique=True)
+    email = models.CharField(max_length=255, blank=True, default="", db_index=True)
+    telegram_id = models.BigIntegerField(null=True, blank=True, db_index=True)
+    telegram_username = models.CharField(max_length=255, blank=True, default="")
+    photo = models.CharField(max_length=2048, blank=True, default="")
+    subscription_url = models.CharField(max_length=2048, blank=True, default="")
+    fetched_at = models.DateTimeField(db_index=True)
+
+    def __str__(self) -> str:
+        return f"{self.uuid}:{self.email or self.telegram_id}"
+
+
+class RemnawaveSyncState(models.Model):
+    """When the last full sync finished; the mirror only answers for Remnawave while this is recent.
+
+    Webhooks keep individual rows current but cannot tell which users are missing, so they do not count.
+    """
+
+    synced_at = models.DateTimeField()
+
+    def __str__(self) -> str:
+        return self.synced_at.isoformat()
+
+
+class RemnawaveCacheInvalidation(models.Model):
+    """When a webhook last changed the user behind a lookup key, e.g. ``email:user@example.com``.
+
+    Every worker keeps its own lookup cache; entries cached before this time are dropped on use.
+    """
+
+    key = models.CharField(max_length=300, unique=True)
+    invalidated_at = models.DateTimeField(db_index=True)
+
+    def __str__(self) -> str:
+        return self.key
@@ -0,0 +1,261 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+from collections.abc import Awaitable, Callable, Coroutine, Hashable, Iterator
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+SHUTDOWN_TIMEOUT_SECONDS = 5
+OUTBOUND_REQUEST_BUDGET_SECONDS = max(0.1, float(os.getenv("OUTBOUND_REQUEST_BUDGET_SECONDS", "4")))
+
+# Absolute time.monotonic() deadline shared by every outbound call made while serving one request.
+_OUTBOUND_DEADLINE: ContextVar[float | None] = ContextVar("outbound_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: float) -> Iterator[None]:
+    """Limit all outbound calls inside the block to ``seconds`` in total (nested scopes only shrink it)."""
+    deadline = time.monotonic() + seconds
+    current = _OUTBOUND_DEADLINE.get()
+    token = _OUTBOUND_DEADLINE.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _OUTBOUND_DEADLINE.reset(token)
+
+
+def detach_deadline() -> None:
+    """Drop the request deadline in the current context, e.g. for background work outliving the request."""
+    _OUTBOUND_DEADLINE.set(None)
+
+
+def remaining_timeout(default: float) -> float | None:
+    """Timeout for the next outbound call: ``default`` capped by the budget, or None when it is spent."""
+    deadline = _OUTBOUND_DEADLINE.get()
+    if deadline is None:
+        return default
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return None
+    return min(default, remaining)
+
+
+def is_budget_timeout(exc: BaseException, granted: float, default: float) -> bool:
+    """Whether ``exc`` timed out a call that the request budget gave less than its own ``default`` timeout.
+
+    Such a timeout says nothing about the upstream's health, so it must not count as a breaker failure.
+    """
+    return isinstance(exc, TimeoutError) and granted < default
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe.
+
+    closed: calls pass; ``failure_threshold`` failures in a row open the circuit.
+    open: calls are rejected until ``reset_timeout`` has passed.
+    half-open: one probe call passes; success closes the circuit, failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        failure_threshold: int,
+        reset_timeout: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            now = self._clock()
+            if now - self._opened_at < self.reset_timeout:
+                return False
+            # Open long enough, or a half-open probe never reported back: let one probe through.
+            self._state = self.HALF_OPEN
+            self._opened_at = now
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("%s: circuit closed", self.name)
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning("%s: circuit opened after %s failure(s)", self.name, self._failures)
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+
+class BackgroundLoop:
+    """Event loop running on a daemon thread for the lifetime of the worker process.
+
+    Outbound HTTP clients keep their connection pools on this loop so that sync views
+    (running in the thread pool) and async code (running on the ASGI loop) share them.
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._pid: int | None = None
+        self._shutdown_callbacks: list[Callable[[], Awaitable[None]]] = []
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        loop = self._loop
+        if loop is not None and self._pid == os.getpid():
+            return loop
+        with self._lock:
+            # After a fork (gunicorn --preload) the parent's loop thread is gone; start a fresh one.
+            if self._loop is None or self._pid != os.getpid():
+                self._start()
+            assert self._loop is not None
+            return self._loop
+
+    def _start(self) -> None:
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def _run() -> None:
+            asyncio.set_event_loop(loop)
+            loop.call_soon(ready.set)
+            loop.run_forever()
+
+        thread = threading.Thread(target=_run, name=self._name, daemon=True)
+        thread.start()
+        ready.wait()
+        self._loop = loop
+        self._thread = thread
+        self._pid = os.getpid()
+
+    def is_current(self) -> bool:
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        return running_loop is self._loop and self._pid == os.getpid()
+
+    def submit(self, coroutine: Coroutine[Any, Any, T]) -> Future[T]:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.get_loop())
+
+    def run_sync(self, coroutine: Coroutine[Any, Any, T], timeout: float | None = None) -> T:
+        if self.is_current():
+            coroutine.close()
+            raise RuntimeError(f"{self._name}: run_sync() called from the background loop itself")
+        future = self.submit(coroutine)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    async def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        if self.is_current():
+            return await coroutine
+        return await asyncio.wrap_future(self.submit(coroutine))
+
+    def add_shutdown_callback(self, callback: Callable[[], Awaitable[None]]) -> None:
+        self._shutdown_callbacks.append(callback)
+
+    async def _run_shutdown_callbacks(self) -> None:
+        for callback in self._shutdown_callbacks:
+            try:
+                await callback()
+            except Exception as exc:
+                logger.warning("%s: shutdown callback failed: %s", self._name, exc)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            loop = self._loop
+            thread = self._thread
+            if loop is None or thread is None or self._pid != os.getpid():
+                return
+            self._loop = None
+            self._thread = None
+            self._pid = None
+
+        try:
+            asyncio.run_coroutine_threadsafe(self._run_shutdown_callbacks(), loop).result(SHUTDOWN_TIMEOUT_SECONDS)
+        except Exception as exc:
+            logger.warning("%s: graceful shutdown failed: %s", self._name, exc)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(SHUTDOWN_TIMEOUT_SECONDS)
+        loop.close()
+
+
+class AsyncSingleFlight:
+    """Coalesce concurrent coroutines for the same key on one event loop.
+
+    The first caller runs the work; callers arriving while it is in flight await the same task.
+    A cancelled waiter does not cancel the shared task for the others. With
+    ``cancel_when_abandoned`` the task is cancelled once its last waiter is, so nobody pays for
+    work whose result would only be discarded; otherwise it runs to completion regardless.
+    """
+
+    def __init__(self, *, cancel_when_abandoned: bool = False) -> None:
+        self._inflight: dict[Hashable, asyncio.Task[Any]] = {}
+        self._waiters: dict[asyncio.Task[Any], int] = {}
+        self._cancel_when_abandoned = cancel_when_abandoned
+
+    def inflight_count(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, factory: Callable[[], Coroutine[Any, Any, T]]) -> T:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda finished: self._forget(key, finished))
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._cancel_when_abandoned and self._waiters[task] == 1:
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def _forget(self, key: Hashable, task: asyncio.Task[Any]) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+
+OUTBOUND_LOOP = BackgroundLoop("outbound-http")
+atexit.register(OUTBOUND_LOOP.shutdown)
@@ -1,13 +1,49 @@
 import asyncio
 import logging
 import os
-from typing import Any
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Coroutine
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, TypeVar
 from urllib.parse import quote
 
 import aiohttp
+from prometheus_client import Counter as PrometheusCounter
+
+from .outbound import (
+    OUTBOUND_LOOP,
+    AsyncSingleFlight,
+    BackgroundLoop,
+    CircuitBreaker,
+    detach_deadline,
+    is_budget_timeout,
+    remaining_timeout,
+)
 
 logger = logging.getLogger(__name__)
 
+K = TypeVar("K")
+T = TypeVar("T")
+
+REMNAWAVE_POOL_SIZE = max(1, int(os.getenv("REMNAWAVE_POOL_SIZE", "32")))
+REMNAWAVE_POOL_PER_HOST = max(1, int(os.getenv("REMNAWAVE_POOL_PER_HOST", "16")))
+REMNAWAVE_KEEPALIVE_SECONDS = max(1.0, float(os.getenv("REMNAWAVE_KEEPALIVE_SECONDS", "60")))
+REMNAWAVE_TIMEOUT_SECONDS = max(0.5, float(os.getenv("REMNAWAVE_TIMEOUT_SECONDS", "10")))
+REMNAWAVE_CACHE_TTL_SECONDS = max(0.0, float(os.getenv("REMNAWAVE_CACHE_TTL_SECONDS", "300")))
+REMNAWAVE_CACHE_NEGATIVE_TTL_SECONDS = max(0.0, float(os.getenv("REMNAWAVE_CACHE_NEGATIVE_TTL_SECONDS", "60")))
+REMNAWAVE_CACHE_MAX_ENTRIES = max(0, int(os.getenv("REMNAWAVE_CACHE_MAX_ENTRIES", "4096")))
+REMNAWAVE_CACHE_SOFT_TTL_SECONDS = max(0.0, float(os.getenv("REMNAWAVE_CACHE_SOFT_TTL_SECONDS", "60")))
+REMNAWAVE_CACHE_MAX_STALE_SECONDS = max(0.0, float(os.getenv("REMNAWAVE_CACHE_MAX_STALE_SECONDS", "86400")))
+REMNAWAVE_BREAKER_FAILURE_THRESHOLD = max(1, int(os.getenv("REMNAWAVE_BREAKER_FAILURE_THRESHOLD", "5")))
+REMNAWAVE_BREAKER_RESET_SECONDS = max(1.0, float(os.getenv("REMNAWAVE_BREAKER_RESET_SECONDS", "30")))
+REMNAWAVE_BATCH_CONCURRENCY = max(1, int(os.getenv("REMNAWAVE_BATCH_CONCURRENCY", "16")))
+REMNAWAVE_BATCH_DEADLINE_SECONDS = max(0.1, float(os.getenv("REMNAWAVE_BATCH_DEADLINE_SECONDS", "3")))
+REMNAWAVE_SYNC_PAGE_SIZE = max(1, int(os.getenv("REMNAWAVE_SYNC_PAGE_SIZE", "500")))
+REMNAWAVE_SYNC_CONCURRENCY = max(1, int(os.getenv("REMNAWAVE_SYNC_CONCURRENCY", "4")))
+
 
 def _first_non_empty(*values: Any) -> str:
     for value in values:
@@ -115,61 +151,109 @@ def _collect_nested_dicts(payload: Any) -> list[dict[str, Any]]:
     return telegram_candidates + regular_candidates
 
 
-def normalize_remnawave_user(payload: Any) -> dict[str, Any] | None:
-    user = _pick_first_user(payload)
-    if user is None:
-        return None
+_EMAIL_KEYS = ("email",)
+_TELEGRAM_ID_KEYS = ("telegramId", "telegram_id", "telegramID", "telegramUserId", "telegram_user_id", "tgId", "tg_id")
+_TELEGRAM_USERNAME_KEYS = (
+    "telegramUsername",
+    "telegram_username",
+    "telegramLogin",
+    "telegram_login",
+    "telegramNick",
+    "telegram_nick",
+    "username",
+    "login",
+)
+_PHOTO_KEYS = (
+    "telegramPhotoUrl",
+    "telegram_photo_url",
+    "telegramAvatarUrl",
+    "telegram_avatar_url",
+    "telegramUserpic",
+    "telegram_userpic",
+    "photoUrl",
+    "photo_url",
+    "avatarUrl",
+    "avatar_url",
+    "userpicUrl",
+    "userpic_url",
+    "avatar",
+    "photo",
+    "userpic",
+    "imageUrl",
+    "image_url",
+    "profilePhotoUrl",
+    "profile_photo_url",
+)
+_SUBSCRIPTION_URL_KEYS = ("subscriptionUrl", "subscription_url", "url")
+
+# Nested objects of the current Remnawave user schema (traffic, nodes, squads, Happ links).
+# None of them carries identity fields, so the generic DFS would never pick a value from them.
+_OPAQUE_REMNAWAVE_KEYS = frozenset(
+    {
+        "activeInternalSquads",
+        "activeUserInbounds",
+        "happ",
+        "lastConnectedNode",
+        "userTraffic",
+    }
+)
 
-    candidates = _collect_nested_dicts(user)
+REMNAWAVE_NORMALIZE_FALLBACKS = PrometheusCounter(
+    "remnawave_normalize_fallback_total",
+    "Remnawave user payloads normalized with the generic nested-dict search.",
+    ["reason"],
+)
 
-    email = _find_first_non_empty(candidates, ("email",)).lower()
 
-    telegram_id = _find_first_optional_int(
-        candidates,
-        ("telegramId", "telegram_id", "telegramID", "telegramUserId", "telegram_user_id", "tgId", "tg_id"),
-    )
+@dataclass(frozen=True, slots=True)
+class _RemnawaveUserPlan:
+    """Extraction plan compiled for one top-level key layout of a Remnawave user object."""
+
+    email_keys: tuple[str, ...]
+    telegram_id_keys: tuple[str, ...]
+    telegram_username_keys: tuple[str, ...]
+    photo_keys: tuple[str, ...]
+    subscription_url_keys: tuple[str, ...]
+    # Keys that must not hold nested containers for the plan to give the generic result.
+    plain_keys: tuple[str, ...]
+
+
+_PLAN_CACHE_MAX_SIZE = 64
+_plan_cache: dict[tuple[str, ...], _RemnawaveUserPlan] = {}
 
-    telegram_username = _find_first_non_empty(
-        candidates,
-        (
-            "telegramUsername",
-            "telegram_username",
-            "telegramLogin",
-            "telegram_login",
-            "telegramNick",
-            "telegram_nick",
-            "username",
-            "login",
-        ),
-    )
 
-    photo = _find_first_non_empty(
-        candidates,
-        (
-            "telegramPhotoUrl",
-            "telegram_photo_url",
-            "telegramAvatarUrl",
-            "telegram_avatar_url",
-            "telegramUserpic",
-            "telegram_userpic",
-            "photoUrl",
-            "photo_url",
-            "avatarUrl",
-            "avatar_url",
-            "userpicUrl",
-            "userpic_url",
-            "avatar",
-            "photo",
-            "userpic",
-            "imageUrl",
-            "image_url",
-            "profilePhotoUrl",
-            "profile_photo_url",
-        ),
+def _compile_plan(key_layout: tuple[str, ...]) -> _RemnawaveUserPlan:
+    present = set(key_layout)
+
+    def _present(keys: tuple[str, ...]) -> tuple[str, ...]:
+        return tuple(key for key in keys if key in present)
+
+    return _RemnawaveUserPlan(
+        email_keys=_present(_EMAIL_KEYS),
+        telegram_id_keys=_present(_TELEGRAM_ID_KEYS),
+        telegram_username_keys=_present(_TELEGRAM_USERNAME_KEYS),
+        photo_keys=_present(_PHOTO_KEYS),
+        subscription_url_keys=_present(_SUBSCRIPTION_URL_KEYS),
+        plain_keys=tuple(key for key in key_layout if key not in _OPAQUE_REMNAWAVE_KEYS),
     )
 
-    subscription_url = _find_first_non_empty(candidates, ("subscriptionUrl", "subscription_url", "url"))
 
+def _plan_for(user: dict[str, Any]) -> _RemnawaveUserPlan:
+    key_layout = tuple(user)
+    plan = _plan_cache.get(key_layout)
+    if plan is None:
+        if len(_plan_cache) >= _PLAN_CACHE_MAX_SIZE:
+            _plan_cache.clear()
+        plan = _plan_cache[key_layout] = _compile_plan(key_layout)
+    return plan
+
+
+def _build_normalized_user(candidates: list[dict[str, Any]], user: dict[str, Any], plan: _RemnawaveUserPlan) -> dict[str, Any]:
+    email = _find_first_non_empty(candidates, plan.email_keys).lower()
+    telegram_id = _find_first_optional_int(candidates, plan.telegram_id_keys)
+    telegram_username = _find_first_non_empty(candidates, plan.telegram_username_keys)
+    photo = _find_first_non_empty(candidates, plan.photo_keys)
+    subscription_url = _find_first_non_empty(candidates, plan.subscription_url_keys)
     return {
         "email": email or None,
         "telegram_id": telegram_id,
@@ -180,7 +264,223 @@ def normalize_remnawave_user(payload: Any) -> dict[str, Any] | None:
     }
 
 
-async def _fetch_remnawave_user(path: str, lookup_label: str, lookup_value: str | int) -> dict[str, Any] | None:
+_GENERIC_PLAN = _RemnawaveUserPlan(
+    email_keys=_EMAIL_KEYS,
+    telegram_id_keys=_TELEGRAM_ID_KEYS,
+    telegram_username_keys=_TELEGRAM_USERNAME_KEYS,
+    photo_keys=_PHOTO_KEYS,
+    subscription_url_keys=_SUBSCRIPTION_URL_KEYS,
+    plain_keys=(),
+)
+
+
+def _normalize_remnawave_user_generic(user: dict[str, Any]) -> dict[str, Any]:
+    return _build_normalized_user(_collect_nested_dicts(user), user, _GENERIC_PLAN)
+
+
+def _normalize_remnawave_user_fast(user: dict[str, Any]) -> dict[str, Any] | None:
+    """Read fields straight from the top-level object; None when the payload is not of the known shape.
+
+    When nested containers only sit under the opaque schema keys, the top-level object is the first
+    candidate of the generic search and nothing below it can match, so both paths agree.
+    """
+    plan = _plan_for(user)
+    for key in plan.plain_keys:
+        if isinstance(user[key], (dict, list)):
+            return None
+    return _build_normalized_user([user], user, plan)
+
+
+def normalize_remnawave_user(payload: Any) -> dict[str, Any] | None:
+    user = _pick_first_user(payload)
+    if user is None:
+        return None
+
+    normalized = _normalize_remnawave_user_fast(user)
+    if normalized is None:
+        REMNAWAVE_NORMALIZE_FALLBACKS.labels(reason="unknown_shape").inc()
+        normalized = _normalize_remnawave_user_generic(user)
+    return normalized
+
+
+class RemnawaveClient:
+    """Keep-alive connection pool to Remnawave shared by every caller in the worker process."""
+
+    def __init__(self, background_loop: BackgroundLoop) -> None:
+        self._background_loop = background_loop
+        self._session: aiohttp.ClientSession | None = None
+        self._session_loop: asyncio.AbstractEventLoop | None = None
+        background_loop.add_shutdown_callback(self.close)
+
+    async def session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=REMNAWAVE_POOL_SIZE,
+                limit_per_host=REMNAWAVE_POOL_PER_HOST,
+                keepalive_timeout=REMNAWAVE_KEEPALIVE_SECONDS,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=REMNAWAVE_TIMEOUT_SECONDS),
+                # Remnawave auth cookies are passed per request; never keep server-set cookies between lookups.
+                cookie_jar=aiohttp.DummyCookieJar(),
+                version=aiohttp.HttpVersion11,
+            )
+            self._session_loop = loop
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._session_loop = None
+
+    def run_sync(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        return self._background_loop.run_sync(coroutine)
+
+    def submit(self, coroutine: Coroutine[Any, Any, T]) -> Future[T]:
+        return self._background_loop.submit(coroutine)
+
+    async def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        return await self._background_loop.run(coroutine)
+
+
+REMNAWAVE_CLIENT = RemnawaveClient(OUTBOUND_LOOP)
+
+
+@dataclass(slots=True)
+class _CacheEntry:
+    user: dict[str, Any] | None
+    stored_at: float
+    expires_at: float
+
+
+class RemnawaveLookupCache:
+    """Per-process LRU cache of lookups keyed by normalized email or Telegram ID.
+
+    Found users live for ``ttl`` seconds, definitive "not found" answers for ``negative_ttl``.
+    Transport errors are never cached; expired entries remain available through ``get_stale``.
+    """
+
+    def __init__(
+        self,
+        *,
+        ttl: float,
+        negative_ttl: float,
+        max_entries: int,
+        soft_ttl: float | None = None,
+        max_stale: float = float("inf"),
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.soft_ttl = min(ttl, negative_ttl) if soft_ttl is None else soft_ttl
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple[str, str], _CacheEntry] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple[str, str]) -> tuple[bool, dict[str, Any] | None]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            if entry.expires_at <= self._clock():
+                # Expired entries stay until evicted so they can still be served while Remnawave is down.
+                return False, None
+            self._entries.move_to_end(key)
+            return True, entry.user
+
+    def peek(self, key: tuple[str, str]) -> tuple[bool, dict[str, Any] | None, bool]:
+        """Return (hit, user, needs_refresh) for stale-while-revalidate readers.
+
+        Entries older than ``soft_ttl`` (or past their hard TTL) are still returned, flagged for refresh,
+        until they are ``max_stale`` seconds old.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None, False
+            now = self._clock()
+            if now - entry.stored_at > self.max_stale:
+                return False, None, False
+            self._entries.move_to_end(key)
+            return True, entry.user, now - entry.stored_at >= self.soft_ttl or entry.expires_at <= now
+
+    def age(self, key: tuple[str, str]) -> float | None:
+        """Seconds since ``key`` was stored, or None if it is not cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else self._clock() - entry.stored_at
+
+    def get_stale(self, key: tuple[str, str]) -> tuple[bool, dict[str, Any] | None]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            return True, entry.user
+
+    def set(self, key: tuple[str, str], user: dict[str, Any] | None) -> None:
+        ttl = self.ttl if user is not None else self.negative_ttl
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            now = self._clock()
+            self._entries[key] = _CacheEntry(user=user, stored_at=now, expires_at=now + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, keys: list[tuple[str, str]]) -> None:
+        with self._lock:
+            pending = list(keys)
+            while pending:
+                entry = self._entries.pop(pending.pop(), None)
+                if entry is None or entry.user is None:
+                    continue
+                # The same Remnawave user may also be cached under its other key.
+                cached_email = str(entry.user.get("email") or "").strip().lower()
+                if cached_email:
+                    pending.append(("email", cached_email))
+                if entry.user.get("telegram_id") is not None:
+                    pending.append(("telegram_id", str(entry.user["telegram_id"])))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# A lookup every caller gave up on (e.g. a cancelled speculative one) stops instead of finishing for the cache.
+REMNAWAVE_INFLIGHT = AsyncSingleFlight(cancel_when_abandoned=True)
+REMNAWAVE_BREAKER = CircuitBreaker(
+    "remnawave",
+    failure_threshold=REMNAWAVE_BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=REMNAWAVE_BREAKER_RESET_SECONDS,
+)
+REMNAWAVE_CACHE = RemnawaveLookupCache(
+    ttl=REMNAWAVE_CACHE_TTL_SECONDS,
+    negative_ttl=REMNAWAVE_CACHE_NEGATIVE_TTL_SECONDS,
+    max_entries=REMNAWAVE_CACHE_MAX_ENTRIES,
+    soft_ttl=REMNAWAVE_CACHE_SOFT_TTL_SECONDS,
+    max_stale=REMNAWAVE_CACHE_MAX_STALE_SECONDS,
+)
+
+
+@dataclass(frozen=True, slots=True)
+class _RemnawaveRequestConfig:
+    base_url: str
+    headers: dict[str, str]
+    cookies: dict[str, str]
+    verify_ssl: bool
+
+
+def _remnawave_request_config() -> _RemnawaveRequestConfig | None:
     base_url = str(os.getenv("REMNAWAVE_BASE_URL", "")).rstrip("/")
     token = str(os.getenv("REMNAWAVE_TOKEN", "")).strip()
     raw_cookie = str(os.getenv("REMNAWAVE_COOKIE", "")).strip()
@@ -190,63 +490,324 @@ async def _fetch_remnawave_user(path: str, lookup_label: str, lookup_value: str
         logger.warning("REMNAWAVE_BASE_URL, REMNAWAVE_TOKEN, or REMNAWAVE_COOKIE not configured")
         return None
 
-    headers = {"Authorization": f"Bearer {token}"}
     cookies = _extract_cookie_map(raw_cookie)
     if not cookies:
         logger.warning("REMNAWAVE_COOKIE is malformed")
         return None
 
-    url = f"{base_url}{path}"
+    return _RemnawaveRequestConfig(
+        base_url=base_url,
+        headers={"Authorization": f"Bearer {token}"},
+        cookies=cookies,
+        verify_ssl=verify_ssl,
+    )
+
+
+async def _fetch_remnawave_user(
+    path: str,
+    lookup_label: str,
+    lookup_value: str | int,
+) -> tuple[dict[str, Any] | None, bool]:
+    """Return the normalized user and whether the answer is definitive (found or 404) and may be cached."""
+    config = _remnawave_request_config()
+    if config is None:
+        return None, False
+
+    timeout = remaining_timeout(REMNAWAVE_TIMEOUT_SECONDS)
+    if timeout is None:
+        logger.warning("Request deadline spent, skipping Remnawave lookup for %s=%s", lookup_label, lookup_value)
+        return None, False
+    if not REMNAWAVE_BREAKER.allow_request():
+        return None, False
+
+    url = f"{config.base_url}{path}"
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, cookies=cookies, ssl=verify_ssl) as response:
-                if response.status == 404:
-                    logger.info("Remnawave user not found for %s=%s", lookup_label, lookup_value)
-                    return None
-                if response.status != 200:
-                    logger.warning(
-                        "Remnawave returned status %s for %s=%s",
-                        response.status,
-                        lookup_label,
-                        lookup_value,
-                    )
-                    return None
-
-                data = await response.json()
-                return normalize_remnawave_user(data.get("response"))
+        session = await REMNAWAVE_CLIENT.session()
+        async with session.get(
+            url,
+            headers=config.headers,
+            cookies=config.cookies,
+            ssl=config.verify_ssl,
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as response:
+            if response.status == 404:
+                REMNAWAVE_BREAKER.record_success()
+                logger.info("Remnawave user not found for %s=%s", lookup_label, lookup_value)
+                return None, True
+            if response.status != 200:
+                REMNAWAVE_BREAKER.record_failure()
+                logger.warning(
+                    "Remnawave returned status %s for %s=%s",
+                    response.status,
+                    lookup_label,
+                    lookup_value,
+                )
+                return None, False
+
+            data = await response.json()
+            REMNAWAVE_BREAKER.record_success()
+            return normalize_remnawave_user(data.get("response")), True
     except Exception as exc:
+        if is_budget_timeout(exc, timeout, REMNAWAVE_TIMEOUT_SECONDS):
+            logger.warning("Request deadline ran out during Remnawave lookup for %s=%s", lookup_label, lookup_value)
+            return None, False
+        REMNAWAVE_BREAKER.record_failure()
         logger.error("Error fetching Remnawave user for %s=%s: %s", lookup_label, lookup_value, exc)
-        return None
+        return None, False
 
 
-async def get_user_by_telegram_id(telegram_id: int) -> dict[str, Any] | None:
-    return await _fetch_remnawave_user(
-        f"/api/users/by-telegram-id/{telegram_id}",
-        "telegram_id",
-        telegram_id,
-    )
+@dataclass(frozen=True, slots=True)
+class _RemnawaveLookup:
+    cache_key: tuple[str, str]
+    path: str
+    label: str
+    value: str | int
 
 
-async def get_user_by_email(email: str) -> dict[str, Any] | None:
+def _email_lookup(email: str) -> _RemnawaveLookup:
     normalized_email = email.strip().lower()
-    return await _fetch_remnawave_user(
-        f"/api/users/by-email/{quote(normalized_email, safe='')}",
-        "email",
-        normalized_email,
+    return _RemnawaveLookup(
+        cache_key=("email", normalized_email),
+        path=f"/api/users/by-email/{quote(normalized_email, safe='')}",
+        label="email",
+        value=normalized_email,
     )
 
 
-def get_remnawave_user_sync(*, email: str | None = None, telegram_id: int | None = None) -> dict[str, Any] | None:
-    if email:
-        coroutine = get_user_by_email(email)
-    elif telegram_id is not None:
-        coroutine = get_user_by_telegram_id(telegram_id)
+def _telegram_lookup(telegram_id: int) -> _RemnawaveLookup:
+    return _RemnawaveLookup(
+        cache_key=("telegram_id", str(telegram_id)),
+        path=f"/api/users/by-telegram-id/{telegram_id}",
+        label="telegram_id",
+        value=telegram_id,
+    )
+
+
+async def _fetch_and_cache(lookup: _RemnawaveLookup) -> dict[str, Any] | None:
+    user, definitive = await _fetch_remnawave_user(lookup.path, lookup.label, lookup.value)
+    if definitive:
+        REMNAWAVE_CACHE.set(lookup.cache_key, user)
+        return user
+    # Remnawave is failing, the circuit is open or the deadline is spent: degrade to the last known answer.
+    _, stale_user = REMNAWAVE_CACHE.get_stale(lookup.cache_key)
+    return stale_user
+
+
+async def _resolve_lookup(lookup: _RemnawaveLookup) -> dict[str, Any] | None:
+    hit, cached_user = REMNAWAVE_CACHE.get(lookup.cache_key)
+    if hit:
+        return cached_user
+    # Sync and async callers all end up here on the client loop, so one in-flight request serves them all.
+    return await REMNAWAVE_INFLIGHT.do(lookup.cache_key, lambda: _fetch_and_cache(lookup))
+
+
+async def _refresh_lookup(lookup: _RemnawaveLookup) -> None:
+    # Background refreshes outlive the request that triggered them and must not inherit its deadline.
+    detach_deadline()
+    await REMNAWAVE_INFLIGHT.do(lookup.cache_key, lambda: _fetch_and_cache(lookup))
+
+
+def _schedule_refresh(lookup: _RemnawaveLookup) -> None:
+    REMNAWAVE_CLIENT.submit(_refresh_lookup(lookup))
+
+
+def _peek_lookup(lookup: _RemnawaveLookup) -> tuple[bool, dict[str, Any] | None]:
+    hit, cached_user, needs_refresh = REMNAWAVE_CACHE.peek(lookup.cache_key)
+    if hit and needs_refresh:
+        _schedule_refresh(lookup)
+    return hit, cached_user
+
+
+async def _run_lookup(lookup: _RemnawaveLookup, *, stale_while_revalidate: bool = False) -> dict[str, Any] | None:
+    if stale_while_revalidate:
+        hit, cached_user = _peek_lookup(lookup)
     else:
+        hit, cached_user = REMNAWAVE_CACHE.get(lookup.cache_key)
+    if hit:
+        return cached_user
+    return await REMNAWAVE_CLIENT.run(_resolve_lookup(lookup))
+
+
+async def get_user_by_telegram_id(telegram_id: int, *, stale_while_revalidate: bool = False) -> dict[str, Any] | None:
+    return await _run_lookup(_telegram_lookup(telegram_id), stale_while_revalidate=stale_while_revalidate)
+
+
+async def get_user_by_email(email: str, *, stale_while_revalidate: bool = False) -> dict[str, Any] | None:
+    return await _run_lookup(_email_lookup(email), stale_while_revalidate=stale_while_revalidate)
+
+
+def _lookup_for(*, email: str | None, telegram_id: int | None) -> _RemnawaveLookup | None:
+    if email:
+        return _email_lookup(email)
+    if telegram_id is not None:
+        return _telegram_lookup(telegram_id)
+    return None
+
+
+def get_remnawave_user_sync(
+    *,
+    email: str | None = None,
+    telegram_id: int | None = None,
+    stale_while_revalidate: bool = False,
+) -> dict[str, Any] | None:
+    """Look up a user by email (preferred) or Telegram ID.
+
+    With ``stale_while_revalidate`` any known answer is returned immediately and refreshed in the
+    background once it is older than the soft TTL; only a complete miss blocks on Remnawave.
+    """
+    lookup = _lookup_for(email=email, telegram_id=telegram_id)
+    if lookup is None:
         return None
 
-    loop = asyncio.new_event_loop()
+    if stale_while_revalidate:
+        hit, cached_user = _peek_lookup(lookup)
+    else:
+        hit, cached_user = REMNAWAVE_CACHE.get(lookup.cache_key)
+    if hit:
+        return cached_user
+    return REMNAWAVE_CLIENT.run_sync(_resolve_lookup(lookup))
+
+
+def has_cached_remnawave_user(*, email: str | None = None, telegram_id: int | None = None) -> bool:
+    lookup = _lookup_for(email=email, telegram_id=telegram_id)
+    return lookup is not None and REMNAWAVE_CACHE.peek(lookup.cache_key)[0]
+
+
+def refresh_remnawave_user(*, email: str | None = None, telegram_id: int | None = None) -> None:
+    """Warm the cache for a user in the background without waiting for Remnawave."""
+    lookup = _lookup_for(email=email, telegram_id=telegram_id)
+    if lookup is not None:
+        _schedule_refresh(lookup)
+
+
+async def _gather_bounded(
+    coroutines: dict[K, Coroutine[Any, Any, T]],
+    *,
+    concurrency: int,
+    deadline_seconds: float,
+) -> dict[K, T]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _limited(coroutine: Coroutine[Any, Any, T]) -> T:
+        async with semaphore:
+            return await coroutine
+
+    tasks = {key: asyncio.ensure_future(_limited(coroutine)) for key, coroutine in coroutines.items()}
+    if not tasks:
+        return {}
+    _, pending = await asyncio.wait(tasks.values(), timeout=deadline_seconds)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning("Remnawave batch deadline hit: %s of %s lookups unfinished", len(pending), len(tasks))
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    results: dict[K, T] = {}
+    for key, task in tasks.items():
+        if task.cancelled():
+            continue
+        if task.exception() is not None:
+            logger.error("Remnawave batch lookup failed for %s: %s", key, task.exception())
+            continue
+        results[key] = task.result()
+    return results
+
+
+def gather_remnawave_lookups_sync(
+    coroutines: dict[K, Coroutine[Any, Any, T]],
+    *,
+    concurrency: int = REMNAWAVE_BATCH_CONCURRENCY,
+    deadline_seconds: float = REMNAWAVE_BATCH_DEADLINE_SECONDS,
+) -> dict[K, T]:
+    """Run lookups concurrently on the client loop; keys that miss the deadline or fail are left out."""
+    return REMNAWAVE_CLIENT.run_sync(
+        _gather_bounded(coroutines, concurrency=max(1, concurrency), deadline_seconds=deadline_seconds)
+    )
+
+
+def prime_remnawave_user(user: dict[str, Any]) -> None:
+    """Store a user pushed by Remnawave under its email and Telegram ID keys."""
+    if user.get("email"):
+        REMNAWAVE_CACHE.set(_email_lookup(str(user["email"])).cache_key, user)
+    if user.get("telegram_id") is not None:
+        REMNAWAVE_CACHE.set(_telegram_lookup(int(user["telegram_id"])).cache_key, user)
+
+
+def remnawave_cache_keys(*, email: str | None = None, telegram_id: int | None = None) -> list[tuple[str, str]]:
+    keys: list[tuple[str, str]] = []
+    if email:
+        keys.append(_email_lookup(email).cache_key)
+    if telegram_id is not None:
+        keys.append(_telegram_lookup(telegram_id).cache_key)
+    return keys
+
+
+def invalidate_remnawave_user(*, email: str | None = None, telegram_id: int | None = None) -> None:
+    """Drop cached lookups for a user whose email/Telegram binding has just changed."""
+    REMNAWAVE_CACHE.invalidate(remnawave_cache_keys(email=email, telegram_id=telegram_id))
+
+
+async def _fetch_remnawave_users_page(
+    config: _RemnawaveRequestConfig,
+    *,
+    start: int,
+    size: int,
+) -> tuple[list[dict[str, Any]], int] | None:
+    url = f"{config.base_url}/api/users"
     try:
-        asyncio.set_event_loop(loop)
-        return loop.run_until_complete(coroutine)
-    finally:
-        loop.close()
+        session = await REMNAWAVE_CLIENT.session()
+        async with session.get(
+            url,
+            params={"start": str(start), "size": str(size)},
+            headers=config.headers,
+            cookies=config.cookies,
+            ssl=config.verify_ssl,
+        ) as response:
+            if response.status != 200:
+                logger.warning("Remnawave returned status %s for users page start=%s", response.status, start)
+                return None
+            data = await response.json()
+    except Exception as exc:
+        logger.error("Error fetching Remnawave users page start=%s: %s", start, exc)
+        return None
+
+    body = data.get("response") if isinstance(data, dict) else None
+    raw_users = body.get("users") if isinstance(body, dict) else None
+    if not isinstance(raw_users, list):
+        logger.warning("Remnawave users page start=%s has unexpected shape", start)
+        return None
+    total = _parse_optional_int(body.get("total"))
+    return [user for user in raw_users if isinstance(user, dict)], total if total is not None else len(raw_users)
+
+
+async def _fetch_all_remnawave_users(page_size: int, concurrency: int) -> list[dict[str, Any]] | None:
+    config = _remnawave_request_config()
+    if config is None:
+        return None
+
+    first_page = await _fetch_remnawave_users_page(config, start=0, size=page_size)
+    if first_page is None:
+        return None
+    users, total = first_page
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _fetch_page(start: int) -> tuple[list[dict[str, Any]], int] | None:
+        async with semaphore:
+            return await _fetch_remnawave_users_page(config, start=start, size=page_size)
+
+    pages = await asyncio.gather(*(_fetch_page(start) for start in range(page_size, total, page_size)))
+    for page in pages:
+        if page is None:
+            return None
+        users.extend(page[0])
+    return users
+
+
+def fetch_all_remnawave_users_sync(
+    *,
+    page_size: int = REMNAWAVE_SYNC_PAGE_SIZE,
+    concurrency: int = REMNAWAVE_SYNC_CONCURRENCY,
+) -> list[dict[str, Any]] | None:
+    """Fetch every raw Remnawave user page by page; None if any page failed."""
+    return REMNAWAVE_CLIENT.run_sync(_fetch_all_remnawave_users(max(1, page_size), max(1, concurrency)))
@@ -0,0 +1,281 @@
+import hashlib
+import hmac
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from typing import Any
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import RemnawaveCacheInvalidation, RemnawaveSyncState, RemnawaveUserSnapshot
+from .remnawave_client import (
+    REMNAWAVE_CACHE,
+    REMNAWAVE_CACHE_MAX_STALE_SECONDS,
+    REMNAWAVE_CACHE_NEGATIVE_TTL_SECONDS,
+    REMNAWAVE_CACHE_TTL_SECONDS,
+    REMNAWAVE_SYNC_CONCURRENCY,
+    REMNAWAVE_SYNC_PAGE_SIZE,
+    fetch_all_remnawave_users_sync,
+    normalize_remnawave_user,
+    prime_remnawave_user,
+    remnawave_cache_keys,
+)
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_UPSERT_BATCH_SIZE = 500
+REMNAWAVE_WEBHOOK_SIGNATURE_HEADER = "X-Remnawave-Signature"
+REMNAWAVE_WEBHOOK_TIMESTAMP_HEADER = "X-Remnawave-Timestamp"
+# Events sent longer ago (or further in the future) than this are rejected as replays.
+REMNAWAVE_WEBHOOK_TOLERANCE_SECONDS = max(1, int(os.getenv("REMNAWAVE_WEBHOOK_TOLERANCE_SECONDS", "300")))
+# Webhook timestamps may have one-second resolution, so entries cached within a second after one are suspect too.
+INVALIDATION_SLACK = timedelta(seconds=1)
+# Past this age the mirror may be missing users, so admin views fall back to live lookups.
+REMNAWAVE_MIRROR_MAX_AGE_SECONDS = max(60, int(os.getenv("REMNAWAVE_MIRROR_MAX_AGE_SECONDS", "1800")))
+REMNAWAVE_USER_DELETED_EVENTS = frozenset({"user.deleted"})
+SNAPSHOT_UPDATE_FIELDS = ["email", "telegram_id", "telegram_username", "photo", "subscription_url", "fetched_at"]
+
+
+@dataclass(frozen=True, slots=True)
+class RemnawaveSyncResult:
+    fetched: int
+    stored: int
+    pruned: int
+
+
+def build_remnawave_snapshot(raw_user: dict[str, Any], *, fetched_at) -> RemnawaveUserSnapshot | None:
+    normalized = normalize_remnawave_user(raw_user)
+    uuid = str(raw_user.get("uuid") or raw_user.get("shortUuid") or "").strip()
+    if normalized is None or not uuid:
+        return None
+    return RemnawaveUserSnapshot(
+        uuid=uuid[:64],
+        email=(normalized["email"] or "")[:255],
+        telegram_id=normalized["telegram_id"],
+        telegram_username=(normalized["telegram_username"] or "")[:255],
+        photo=(normalized["photo"] or "")[:2048],
+        subscription_url=(normalized["subscription_url"] or "")[:2048],
+        fetched_at=fetched_at,
+    )
+
+
+def store_remnawave_snapshots(snapshots: list[RemnawaveUserSnapshot]) -> None:
+    RemnawaveUserSnapshot.objects.bulk_create(
+        snapshots,
+        batch_size=SNAPSHOT_UPSERT_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=["uuid"],
+        update_fields=SNAPSHOT_UPDATE_FIELDS,
+    )
+
+
+def sync_remnawave_snapshots(
+    *,
+    page_size: int = REMNAWAVE_SYNC_PAGE_SIZE,
+    concurrency: int = REMNAWAVE_SYNC_CONCURRENCY,
+) -> RemnawaveSyncResult | None:
+    """Mirror every Remnawave user into RemnawaveUserSnapshot.
+
+    Rows not seen in this pass are pruned. A failed page aborts the sync before anything
+    is written, so a partial listing never deletes live users from the mirror. Users a webhook
+    changed or deleted after the listing started keep what the webhook wrote.
+    """
+    synced_at = timezone.now()
+    raw_users = fetch_all_remnawave_users_sync(page_size=page_size, concurrency=concurrency)
+    if raw_users is None:
+        logger.warning("Remnawave sync aborted: could not fetch the full user list")
+        return None
+
+    snapshots_by_uuid: dict[str, RemnawaveUserSnapshot] = {}
+    for raw_user in raw_users:
+        snapshot = build_remnawave_snapshot(raw_user, fetched_at=synced_at)
+        if snapshot is not None:
+            snapshots_by_uuid[snapshot.uuid] = snapshot
+
+    with transaction.atomic():
+        snapshots = _skip_changed_during_sync(list(snapshots_by_uuid.values()), synced_at=synced_at)
+        store_remnawave_snapshots(snapshots)
+        pruned, _ = RemnawaveUserSnapshot.objects.filter(fetched_at__lt=synced_at).delete()
+        RemnawaveSyncState.objects.update_or_create(pk=1, defaults={"synced_at": synced_at})
+        # No worker still holds a cache entry older than this, so older invalidations are moot.
+        retention = max(REMNAWAVE_CACHE_TTL_SECONDS, REMNAWAVE_CACHE_NEGATIVE_TTL_SECONDS, REMNAWAVE_CACHE_MAX_STALE_SECONDS)
+        RemnawaveCacheInvalidation.objects.filter(invalidated_at__lt=synced_at - timedelta(seconds=retention)).delete()
+
+    return RemnawaveSyncResult(fetched=len(raw_users), stored=len(snapshots), pruned=pruned)
+
+
+def is_remnawave_mirror_fresh() -> bool:
+    """Whether the last full sync is recent enough for the mirror to answer who has Remnawave access."""
+    state = RemnawaveSyncState.objects.filter(pk=1).first()
+    if state is None:
+        return False
+    return timezone.now() - state.synced_at <= timedelta(seconds=REMNAWAVE_MIRROR_MAX_AGE_SECONDS)
+
+
+def _skip_changed_during_sync(
+    snapshots: list[RemnawaveUserSnapshot],
+    *,
+    synced_at: datetime,
+) -> list[RemnawaveUserSnapshot]:
+    # The listing may predate a webhook handled meanwhile; overwriting its row would bring back old data.
+    updated_uuids = set(RemnawaveUserSnapshot.objects.filter(fetched_at__gt=synced_at).values_list("uuid", flat=True))
+    # Deleted users have no row left, only the invalidation of their cache keys.
+    invalidated_keys = set(
+        RemnawaveCacheInvalidation.objects.filter(invalidated_at__gt=synced_at).values_list("key", flat=True)
+    )
+    return [
+        snapshot
+        for snapshot in snapshots
+        if snapshot.uuid not in updated_uuids
+        and not any(
+            _cache_key_label(key) in invalidated_keys
+            for key in remnawave_cache_keys(email=snapshot.email or None, telegram_id=snapshot.telegram_id)
+        )
+    ]
+
+
+def remnawave_webhook_secret() -> str:
+    return str(os.getenv("REMNAWAVE_WEBHOOK_SECRET", "")).strip()
+
+
+def sign_remnawave_webhook(body: bytes, secret: str) -> str:
+    """HMAC-SHA256 of the raw body, as Remnawave sends it in X-Remnawave-Signature."""
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_remnawave_webhook(body: bytes, signature: str) -> bool:
+    secret = remnawave_webhook_secret()
+    if not secret or not signature:
+        return False
+    return hmac.compare_digest(sign_remnawave_webhook(body, secret), signature.strip().lower())
+
+
+def _parse_event_time(value: Any) -> datetime | None:
+    if isinstance(value, str):
+        value = value.strip()
+        if not value:
+            return None
+        if not value.isdigit():
+            parsed = parse_datetime(value)
+            if parsed is None:
+                return None
+            return parsed if timezone.is_aware(parsed) else parsed.replace(tzinfo=dt_timezone.utc)
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return None
+    seconds = float(value)
+    # Unix milliseconds; seconds will not reach this until the year 5138.
+    if seconds > 100_000_000_000:
+        seconds /= 1000
+    try:
+        return datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+def remnawave_event_sent_at(payload: dict[str, Any], timestamp_header: str = "") -> datetime | None:
+    """When Remnawave sent the event, or None if it says nothing about it.
+
+    The payload ``timestamp`` is preferred: unlike the header it is covered by the signature.
+    Unix seconds, milliseconds and ISO 8601 are accepted.
+    """
+    return _parse_event_time(payload.get("timestamp")) or _parse_event_time(timestamp_header)
+
+
+def is_replayed_remnawave_event(sent_at: datetime) -> bool:
+    age = abs((timezone.now() - sent_at).total_seconds())
+    if age > REMNAWAVE_WEBHOOK_TOLERANCE_SECONDS:
+        logger.warning("Rejected Remnawave webhook sent at %s: outside the replay window", sent_at.isoformat())
+        return True
+    return False
+
+
+def _cache_key_label(key: tuple[str, str]) -> str:
+    return f"{key[0]}:{key[1]}"
+
+
+def _event_cache_keys(previous: RemnawaveUserSnapshot | None, normalized: dict[str, Any] | None) -> list[tuple[str, str]]:
+    # The email or Telegram binding may have changed, so both the old and the new keys are affected.
+    keys: list[tuple[str, str]] = []
+    if previous is not None:
+        keys.extend(remnawave_cache_keys(email=previous.email or None, telegram_id=previous.telegram_id))
+    if normalized is not None:
+        keys.extend(remnawave_cache_keys(email=normalized["email"], telegram_id=normalized["telegram_id"]))
+    return list(dict.fromkeys(keys))
+
+
+def _record_invalidations(keys: list[tuple[str, str]], *, at: datetime) -> None:
+    RemnawaveCacheInvalidation.objects.bulk_create(
+        [RemnawaveCacheInvalidation(key=_cache_key_label(key), invalidated_at=at) for key in keys],
+        update_conflicts=True,
+        unique_fields=["key"],
+        update_fields=["invalidated_at"],
+    )
+
+
+def _is_superseded(previous: RemnawaveUserSnapshot | None, keys: list[tuple[str, str]], *, sent_at: datetime) -> bool:
+    if previous is not None and previous.fetched_at > sent_at:
+        return True
+    labels = [_cache_key_label(key) for key in keys]
+    return RemnawaveCacheInvalidation.objects.filter(key__in=labels, invalidated_at__gt=sent_at).exists()
+
+
+def discard_remnawave_entries_invalidated_elsewhere(*, email: str | None, telegram_id: int | None) -> None:
+    """Drop this worker's cached lookups for the user if a webhook changed them after they were cached.
+
+    Webhooks reach one worker; the others learn about the change from RemnawaveCacheInvalidation.
+    """
+    keys = remnawave_cache_keys(email=email, telegram_id=telegram_id)
+    ages = {key: age for key in keys if (age := REMNAWAVE_CACHE.age(key)) is not None}
+    if not ages:
+        return
+    now = timezone.now() - INVALIDATION_SLACK
+    invalidated_at = dict(
+        RemnawaveCacheInvalidation.objects.filter(key__in=[_cache_key_label(key) for key in ages]).values_list(
+            "key", "invalidated_at"
+        )
+    )
+    stale_keys = [
+        key
+        for key, age in ages.items()
+        if _cache_key_label(key) in invalidated_at and invalidated_at[_cache_key_label(key)] > now - timedelta(seconds=age)
+    ]
+    if stale_keys:
+        REMNAWAVE_CACHE.invalidate(stale_keys)
+
+
+def apply_remnawave_user_event(event: str, raw_user: dict[str, Any], *, sent_at: datetime | None = None) -> str:
+    """Apply a pushed user.* event to the mirror and the lookup caches; returns the action taken.
+
+    Events older than what the mirror already holds for the user are ignored as ``stale``.
+    """
+    uuid = str(raw_user.get("uuid") or raw_user.get("shortUuid") or "").strip()[:64]
+    if not uuid:
+        return "ignored"
+    sent_at = sent_at or timezone.now()
+    previous = RemnawaveUserSnapshot.objects.filter(uuid=uuid).first()
+    normalized = normalize_remnawave_user(raw_user)
+    keys = _event_cache_keys(previous, normalized)
+    if _is_superseded(previous, keys, sent_at=sent_at):
+        return "stale"
+
+    if event in REMNAWAVE_USER_DELETED_EVENTS:
+        with transaction.atomic():
+            RemnawaveUserSnapshot.objects.filter(uuid=uuid).delete()
+            _record_invalidations(keys, at=sent_at)
+        REMNAWAVE_CACHE.invalidate(keys)
+        return "deleted"
+
+    snapshot = build_remnawave_snapshot(raw_user, fetched_at=sent_at)
+    if snapshot is None:
+        return "ignored"
+    with transaction.atomic():
+        store_remnawave_snapshots([snapshot])
+        _record_invalidations(keys, at=sent_at)
+    REMNAWAVE_CACHE.invalidate(keys)
+    if normalized is not None:
+        prime_remnawave_user(normalized)
+    return "upserted"
@@ -3,12 +3,21 @@ import hmac
 import json
 import logging
 import os
+from dataclasses import dataclass
 from typing import Any
-from urllib.parse import urlencode
-from urllib.request import urlopen
+
+import aiohttp
+
+from .telegram_client import (
+    TELEGRAM_API_BASE,
+    TELEGRAM_CLIENT,
+    TELEGRAM_FILE_TIMEOUT_SECONDS,
+    telegram_get,
+    telegram_open,
+    telegram_method_timeout,
+)
 
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-TELEGRAM_API_BASE = "https://api.telegram.org"
 
 logger = logging.getLogger(__name__)
 
@@ -32,20 +41,22 @@ def verify_telegram_auth(data: dict) -> bool:
     return hmac.compare_digest(calculated_hash, auth_hash)
 
 
-def _telegram_api_request(method: str, params: dict[str, Any]) -> dict[str, Any] | None:
+async def atelegram_api_request(method: str, params: dict[str, Any]) -> dict[str, Any] | None:
     if not BOT_TOKEN:
         return None
 
-    query = urlencode(params)
-    url = f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}/{method}"
-    if query:
-        url = f"{url}?{query}"
-
+    fetched = await telegram_get(
+        f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}/{method}",
+        params={key: str(value) for key, value in params.items()},
+        timeout=telegram_method_timeout(method),
+        description=f"method={method}",
+    )
+    if fetched is None:
+        return None
     try:
-        with urlopen(url, timeout=10) as response:  # noqa: S310
-            payload = json.loads(response.read().decode("utf-8"))
-    except Exception as exc:
-        logger.warning("Telegram API request failed for method=%s: %s", method, exc)
+        payload = json.loads(fetched[0].decode("utf-8"))
+    except ValueError as exc:
+        logger.warning("Telegram API returned invalid JSON for method=%s: %s", method, exc)
         return None
 
     if not isinstance(payload, dict) or not payload.get("ok"):
@@ -58,32 +69,57 @@ def _telegram_api_request(method: str, params: dict[str, Any]) -> dict[str, Any]
     return None
 
 
-def get_telegram_avatar_file_url(telegram_id: int) -> str | None:
+def telegram_api_request(method: str, params: dict[str, Any]) -> dict[str, Any] | None:
+    return TELEGRAM_CLIENT.run_sync(atelegram_api_request(method, params))
+
+
+@dataclass(frozen=True, slots=True)
+class TelegramAvatarRef:
+    file_id: str
+    file_unique_id: str
+
+
+async def aget_telegram_avatar_ref(telegram_id: int) -> tuple[TelegramAvatarRef | None, bool]:
+    """Return the current profile photo of a user and whether the answer is definitive.
+
+    ``(None, True)`` means Telegram confirmed the user has no photo; ``(None, False)`` means
+    the lookup failed and any previously cached avatar is still the best answer.
+    """
     if not BOT_TOKEN:
-        return None
+        return None, False
 
-    photos_result = _telegram_api_request("getUserProfilePhotos", {"user_id": telegram_id, "limit": 1})
+    photos_result = await atelegram_api_request("getUserProfilePhotos", {"user_id": telegram_id, "limit": 1})
     if not photos_result:
-        return None
+        return None, False
 
     photos = photos_result.get("photos")
     if not isinstance(photos, list) or not photos:
-        return None
+        return None, True
 
     first_profile = photos[0]
     if not isinstance(first_profile, list) or not first_profile:
-        return None
+        return None, True
 
     # Берём самое крупное изображение из первой (актуальной) группы фото.
     largest_size = first_profile[-1]
     if not isinstance(largest_size, dict):
-        return None
+        return None, True
 
     file_id = largest_size.get("file_id")
     if not isinstance(file_id, str) or not file_id.strip():
+        return None, True
+
+    file_unique_id = largest_size.get("file_unique_id")
+    if not isinstance(file_unique_id, str) or not file_unique_id.strip():
+        file_unique_id = file_id
+    return TelegramAvatarRef(file_id=file_id, file_unique_id=file_unique_id.strip()), True
+
+
+async def aget_telegram_file_url(file_id: str) -> str | None:
+    if not BOT_TOKEN:
         return None
 
-    file_result = _telegram_api_request("getFile", {"file_id": file_id})
+    file_result = await atelegram_api_request("getFile", {"file_id": file_id})
     if not file_result:
         return None
 
@@ -94,20 +130,9 @@ def get_telegram_avatar_file_url(telegram_id: int) -> str | None:
     return f"{TELEGRAM_API_BASE}/file/bot{BOT_TOKEN}/{file_path}"
 
 
-def get_telegram_avatar_bytes(telegram_id: int) -> tuple[bytes, str] | None:
-    avatar_url = get_telegram_avatar_file_url(telegram_id)
-    if not avatar_url:
+async def aopen_telegram_file(file_id: str, description: str) -> aiohttp.ClientResponse | None:
+    """Open a file download without reading it; the caller streams the body and releases the response."""
+    file_url = await aget_telegram_file_url(file_id)
+    if not file_url:
         return None
-
-    try:
-        with urlopen(avatar_url, timeout=10) as response:  # noqa: S310
-            content = response.read()
-            content_type = response.headers.get_content_type() or "image/jpeg"
-    except Exception as exc:
-        logger.warning("Telegram avatar download failed for telegram_id=%s: %s", telegram_id, exc)
-        return None
-
-    if not content:
-        return None
-
-    return content, content_type
+    return await telegram_open(file_url, timeout=TELEGRAM_FILE_TIMEOUT_SECONDS, description=description)
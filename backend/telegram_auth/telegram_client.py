@@ -0,0 +1,198 @@
+import asyncio
+import json
+import logging
+import os
+import random
+from concurrent.futures import Future
+from typing import Any, Coroutine, TypeVar
+
+import aiohttp
+
+from .outbound import OUTBOUND_LOOP, BackgroundLoop, CircuitBreaker, is_budget_timeout, remaining_timeout
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+TELEGRAM_API_BASE = "https://api.telegram.org"
+TELEGRAM_TIMEOUT_SECONDS = max(0.5, float(os.getenv("TELEGRAM_TIMEOUT_SECONDS", "10")))
+TELEGRAM_FILE_TIMEOUT_SECONDS = max(0.5, float(os.getenv("TELEGRAM_FILE_TIMEOUT_SECONDS", "15")))
+TELEGRAM_POOL_SIZE = max(1, int(os.getenv("TELEGRAM_POOL_SIZE", "32")))
+TELEGRAM_KEEPALIVE_SECONDS = max(1.0, float(os.getenv("TELEGRAM_KEEPALIVE_SECONDS", "30")))
+TELEGRAM_MAX_RETRIES = max(0, int(os.getenv("TELEGRAM_MAX_RETRIES", "2")))
+TELEGRAM_RETRY_BACKOFF_SECONDS = max(0.0, float(os.getenv("TELEGRAM_RETRY_BACKOFF_SECONDS", "0.25")))
+TELEGRAM_MAX_RETRY_AFTER_SECONDS = max(0.0, float(os.getenv("TELEGRAM_MAX_RETRY_AFTER_SECONDS", "5")))
+
+# Lookup methods sit on the avatar request path and must answer quickly; anything else gets the default.
+TELEGRAM_METHOD_TIMEOUTS = {
+    "getUserProfilePhotos": 5.0,
+    "getFile": 5.0,
+}
+
+TELEGRAM_BREAKER = CircuitBreaker(
+    "telegram",
+    failure_threshold=max(1, int(os.getenv("TELEGRAM_BREAKER_FAILURE_THRESHOLD", "5"))),
+    reset_timeout=max(1.0, float(os.getenv("TELEGRAM_BREAKER_RESET_SECONDS", "30"))),
+)
+
+
+def telegram_method_timeout(method: str) -> float:
+    return min(TELEGRAM_METHOD_TIMEOUTS.get(method, TELEGRAM_TIMEOUT_SECONDS), TELEGRAM_TIMEOUT_SECONDS)
+
+
+class TelegramBotClient:
+    """Keep-alive connection pool to the Telegram Bot API shared by every caller in the worker process."""
+
+    def __init__(self, background_loop: BackgroundLoop) -> None:
+        self._background_loop = background_loop
+        self._session: aiohttp.ClientSession | None = None
+        self._session_loop: asyncio.AbstractEventLoop | None = None
+        background_loop.add_shutdown_callback(self.close)
+
+    async def session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=TELEGRAM_POOL_SIZE,
+                keepalive_timeout=TELEGRAM_KEEPALIVE_SECONDS,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=TELEGRAM_TIMEOUT_SECONDS),
+                cookie_jar=aiohttp.DummyCookieJar(),
+            )
+            self._session_loop = loop
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._session_loop = None
+
+    def run_sync(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        return self._background_loop.run_sync(coroutine)
+
+    def submit(self, coroutine: Coroutine[Any, Any, T]) -> Future[T]:
+        return self._background_loop.submit(coroutine)
+
+    async def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        return await self._background_loop.run(coroutine)
+
+
+TELEGRAM_CLIENT = TelegramBotClient(OUTBOUND_LOOP)
+
+
+def _retry_after_seconds(headers: Any, content: bytes) -> float | None:
+    """Read Telegram's flood-wait hint from ``parameters.retry_after`` or the Retry-After header."""
+    try:
+        payload = json.loads(content.decode("utf-8"))
+    except ValueError:
+        payload = None
+    if isinstance(payload, dict) and isinstance(payload.get("parameters"), dict):
+        retry_after = payload["parameters"].get("retry_after")
+        if isinstance(retry_after, (int, float)) and retry_after >= 0:
+            return float(retry_after)
+    try:
+        return max(0.0, float(headers.get("Retry-After", "")))
+    except ValueError:
+        return None
+
+
+def _backoff_seconds(attempt: int) -> float:
+    base = TELEGRAM_RETRY_BACKOFF_SECONDS * (2**attempt)
+    return base + random.uniform(0, base)
+
+
+async def telegram_open(
+    url: str,
+    *,
+    timeout: float,
+    description: str,
+    params: dict[str, Any] | None = None,
+) -> aiohttp.ClientResponse | None:
+    """GET ``url`` through the shared pool and return the unread 200 response, or None on any failure.
+
+    Flood waits (429 with ``retry_after``), 5xx answers and transport errors are retried up to
+    TELEGRAM_MAX_RETRIES times, but never past the request deadline. Only idempotent calls may use this.
+    ``timeout`` covers reading the body too; the caller must release the response.
+    """
+    for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+        request_timeout = remaining_timeout(timeout)
+        if request_timeout is None:
+            logger.warning("Request deadline spent, skipping Telegram %s", description)
+            return None
+        if not TELEGRAM_BREAKER.allow_request():
+            return None
+
+        try:
+            session = await TELEGRAM_CLIENT.session()
+            response = await session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=request_timeout))
+        except Exception as exc:
+            if is_budget_timeout(exc, request_timeout, timeout):
+                logger.warning("Request deadline ran out during Telegram %s", description)
+                return None
+            TELEGRAM_BREAKER.record_failure()
+            logger.warning("Telegram %s failed: %s", description, exc.__class__.__name__)
+            delay = _backoff_seconds(attempt)
+        else:
+            status = response.status
+            if status == 200:
+                TELEGRAM_BREAKER.record_success()
+                return response
+            try:
+                content = await response.read()
+            except Exception:
+                content = b""
+            finally:
+                response.release()
+            if status == 429:
+                TELEGRAM_BREAKER.record_failure()
+                retry_after = _retry_after_seconds(response.headers, content)
+                delay = _backoff_seconds(attempt) if retry_after is None else retry_after
+                if delay > TELEGRAM_MAX_RETRY_AFTER_SECONDS:
+                    logger.warning("Telegram %s throttled for %.0fs, giving up", description, delay)
+                    return None
+            elif status >= 500:
+                TELEGRAM_BREAKER.record_failure()
+                delay = _backoff_seconds(attempt)
+            else:
+                # Client errors (unknown user, expired file) mean Telegram itself is healthy.
+                TELEGRAM_BREAKER.record_success()
+                logger.warning("Telegram %s failed with status %s", description, status)
+                return None
+            logger.warning("Telegram %s failed with status %s (attempt %s)", description, status, attempt + 1)
+
+        if attempt == TELEGRAM_MAX_RETRIES:
+            break
+        budget = remaining_timeout(delay)
+        if budget is None or budget < delay:
+            logger.warning("Request deadline too close to retry Telegram %s", description)
+            break
+        await asyncio.sleep(delay)
+    return None
+
+
+async def telegram_get(
+    url: str,
+    *,
+    timeout: float,
+    description: str,
+    params: dict[str, Any] | None = None,
+) -> tuple[bytes, str] | None:
+    """Like ``telegram_open`` but read the whole body; returns (body, content type) or None."""
+    response = await telegram_open(url, timeout=timeout, description=description, params=params)
+    if response is None:
+        return None
+    try:
+        content = await response.read()
+    except Exception as exc:
+        # The body shares the request's timeout; if the deadline has passed too, the budget ran out first.
+        if not (isinstance(exc, TimeoutError) and remaining_timeout(timeout) is None):
+            TELEGRAM_BREAKER.record_failure()
+        logger.warning("Telegram %s failed while reading: %s", description, exc.__class__.__name__)
+        return None
+    finally:
+        response.release()
+    return content, response.content_type or "application/octet-stream"
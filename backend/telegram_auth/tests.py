@@ -1,12 +1,43 @@
+import asyncio
+import hashlib
+import hmac
+import json
 import os
-from unittest.mock import patch
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import call, patch
+from urllib.parse import quote
 
 from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.db import connection
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from prometheus_client import REGISTRY
 
-from telegram_auth.models import AuthIdentity, ChatMessage, ChatUserProfile
-from telegram_auth import views
+from telegram_auth.models import AuthIdentity, ChatMessage, ChatUserProfile, RemnawaveSyncState, RemnawaveUserSnapshot
+from telegram_auth import avatar_cache, avatar_prefetch, remnawave_client, remnawave_sync, services, views
+from telegram_auth.chat_broker import InProcessChatBroker, PostgresChatBroker, build_chat_broker
+from telegram_auth.chat_realtime import (
+    ChatRealtimeHub,
+    ChatWsConnection,
+    _can_receive_event,
+    _queued_frame,
+    _run_chat_operation,
+)
+from telegram_auth.outbound import OUTBOUND_LOOP, AsyncSingleFlight, CircuitBreaker, deadline_scope, remaining_timeout
+from telegram_auth.remnawave_sync import sign_remnawave_webhook
+from testing.remnawave_stub import RemnawaveStubServer, build_stub_user
 
 
 def _auth_headers(user_id: int, username: str, email: str = "") -> dict:
@@ -220,6 +251,68 @@ class ChatApiTests(TestCase):
         self.assertEqual(len(items), 1)
         self.assertEqual(items[0]["sender_username"], "FreshNick")
 
+    def test_message_events_carry_the_serialized_message(self):
+        sender_headers = _auth_headers(717, "author", "author@example.com")
+
+        with patch("telegram_auth.views.publish_chat_event") as publish:
+            created = self.client.post(
+                "/api/chat/messages/",
+                data={"scope": "global", "body": "delta"},
+                content_type="application/json",
+                **sender_headers,
+            ).json()
+            self.client.delete(f"/api/chat/messages/{created['id']}/", **sender_headers)
+
+        events = {call_args.args[0]["event"]: call_args.args[0] for call_args in publish.call_args_list}
+        created_message = events["message_created"]["message"]
+        self.assertEqual(created_message, {key: value for key, value in created.items() if key != "read_by_me"})
+        deleted_message = events["message_deleted"]["message"]
+        self.assertTrue(deleted_message["is_deleted"])
+        self.assertNotEqual(deleted_message["body"], "delta")
+
+
+class ChatWsOperationTests(TransactionTestCase):
+    # Operations run on their own threads and database connections, so they must see committed rows.
+    async def test_websocket_operations_share_the_http_rules(self):
+        await ChatUserProfile.objects.acreate(user_id=818, username="wsauthor")
+        connection = ChatWsConnection(user_id=818, is_admin=False)
+        other = ChatWsConnection(user_id=919, is_admin=False)
+
+        async def run(ws_connection, operation, **payload):
+            await _run_chat_operation(ws_connection, operation, {"request_id": operation, **payload})
+            return json.loads(ws_connection.control.popleft()[0])
+
+        frame = {"scope": "global", "body": "over the socket", "client_message_id": "ws-1"}
+        created = await run(connection, "send_message", **frame)
+        self.assertEqual((created["type"], created["request_id"], created["status"]), ("ack", "send_message", 201))
+        self.assertEqual(created["data"]["sender_username"], "wsauthor")
+        retried = await run(connection, "send_message", **frame)
+        self.assertEqual((retried["status"], retried["data"]["id"]), (200, created["data"]["id"]))
+
+        message_id = created["data"]["id"]
+        forbidden = await run(other, "edit_message", message_id=message_id, body="hijack")
+        self.assertEqual((forbidden["type"], forbidden["status"], forbidden["error"]), ("error", 403, "Forbidden"))
+        edited = await run(connection, "edit_message", message_id=message_id, body="edited")
+        self.assertEqual(edited["data"]["body"], "edited")
+        deleted = await run(connection, "delete_message", message_id=message_id)
+        self.assertTrue(deleted["data"]["is_deleted"])
+        marked = await run(connection, "mark_read", scope="private", peer_id=818)
+        self.assertEqual((marked["status"], marked["error"]), (400, "Cannot mark yourself as peer"))
+
+    async def test_websocket_operations_recycle_connections_off_the_shared_sync_thread(self):
+        threads: list[str] = []
+
+        def _recording_close_old_connections():
+            threads.append(threading.current_thread().name)
+
+        connection = ChatWsConnection(user_id=818, is_admin=False)
+        with patch("telegram_auth.chat_realtime.close_old_connections", side_effect=_recording_close_old_connections):
+            await _run_chat_operation(connection, "mark_read", {"request_id": "r1", "scope": "private", "peer_id": 818})
+
+        self.assertEqual(json.loads(connection.control.popleft()[0])["request_id"], "r1")
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith("chat-ws-operation") for name in threads))
+
 
 class AuthIdentityBindingTests(TestCase):
     @patch("telegram_auth.views._resolve_remnawave_user")
@@ -414,3 +507,1175 @@ class AuthIdentityBindingTests(TestCase):
                 provider_user_id="linked.from.tg@example.com",
             ).exists()
         )
+
+
+class RemnawaveClientTests(SimpleTestCase):
+    def setUp(self):
+        self.stub = RemnawaveStubServer([build_stub_user(1), build_stub_user(2)]).start()
+        self.addCleanup(self.stub.stop)
+        env_patch = patch.dict(os.environ, self.stub.env())
+        env_patch.start()
+        self.addCleanup(env_patch.stop)
+        remnawave_client.REMNAWAVE_CACHE.clear()
+        self.addCleanup(remnawave_client.REMNAWAVE_CACHE.clear)
+
+    def test_sync_and_async_lookups_share_one_keepalive_connection(self):
+        first = remnawave_client.get_remnawave_user_sync(email="User1@example.com")
+        second = remnawave_client.get_remnawave_user_sync(telegram_id=700000002)
+        from_other_loop = asyncio.run(remnawave_client.get_user_by_email("user2@example.com"))
+
+        self.assertEqual(first["subscription_url"], "https://sub.example.com/1")
+        self.assertEqual(second["email"], "user2@example.com")
+        self.assertEqual(from_other_loop["telegram_id"], 700000002)
+        self.assertEqual(self.stub.request_count, 3)
+        self.assertEqual(self.stub.connection_count, 1)
+
+    def test_missing_user_returns_none(self):
+        self.assertIsNone(remnawave_client.get_remnawave_user_sync(email="absent@example.com"))
+
+    def test_repeated_lookups_are_served_from_cache(self):
+        for _ in range(3):
+            self.assertEqual(remnawave_client.get_remnawave_user_sync(email="user1@example.com")["telegram_id"], 700000001)
+            self.assertIsNone(remnawave_client.get_remnawave_user_sync(email="absent@example.com"))
+        self.assertIsNotNone(asyncio.run(remnawave_client.get_user_by_email("USER1@example.com")))
+
+        self.assertEqual(self.stub.request_count, 2)
+
+    def test_invalidation_drops_both_keys_of_a_user(self):
+        remnawave_client.get_remnawave_user_sync(email="user1@example.com")
+        remnawave_client.get_remnawave_user_sync(telegram_id=700000001)
+
+        remnawave_client.invalidate_remnawave_user(email="user1@example.com")
+        remnawave_client.get_remnawave_user_sync(telegram_id=700000001)
+
+        self.assertEqual(self.stub.requests["by-telegram-id"], 2)
+
+    def test_upstream_errors_are_not_cached(self):
+        with patch.dict(os.environ, {"REMNAWAVE_TOKEN": ""}):
+            self.assertIsNone(remnawave_client.get_remnawave_user_sync(email="user1@example.com"))
+        self.assertIsNotNone(remnawave_client.get_remnawave_user_sync(email="user1@example.com"))
+
+
+class RemnawaveLookupCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = remnawave_client.RemnawaveLookupCache(
+            ttl=300,
+            negative_ttl=60,
+            max_entries=2,
+            clock=lambda: self.now,
+        )
+
+    def test_positive_and_negative_ttls(self):
+        self.cache.set(("email", "found@example.com"), {"email": "found@example.com"})
+        self.cache.set(("email", "absent@example.com"), None)
+
+        self.now += 61
+        self.assertEqual(self.cache.get(("email", "absent@example.com")), (False, None))
+        self.assertTrue(self.cache.get(("email", "found@example.com"))[0])
+
+        self.now += 240
+        self.assertEqual(self.cache.get(("email", "found@example.com")), (False, None))
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set(("email", "a@example.com"), None)
+        self.cache.set(("email", "b@example.com"), None)
+        self.cache.get(("email", "a@example.com"))
+        self.cache.set(("email", "c@example.com"), None)
+
+        self.assertTrue(self.cache.get(("email", "a@example.com"))[0])
+        self.assertFalse(self.cache.get(("email", "b@example.com"))[0])
+        self.assertEqual(len(self.cache), 2)
+
+
+class AuthMeRemnawaveCacheTests(TestCase):
+    def setUp(self):
+        self.stub = RemnawaveStubServer([build_stub_user(5)]).start()
+        self.addCleanup(self.stub.stop)
+        env_patch = patch.dict(os.environ, self.stub.env())
+        env_patch.start()
+        self.addCleanup(env_patch.stop)
+        remnawave_client.REMNAWAVE_CACHE.clear()
+        self.addCleanup(remnawave_client.REMNAWAVE_CACHE.clear)
+
+    def test_repeated_auth_me_does_not_call_remnawave_again(self):
+        user = User.objects.create_user(username="user5@example.com", email="user5@example.com", password="secret123")
+        headers = _auth_headers(user.id, "user5@example.com", "user5@example.com")
+
+        first_response = self.client.get("/api/auth/me/", **headers)
+        self.assertEqual(first_response.status_code, 200)
+        requests_after_first_call = self.stub.request_count
+        self.assertGreater(requests_after_first_call, 0)
+
+        for _ in range(3):
+            self.assertEqual(self.client.get("/api/auth/me/", **headers).status_code, 200)
+        self.assertEqual(self.stub.request_count, requests_after_first_call)
+
+    def _wait_for_requests(self, count: int) -> None:
+        deadline = time.monotonic() + 3
+        while self.stub.request_count < count and time.monotonic() < deadline:
+            time.sleep(0.02)
+
+    def test_auth_me_serves_stale_data_and_refreshes_in_background(self):
+        user = User.objects.create_user(username="user5@example.com", email="user5@example.com", password="secret123")
+        headers = _auth_headers(user.id, "user5@example.com", "user5@example.com")
+        self.client.get("/api/auth/me/", **headers)
+        self.stub.reset_stats()
+        self.stub.latency_seconds = 0.5
+
+        stale_clock = lambda: time.monotonic() + remnawave_client.REMNAWAVE_CACHE.ttl + 1  # noqa: E731
+        with patch.object(remnawave_client.REMNAWAVE_CACHE, "_clock", stale_clock):
+            started = time.perf_counter()
+            response = self.client.get("/api/auth/me/", **headers)
+            elapsed = time.perf_counter() - started
+            self._wait_for_requests(1)
+
+        self.assertEqual(response.json()["subscription_url"], "https://sub.example.com/5")
+        self.assertLess(elapsed, 0.4)
+        self.assertGreaterEqual(self.stub.request_count, 1)
+
+    def test_auth_me_falls_back_to_mirror_before_blocking(self):
+        RemnawaveUserSnapshot.objects.create(
+            uuid="snapshot-5",
+            email="user5@example.com",
+            telegram_id=700000005,
+            subscription_url="https://sub.example.com/from-mirror",
+            fetched_at=timezone.now(),
+        )
+        user = User.objects.create_user(username="user5@example.com", email="user5@example.com", password="secret123")
+        self.stub.latency_seconds = 0.5
+
+        started = time.perf_counter()
+        response = self.client.get("/api/auth/me/", **_auth_headers(user.id, "user5@example.com", "user5@example.com"))
+
+        self.assertLess(time.perf_counter() - started, 0.4)
+        self.assertEqual(response.json()["subscription_url"], "https://sub.example.com/from-mirror")
+        self._wait_for_requests(2)
+        self.assertEqual(self.stub.requests["by-email"], 1)
+        self.assertEqual(self.stub.requests["by-telegram-id"], 1)
+
+
+class RemnawaveMirrorTests(TestCase):
+    def setUp(self):
+        users = [build_stub_user(index) for index in range(1, 6)]
+        users[4]["subscriptionUrl"] = ""
+        self.stub = RemnawaveStubServer(users).start()
+        self.addCleanup(self.stub.stop)
+        env_patch = patch.dict(os.environ, {**self.stub.env(), "ADMIN": "999"})
+        env_patch.start()
+        self.addCleanup(env_patch.stop)
+        remnawave_client.REMNAWAVE_CACHE.clear()
+        self.addCleanup(remnawave_client.REMNAWAVE_CACHE.clear)
+
+    def test_sync_command_mirrors_all_pages_and_prunes_stale_rows(self):
+        RemnawaveUserSnapshot.objects.create(uuid="gone", email="gone@example.com", fetched_at=timezone.now())
+
+        call_command("sync_remnawave_users", "--page-size", "2", "--concurrency", "2", stdout=StringIO())
+
+        self.assertEqual(self.stub.requests["list"], 3)
+        self.assertFalse(RemnawaveUserSnapshot.objects.filter(uuid="gone").exists())
+        snapshot = RemnawaveUserSnapshot.objects.get(email="user3@example.com")
+        self.assertEqual(snapshot.telegram_id, 700000003)
+        self.assertEqual(snapshot.subscription_url, "https://sub.example.com/3")
+        self.assertEqual(RemnawaveUserSnapshot.objects.count(), 5)
+
+    def test_sync_keeps_webhook_changes_made_while_it_was_listing(self):
+        fetch_all = remnawave_sync.fetch_all_remnawave_users_sync
+
+        def _listing_then_webhooks(**kwargs):
+            listing = fetch_all(**kwargs)
+            rotated = build_stub_user(1)
+            rotated["subscriptionUrl"] = "https://sub.example.com/rotated"
+            remnawave_sync.apply_remnawave_user_event("user.modified", rotated, sent_at=timezone.now())
+            remnawave_sync.apply_remnawave_user_event("user.deleted", build_stub_user(2), sent_at=timezone.now())
+            return listing
+
+        with patch.object(remnawave_sync, "fetch_all_remnawave_users_sync", side_effect=_listing_then_webhooks):
+            result = remnawave_sync.sync_remnawave_snapshots(page_size=2)
+
+        self.assertEqual((result.fetched, result.stored), (5, 3))
+        snapshot = RemnawaveUserSnapshot.objects.get(email="user1@example.com")
+        self.assertEqual(snapshot.subscription_url, "https://sub.example.com/rotated")
+        self.assertFalse(RemnawaveUserSnapshot.objects.filter(email="user2@example.com").exists())
+        self.assertEqual(RemnawaveUserSnapshot.objects.count(), 4)
+
+    def test_admin_remnawave_filter_uses_mirror_without_outbound_calls(self):
+        call_command("sync_remnawave_users", "--page-size", "2", stdout=StringIO())
+        for index in (1, 2, 5):
+            User.objects.create_user(username=f"user{index}@example.com", email=f"user{index}@example.com")
+        User.objects.create_user(username="stranger@example.com", email="stranger@example.com")
+        self.stub.reset_stats()
+
+        response = self.client.get(
+            "/api/admin/users/?filter=remnawave",
+            **_auth_headers(999, "admin", "admin@example.com"),
+        )
+
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertEqual(sorted(item["email"] for item in payload["items"]), ["user1@example.com", "user2@example.com"])
+        self.assertEqual(payload["pagination"]["filtered_total"], 2)
+        self.assertEqual(payload["metrics"]["remnawave_access_users"], 2)
+        self.assertEqual(self.stub.request_count, 0)
+
+    def test_filter_flag_and_metric_share_the_match_key_and_rows(self):
+        call_command("sync_remnawave_users", "--page-size", "2", stdout=StringIO())
+        RemnawaveUserSnapshot.objects.filter(email="user4@example.com").delete()
+        User.objects.create_user(username="login-only", email="user1@example.com")
+        User.objects.create_user(username="user2@example.com", email="")
+        # The email wins over the login, in the filter as well as in the flag.
+        User.objects.create_user(username="user3@example.com", email="elsewhere@example.com")
+        User.objects.create_user(username="user4@example.com", email="user4@example.com")
+        self.stub.reset_stats()
+        headers = _auth_headers(999, "admin", "admin@example.com")
+
+        filtered = self.client.get("/api/admin/users/?filter=remnawave", **headers).json()
+        self.assertEqual(sorted(item["login"] for item in filtered["items"]), ["login-only", "user2@example.com"])
+        self.assertEqual(self.stub.request_count, 0)
+
+        listed = self.client.get("/api/admin/users/", **headers).json()
+        access = {item["login"]: item["has_remnawave_access"] for item in listed["items"]}
+        self.assertTrue(access["login-only"] and access["user2@example.com"])
+        self.assertFalse(access["user3@example.com"])
+        # A fresh mirror is authoritative: no row means no access, in the flag as in the filter.
+        self.assertFalse(access["user4@example.com"])
+        self.assertEqual(listed["metrics"]["remnawave_access_users"], sum(access.values()))
+        self.assertEqual(self.stub.request_count, 0)
+
+    def test_stale_or_unsynced_mirror_falls_back_to_live_lookups(self):
+        call_command("sync_remnawave_users", "--page-size", "2", stdout=StringIO())
+        RemnawaveUserSnapshot.objects.filter(email="user1@example.com").delete()
+        User.objects.create_user(username="user1@example.com", email="user1@example.com")
+        headers = _auth_headers(999, "admin", "admin@example.com")
+        stale = timezone.now() - timedelta(seconds=remnawave_sync.REMNAWAVE_MIRROR_MAX_AGE_SECONDS + 1)
+
+        for synced_at in (stale, None):
+            with self.subTest(synced_at=synced_at):
+                if synced_at is None:
+                    # Rows written by webhooks alone never make the mirror authoritative.
+                    RemnawaveSyncState.objects.all().delete()
+                else:
+                    RemnawaveSyncState.objects.filter(pk=1).update(synced_at=synced_at)
+                remnawave_client.REMNAWAVE_CACHE.clear()
+                self.stub.reset_stats()
+
+                payload = self.client.get("/api/admin/users/?filter=remnawave", **headers).json()
+
+                self.assertEqual([item["login"] for item in payload["items"]], ["user1@example.com"])
+                self.assertEqual(payload["metrics"]["remnawave_access_users"], 1)
+                self.assertGreater(self.stub.request_count, 0)
+
+
+class RemnawaveBatchEnrichmentTests(TestCase):
+    def setUp(self):
+        self.stub = RemnawaveStubServer(
+            [build_stub_user(index) for index in range(1, 9)],
+            latency_seconds=0.25,
+        ).start()
+        self.addCleanup(self.stub.stop)
+        env_patch = patch.dict(os.environ, {**self.stub.env(), "ADMIN": "999"})
+        env_patch.start()
+        self.addCleanup(env_patch.stop)
+        remnawave_client.REMNAWAVE_CACHE.clear()
+        self.addCleanup(remnawave_client.REMNAWAVE_CACHE.clear)
+
+    def test_admin_page_resolves_remnawave_users_concurrently(self):
+        for index in range(1, 9):
+            User.objects.create_user(username=f"user{index}@example.com", email=f"user{index}@example.com")
+
+        started = time.perf_counter()
+        response = self.client.get("/api/admin/users/", **_auth_headers(999, "admin", "admin@example.com"))
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(all(item["has_remnawave_access"] for item in response.json()["items"]))
+        # 8 users x (by-email + by-telegram-id) at 250ms each would take 4s sequentially.
+        self.assertEqual(self.stub.request_count, 16)
+        self.assertLess(elapsed, 2.0)
+
+    def test_batch_returns_partial_results_after_deadline(self):
+        async def _lookup(delay: float) -> str:
+            await asyncio.sleep(delay)
+            return f"done after {delay}"
+
+        started = time.perf_counter()
+        results = remnawave_client.gather_remnawave_lookups_sync(
+            {"fast": _lookup(0), "slow": _lookup(5)},
+            deadline_seconds=0.2,
+        )
+
+        self.assertEqual(results, {"fast": "done after 0"})
+        self.assertLess(time.perf_counter() - started, 1.0)
+
+
+class RemnawaveResolveModeTests(SimpleTestCase):
+    def setUp(self):
+        photo_user = build_stub_user(2)
+        photo_user["telegramPhotoUrl"] = "https://t.me/i/userpic/2.jpg"
+        self.stub = RemnawaveStubServer([build_stub_user(1), photo_user], latency_seconds=0.4).start()
+        self.addCleanup(self.stub.stop)
+        env_patch = patch.dict(os.environ, self.stub.env())
+        env_patch.start()
+        self.addCleanup(env_patch.stop)
+        remnawave_client.REMNAWAVE_CACHE.clear()
+        self.addCleanup(remnawave_client.REMNAWAVE_CACHE.clear)
+
+    def test_parallel_mode_runs_both_lookups_at_once(self):
+        started = time.perf_counter()
+        with patch.object(views, "REMNAWAVE_RESOLVE_MODE", "parallel"):
+            user = views._resolve_remnawave_user(email="user1@example.com", telegram_id=700000001)
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(user["subscription_url"], "https://sub.example.com/1")
+        self.assertEqual(self.stub.requests["by-email"], 1)
+        self.assertEqual(self.stub.requests["by-telegram-id"], 1)
+        self.assertLess(elapsed, 0.75)
+
+    def test_parallel_mode_matches_sequential_result(self):
+        with patch.object(views, "REMNAWAVE_RESOLVE_MODE", "parallel"):
+            parallel_user = views._resolve_remnawave_user(email="user2@example.com", telegram_id=700000002)
+        remnawave_client.REMNAWAVE_CACHE.clear()
+        with patch.object(views, "REMNAWAVE_RESOLVE_MODE", "sequential"):
+            sequential_user = views._resolve_remnawave_user(email="user2@example.com", telegram_id=700000002)
+
+        self.assertEqual(parallel_user, sequential_user)
+        self.assertEqual(parallel_user["photo"], "https://t.me/i/userpic/2.jpg")
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_remnawave_lookups_share_one_request(self):
+        remnawave_client.REMNAWAVE_CACHE.clear()
+        self.addCleanup(remnawave_client.REMNAWAVE_CACHE.clear)
+        with RemnawaveStubServer([build_stub_user(1)], latency_seconds=0.3) as stub, patch.dict(os.environ, stub.env()):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                sync_results = list(
+                    executor.map(lambda _: remnawave_client.get_remnawave_user_sync(email="user1@example.com"), range(4))
+                )
+            self.assertEqual(stub.requests["by-email"], 1)
+
+            remnawave_client.REMNAWAVE_CACHE.clear()
+            stub.reset_stats()
+
+            async def _concurrent_async_lookups():
+                return await asyncio.gather(
+                    *(remnawave_client.get_user_by_telegram_id(700000001) for _ in range(4))
+                )
+
+            async_results = asyncio.run(_concurrent_async_lookups())
+
+            self.assertEqual(stub.requests["by-telegram-id"], 1)
+        self.assertTrue(all(result["email"] == "user1@example.com" for result in sync_results + async_results))
+
+    def test_abandoned_flight_is_cancelled_after_its_last_waiter(self):
+        async def _scenario():
+            flight = AsyncSingleFlight(cancel_when_abandoned=True)
+            started = asyncio.Event()
+
+            async def _slow_lookup():
+                started.set()
+                await asyncio.sleep(10)
+
+            first = asyncio.ensure_future(flight.do("key", _slow_lookup))
+            second = asyncio.ensure_future(flight.do("key", _slow_lookup))
+            await started.wait()
+            first.cancel()
+            await asyncio.sleep(0.01)
+            # The other waiter still wants the result.
+            in_flight_for_second = flight.inflight_count()
+            second.cancel()
+            await asyncio.gather(first, second, return_exceptions=True)
+            await asyncio.sleep(0.01)
+            return in_flight_for_second, flight.inflight_count()
+
+        self.assertEqual(asyncio.run(_scenario()), (1, 0))
+
+
+class _FakeTelegramStream:
+    def __init__(self, body: bytes):
+        self._body = body
+        self._offset = 0
+
+    async def read(self, size: int) -> bytes:
+        chunk = self._body[self._offset : self._offset + size]
+        self._offset += len(chunk)
+        return chunk
+
+
+class _FakeTelegramFile:
+    content_type = "image/jpeg"
+
+    def __init__(self, body: bytes, declare_length: bool = True):
+        self.content = _FakeTelegramStream(body)
+        self.content_length = len(body) if declare_length else None
+
+    def release(self):
+        pass
+
+    def close(self):
+        pass
+
+
+async def _response_body(response) -> bytes:
+    if not getattr(response, "streaming", False):
+        return response.content
+    if response.is_async:
+        return b"".join([chunk async for chunk in response.streaming_content])
+    return b"".join(response.streaming_content)
+
+
+class TelegramAvatarCacheTests(SimpleTestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.now = [1000.0]
+        self.cache = avatar_cache.TelegramAvatarCache(ttl=60, negative_ttl=30, clock=lambda: self.now[0])
+        self.ref = services.TelegramAvatarRef(file_id="file-1", file_unique_id="unique-1")
+        self.ref_result = (self.ref, True)
+        self.downloads: list[str] = []
+        self.ref_calls = 0
+
+        def _ref(telegram_id):
+            self.ref_calls += 1
+            return self.ref_result
+
+        self.bodies: dict[str, bytes] = {}
+        self.declare_length = True
+
+        def _open(file_id, description):
+            self.downloads.append(file_id)
+            return _FakeTelegramFile(self.bodies.get(file_id, f"image-{file_id}".encode()), self.declare_length)
+
+        for patcher in (
+            patch.object(avatar_cache, "TELEGRAM_AVATAR_CACHE", self.cache),
+            patch.object(avatar_cache, "aget_telegram_avatar_ref", side_effect=_ref),
+            patch.object(avatar_cache, "aopen_telegram_file", side_effect=_open),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_view_streams_cold_avatar_then_serves_it_from_disk_with_etag(self):
+        first = await self.async_client.get("/api/auth/telegram-avatar/42/")
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(await _response_body(first), b"image-file-1")
+        self.assertNotIn("ETag", first)
+
+        second = await self.async_client.get("/api/auth/telegram-avatar/42/")
+        self.assertEqual(await _response_body(second), b"image-file-1")
+        etag = second["ETag"]
+        self.assertTrue(etag.startswith('"') and len(etag) == 66)
+
+        not_modified = await self.async_client.get("/api/auth/telegram-avatar/42/", headers={"If-None-Match": f'"other", {etag}'})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified["ETag"], etag)
+        self.assertEqual(self.downloads, ["file-1"])
+        self.assertEqual(self.ref_calls, 1)
+
+    async def test_stream_holds_one_chunk_and_enforces_the_size_limit(self):
+        self.bodies["file-1"] = bytes(range(256)) * 4
+        with patch.object(avatar_cache, "TELEGRAM_AVATAR_STREAM_CHUNK_BYTES", 100):
+            stream = await self.cache.aopen(42)
+            chunks = [chunk async for chunk in stream.chunks()]
+        self.assertEqual(b"".join(chunks), self.bodies["file-1"])
+        self.assertTrue(all(len(chunk) <= 100 for chunk in chunks))
+        self.assertEqual((await self.cache.aget(42)).path.read_bytes(), self.bodies["file-1"])
+
+        self.now[0] += 61
+        self.ref_result = (services.TelegramAvatarRef(file_id="file-2", file_unique_id="unique-2"), True)
+        self.bodies["file-2"] = b"x" * 2048
+        with patch.object(avatar_cache, "TELEGRAM_AVATAR_MAX_BYTES", 1024):
+            oversized = await self.async_client.get("/api/auth/telegram-avatar/42/")
+            self.assertEqual(await _response_body(oversized), self.bodies["file-1"])
+            self.declare_length = False
+            stream = await self.cache.aopen(42)
+            self.assertLessEqual(len(b"".join([chunk async for chunk in stream.chunks()])), 1024)
+            # The oversized photo is never cached; the previous one keeps being served.
+            self.assertEqual((await self.cache.aget(42)).path.read_bytes(), self.bodies["file-1"])
+        self.assertEqual(self.downloads, ["file-1", "file-2", "file-2", "file-2"])
+
+    async def test_cached_entries_are_read_off_the_event_loop(self):
+        await self.cache.aget(42)
+        readers: list[threading.Thread] = []
+        read_meta = self.cache._read_meta
+
+        def _recording_read_meta(telegram_id):
+            readers.append(threading.current_thread())
+            return read_meta(telegram_id)
+
+        with patch.object(self.cache, "_read_meta", side_effect=_recording_read_meta):
+            self.assertEqual((await self.cache.aopen(42)).path.read_bytes(), b"image-file-1")
+            self.now[0] += 61
+            await self.cache.aget(42)
+
+        self.assertGreaterEqual(len(readers), 3)
+        self.assertNotIn(threading.current_thread(), readers)
+        self.assertNotIn(OUTBOUND_LOOP._thread, readers)
+
+    async def test_revalidation_downloads_only_changed_photos(self):
+        first = await self.cache.aget(42)
+
+        self.now[0] += 61
+        self.assertEqual(await self.cache.aget(42), first)
+        self.assertEqual((self.ref_calls, self.downloads), (2, ["file-1"]))
+
+        self.now[0] += 61
+        self.ref_result = (services.TelegramAvatarRef(file_id="file-2", file_unique_id="unique-2"), True)
+        second = await self.cache.aget(42)
+        self.assertEqual(second.path.read_bytes(), b"image-file-2")
+        self.assertNotEqual(second.etag, first.etag)
+        self.assertFalse(first.path.exists())
+
+        self.now[0] += 61
+        self.ref_result = (None, False)
+        self.assertEqual(await self.cache.aget(42), second)
+
+    async def test_users_without_photo_are_negatively_cached(self):
+        self.ref_result = (None, True)
+        self.assertEqual((await self.async_client.get("/api/auth/telegram-avatar/42/")).status_code, 404)
+        self.assertIsNone(await self.cache.aget(42))
+        self.assertEqual(self.ref_calls, 1)
+
+        self.now[0] += 31
+        self.ref_result = (self.ref, True)
+        self.assertEqual((await self.cache.aget(42)).path.read_bytes(), b"image-file-1")
+        self.assertEqual(self.ref_calls, 2)
+
+
+class TelegramAvatarPrefetchTests(TestCase):
+    def test_profile_upsert_enqueues_new_and_changed_telegram_avatars(self):
+        with patch.object(views, "enqueue_avatar_prefetch") as enqueue:
+            for photo in ("https://t.me/a.jpg", "https://t.me/a.jpg", "https://t.me/b.jpg"):
+                with self.captureOnCommitCallbacks(execute=True):
+                    views._upsert_chat_profile(user_id=1, username="alice", telegram_id=4242, photo=photo)
+            with self.captureOnCommitCallbacks(execute=True):
+                views._upsert_chat_profile(user_id=2, username="bob", email="bob@example.com")
+
+        self.assertEqual(enqueue.call_args_list, [call(4242), call(4242)])
+
+    def test_queue_deduplicates_and_bounds_concurrency(self):
+        active = [0]
+        peak = [0]
+        refreshed: list[int] = []
+
+        async def _refresh(telegram_id):
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            await asyncio.sleep(0.02)
+            refreshed.append(telegram_id)
+            active[0] -= 1
+
+        queue = avatar_prefetch.AvatarPrefetchQueue(OUTBOUND_LOOP, concurrency=2, max_pending=5)
+        with patch.object(avatar_prefetch.TELEGRAM_AVATAR_CACHE, "arefresh", side_effect=_refresh):
+            accepted = [queue.enqueue(telegram_id) for telegram_id in (1, 2, 1, 3, 4, 5, 6)]
+            self.assertTrue(queue.wait_idle(timeout=5))
+
+        self.assertEqual(accepted, [True, True, False, True, True, True, False])
+        self.assertEqual(sorted(refreshed), [1, 2, 3, 4, 5])
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(queue.pending_count(), 0)
+        self.assertEqual(REGISTRY.get_sample_value("telegram_avatar_prefetch_queue_depth"), 0)
+
+
+class _TelegramStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.client_address[1]))
+        status, payload = self.server.answers.pop(0)
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TelegramClientTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _TelegramStubHandler)
+        self.server.requests = []
+        self.server.answers = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        for patcher in (
+            patch.object(services, "BOT_TOKEN", "123:test"),
+            patch.object(services, "TELEGRAM_API_BASE", f"http://127.0.0.1:{self.server.server_port}"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_flood_wait_is_retried_on_a_pooled_connection(self):
+        self.server.answers = [
+            (429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 0}}),
+            (200, {"ok": True, "result": {"file_path": "photos/file_1.jpg"}}),
+        ]
+
+        self.assertEqual(services.telegram_api_request("getFile", {"file_id": "abc"}), {"file_path": "photos/file_1.jpg"})
+        self.assertEqual([path for path, _ in self.server.requests], ["/bot123:test/getFile?file_id=abc"] * 2)
+        self.assertEqual(len({port for _, port in self.server.requests}), 1)
+
+    def test_long_flood_wait_gives_up_without_sleeping(self):
+        self.server.answers = [(429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 60}})]
+
+        started = time.monotonic()
+        self.assertIsNone(services.telegram_api_request("getUserProfilePhotos", {"user_id": 42, "limit": 1}))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(len(self.server.requests), 1)
+
+
+class OutboundPolicyTests(SimpleTestCase):
+    def test_circuit_breaker_opens_and_probes_half_open(self):
+        now = [0.0]
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30, clock=lambda: now[0])
+
+        breaker.record_failure()
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+        now[0] = 31
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        now[0] = 62
+        self.assertTrue(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow_request())
+
+    def test_deadline_scope_caps_and_exhausts_timeouts(self):
+        self.assertEqual(remaining_timeout(10), 10)
+        with deadline_scope(5):
+            self.assertLessEqual(remaining_timeout(10), 5)
+            with deadline_scope(0.01):
+                time.sleep(0.02)
+                self.assertIsNone(remaining_timeout(10))
+            self.assertIsNotNone(remaining_timeout(10))
+
+    def test_remnawave_outage_serves_stale_data_and_opens_circuit(self):
+        remnawave_client.REMNAWAVE_CACHE.clear()
+        self.addCleanup(remnawave_client.REMNAWAVE_CACHE.clear)
+        breaker_patch = patch.object(
+            remnawave_client,
+            "REMNAWAVE_BREAKER",
+            CircuitBreaker("remnawave-test", failure_threshold=1, reset_timeout=60),
+        )
+        breaker = breaker_patch.start()
+        self.addCleanup(breaker_patch.stop)
+
+        stub = RemnawaveStubServer([build_stub_user(1)]).start()
+        env = stub.env()
+        with patch.dict(os.environ, env):
+            self.assertIsNotNone(remnawave_client.get_remnawave_user_sync(email="user1@example.com"))
+            stub.stop()
+
+            with patch.object(remnawave_client.REMNAWAVE_CACHE, "_clock", lambda: time.monotonic() + 3600):
+                stale_user = remnawave_client.get_remnawave_user_sync(email="user1@example.com")
+            self.assertEqual(stale_user["subscription_url"], "https://sub.example.com/1")
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+            started = time.perf_counter()
+            self.assertIsNone(remnawave_client.get_remnawave_user_sync(email="user2@example.com"))
+            self.assertLess(time.perf_counter() - started, 0.1)
+
+
+    def test_timeouts_cut_short_by_the_request_budget_do_not_open_the_circuit(self):
+        remnawave_client.REMNAWAVE_CACHE.clear()
+        self.addCleanup(remnawave_client.REMNAWAVE_CACHE.clear)
+        breaker = CircuitBreaker("remnawave-test", failure_threshold=1, reset_timeout=60)
+
+        with RemnawaveStubServer([build_stub_user(1)], latency_seconds=0.3) as stub, patch.dict(
+            os.environ, stub.env()
+        ), patch.object(remnawave_client, "REMNAWAVE_BREAKER", breaker):
+            with deadline_scope(0.05):
+                self.assertIsNone(remnawave_client.get_remnawave_user_sync(email="user1@example.com"))
+            self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+            with patch.object(remnawave_client, "REMNAWAVE_TIMEOUT_SECONDS", 0.05):
+                self.assertIsNone(remnawave_client.get_remnawave_user_sync(email="user1@example.com"))
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+
+class NormalizeRemnawaveUserTests(SimpleTestCase):
+    def _fallbacks(self) -> float:
+        return REGISTRY.get_sample_value("remnawave_normalize_fallback_total", {"reason": "unknown_shape"}) or 0.0
+
+    def test_fast_path_matches_generic_search_on_full_user_object(self):
+        user = build_stub_user(3, traffic_history_days=30)
+        fallbacks_before = self._fallbacks()
+
+        normalized = remnawave_client.normalize_remnawave_user([user])
+
+        self.assertEqual(normalized, remnawave_client._normalize_remnawave_user_generic(user))
+        self.assertEqual(normalized["telegram_id"], 700000003)
+        self.assertEqual(normalized["telegram_username"], "user_3")
+        self.assertIsNone(normalized["photo"])
+        self.assertEqual(self._fallbacks(), fallbacks_before)
+
+    def test_unknown_nested_shape_falls_back_to_generic_search(self):
+        user = build_stub_user(4)
+        user["telegram"] = {"photoUrl": "https://t.me/i/userpic/4.jpg"}
+        fallbacks_before = self._fallbacks()
+
+        normalized = remnawave_client.normalize_remnawave_user(user)
+
+        self.assertEqual(normalized["photo"], "https://t.me/i/userpic/4.jpg")
+        self.assertEqual(self._fallbacks(), fallbacks_before + 1)
+
+
+@patch.dict(os.environ, {"REMNAWAVE_WEBHOOK_SECRET": "hook-secret"})
+class RemnawaveWebhookTests(TestCase):
+    def setUp(self):
+        remnawave_client.REMNAWAVE_CACHE.clear()
+        self.addCleanup(remnawave_client.REMNAWAVE_CACHE.clear)
+
+    def _post_event(self, event: str, user: dict, *, secret: str = "hook-secret", timestamp: float | None = None):
+        sent_at = datetime.fromtimestamp(time.time() if timestamp is None else timestamp, tz=dt_timezone.utc)
+        body = json.dumps({"event": event, "data": user, "timestamp": sent_at.isoformat()}).encode()
+        return self.client.post(
+            "/api/remnawave/webhook/",
+            data=body,
+            content_type="application/json",
+            HTTP_X_REMNAWAVE_SIGNATURE=sign_remnawave_webhook(body, secret),
+        )
+
+    def test_rejects_bad_signature(self):
+        response = self._post_event("user.modified", build_stub_user(1), secret="wrong")
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(RemnawaveUserSnapshot.objects.exists())
+
+    def test_accepts_body_signature_with_send_time_in_header_or_nowhere(self):
+        for index, headers in ((1, {"HTTP_X_REMNAWAVE_TIMESTAMP": str(int(time.time() * 1000))}), (2, {})):
+            body = json.dumps({"event": "user.created", "data": build_stub_user(index)}).encode()
+            # Remnawave signs the raw body only.
+            signature = hmac.new(b"hook-secret", body, hashlib.sha256).hexdigest()
+            response = self.client.post(
+                "/api/remnawave/webhook/",
+                data=body,
+                content_type="application/json",
+                HTTP_X_REMNAWAVE_SIGNATURE=signature,
+                **headers,
+            )
+            self.assertEqual(response.json(), {"status": "upserted"})
+
+        stale_body = json.dumps({"event": "user.modified", "data": build_stub_user(1)}).encode()
+        response = self.client.post(
+            "/api/remnawave/webhook/",
+            data=stale_body,
+            content_type="application/json",
+            HTTP_X_REMNAWAVE_SIGNATURE=hmac.new(b"hook-secret", stale_body, hashlib.sha256).hexdigest(),
+            HTTP_X_REMNAWAVE_TIMESTAMP=str(int(time.time()) - 3600),
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(RemnawaveUserSnapshot.objects.count(), 2)
+
+    def test_rejects_replayed_and_out_of_order_events(self):
+        user = build_stub_user(3)
+        self.assertEqual(self._post_event("user.created", user, timestamp=int(time.time()) - 3600).status_code, 401)
+
+        self.assertEqual(self._post_event("user.created", user).json(), {"status": "upserted"})
+        old_url = RemnawaveUserSnapshot.objects.get(uuid=user["uuid"]).subscription_url
+        # A body captured a minute ago is still signed, but it must not roll the user back.
+        user["subscriptionUrl"] = "https://sub.example.com/old"
+        self.assertEqual(self._post_event("user.modified", user, timestamp=int(time.time()) - 60).json(), {"status": "stale"})
+        self.assertEqual(RemnawaveUserSnapshot.objects.get(uuid=user["uuid"]).subscription_url, old_url)
+
+        self.assertEqual(self._post_event("user.deleted", user).json(), {"status": "deleted"})
+        self.assertEqual(self._post_event("user.created", user, timestamp=int(time.time()) - 60).json(), {"status": "stale"})
+        self.assertFalse(RemnawaveUserSnapshot.objects.exists())
+
+    @patch("telegram_auth.views.refresh_remnawave_user")
+    def test_webhook_on_another_worker_invalidates_this_workers_cache(self, refresh_mock):
+        user = build_stub_user(5)
+        stale_user = remnawave_client.normalize_remnawave_user(user)
+        remnawave_client.REMNAWAVE_CACHE.set(("email", "user5@example.com"), stale_user)
+
+        user["subscriptionUrl"] = "https://sub.example.com/rotated"
+        other_worker_cache = remnawave_client.RemnawaveLookupCache(ttl=300, negative_ttl=60, max_entries=16)
+        with patch.object(remnawave_client, "REMNAWAVE_CACHE", other_worker_cache), patch(
+            "telegram_auth.remnawave_sync.REMNAWAVE_CACHE", other_worker_cache
+        ):
+            self.assertEqual(self._post_event("user.modified", user).status_code, 200)
+        self.assertTrue(remnawave_client.REMNAWAVE_CACHE.get(("email", "user5@example.com"))[0])
+
+        resolved = views._resolve_remnawave_user_for_auth(email="user5@example.com", telegram_id=None)
+
+        self.assertEqual(resolved["subscription_url"], "https://sub.example.com/rotated")
+        self.assertFalse(remnawave_client.REMNAWAVE_CACHE.get(("email", "user5@example.com"))[0])
+        refresh_mock.assert_called()
+
+    def test_modified_event_replaces_old_binding_in_mirror_and_cache(self):
+        user = build_stub_user(1)
+        self.assertEqual(self._post_event("user.created", user).json(), {"status": "upserted"})
+        remnawave_client.REMNAWAVE_CACHE.set(("email", "user1@example.com"), {"email": "user1@example.com"})
+
+        user["email"] = "renamed@example.com"
+        user["subscriptionUrl"] = "https://sub.example.com/rotated"
+        self.assertEqual(self._post_event("user.modified", user).status_code, 200)
+
+        snapshot = RemnawaveUserSnapshot.objects.get(uuid=user["uuid"])
+        self.assertEqual(snapshot.email, "renamed@example.com")
+        self.assertFalse(remnawave_client.REMNAWAVE_CACHE.get(("email", "user1@example.com"))[0])
+        # Pushed data is served without asking Remnawave.
+        cached_user = remnawave_client.get_remnawave_user_sync(telegram_id=700000001)
+        self.assertEqual(cached_user["subscription_url"], "https://sub.example.com/rotated")
+
+    def test_deleted_event_removes_mirrored_user(self):
+        user = build_stub_user(2)
+        self._post_event("user.created", user)
+
+        self.assertEqual(self._post_event("user.deleted", user).json(), {"status": "deleted"})
+
+        self.assertFalse(RemnawaveUserSnapshot.objects.exists())
+        self.assertFalse(remnawave_client.REMNAWAVE_CACHE.get(("telegram_id", "700000002"))[0])
+
+
+class ReplayRemnawaveWebhookCommandTests(LiveServerTestCase):
+    def test_replays_signed_stub_events(self):
+        env_patch = patch.dict(os.environ, {"REMNAWAVE_WEBHOOK_SECRET": "hook-secret"})
+        env_patch.start()
+        self.addCleanup(env_patch.stop)
+        self.addCleanup(remnawave_client.REMNAWAVE_CACHE.clear)
+        output = StringIO()
+
+        call_command(
+            "replay_remnawave_webhook",
+            "--url",
+            f"{self.live_server_url}/api/remnawave/webhook/",
+            "--stub-user",
+            "7",
+            "--stub-user",
+            "8",
+            stdout=output,
+        )
+
+        self.assertEqual(output.getvalue().count("HTTP 200"), 2)
+        self.assertEqual(RemnawaveUserSnapshot.objects.count(), 2)
+
+
+class ChatRealtimeHubTests(SimpleTestCase):
+    async def test_published_events_reach_matching_connections_through_the_broker(self):
+        hub = ChatRealtimeHub(InProcessChatBroker())
+        alice = ChatWsConnection(user_id=1, is_admin=False)
+        bob = ChatWsConnection(user_id=2, is_admin=False)
+        await hub.register(alice)
+        await hub.register(bob)
+
+        await hub.publish({"event": "message_created", "scope": "private", "sender_id": 1, "recipient_id": 3})
+        await hub.publish({"event": "message_created", "scope": "global", "message_id": 7})
+
+        self.assertEqual(len(alice.queue), 2)
+        self.assertEqual(len(bob.queue), 1)
+        frame, _ = bob.queue.popleft()
+        envelope = json.loads(frame)
+        self.assertEqual((envelope["type"], envelope["event"]["message_id"]), ("chat_event", 7))
+        self.assertIn("at", envelope["event"])
+        alice.queue.popleft()
+        # The broadcast was encoded once and the same text queued for every recipient.
+        self.assertIs(alice.queue.popleft()[0], frame)
+
+    async def test_threadsafe_publish_returns_before_delivery_and_drains_in_order(self):
+        broker = InProcessChatBroker()
+        hub = ChatRealtimeHub(broker)
+        self.assertFalse(hub.publish_threadsafe({"event": "message_created", "scope": "global"}))
+
+        listener = ChatWsConnection(user_id=1, is_admin=False)
+        await hub.register(listener)
+        enqueued_before = REGISTRY.get_sample_value("chat_events_enqueued_total")
+        delivered_before = REGISTRY.get_sample_value("chat_events_delivered_total")
+
+        def _publish_burst():
+            return [
+                hub.publish_threadsafe({"event": "message_created", "scope": "global", "message_id": message_id})
+                for message_id in range(5)
+            ]
+
+        self.assertEqual(await asyncio.to_thread(_publish_burst), [True] * 5)
+        for _ in range(100):
+            if len(listener.queue) == 5:
+                break
+            await asyncio.sleep(0.01)
+
+        message_ids = [json.loads(listener.queue.popleft()[0])["event"]["message_id"] for _ in range(5)]
+        self.assertEqual(message_ids, list(range(5)))
+        self.assertEqual(REGISTRY.get_sample_value("chat_events_enqueued_total") - enqueued_before, 5)
+        self.assertEqual(REGISTRY.get_sample_value("chat_events_delivered_total") - delivered_before, 5)
+
+    async def test_slow_consumers_drop_old_frames_then_get_evicted(self):
+        hub = ChatRealtimeHub(InProcessChatBroker(), queue_max_bytes=250, slow_consumer_seconds=60)
+        slow = ChatWsConnection(user_id=1, is_admin=False)
+        await hub.register(slow)
+        dropped_before = REGISTRY.get_sample_value("chat_ws_dropped_frames_total") or 0
+
+        for message_id in range(3):
+            await hub.deliver({"event": "message_created", "scope": "global", "message_id": message_id, "body": "x" * 40})
+
+        self.assertLessEqual(slow.queued_bytes, 250)
+        self.assertEqual(slow.missed_frames, 3 - len(slow.queue))
+        self.assertEqual(REGISTRY.get_sample_value("chat_ws_dropped_frames_total") - dropped_before, slow.missed_frames)
+        self.assertEqual(json.loads(slow.queue.popleft()[0])["seq"], 3)
+        self.assertFalse(slow.evicted.is_set())
+
+        hub.slow_consumer_seconds = 0
+        await hub.deliver({"event": "message_created", "scope": "global", "message_id": 9, "body": "x" * 400})
+        await hub.deliver({"event": "message_created", "scope": "global", "message_id": 10, "body": "x" * 400})
+        self.assertTrue(slow.evicted.is_set())
+        self.assertEqual((hub.connection_count(), slow.queued_bytes), (0, 0))
+
+    async def test_control_frames_survive_overflow_and_stalled_sockets_get_evicted(self):
+        hub = ChatRealtimeHub(InProcessChatBroker(), queue_max_bytes=250, slow_consumer_seconds=0.05)
+        stalled = ChatWsConnection(user_id=1, is_admin=False)
+        await hub.register(stalled)
+        ack = _queued_frame({"type": "ack", "request_id": "edit-1", "status": 200})
+        hub.enqueue(stalled, ack, control=True)
+
+        for message_id in range(4):
+            await hub.deliver({"event": "message_created", "scope": "global", "message_id": message_id, "body": "x" * 40})
+
+        self.assertGreater(stalled.missed_frames, 0)
+        self.assertEqual(list(stalled.control), [ack])
+        self.assertIs(await hub.next_frame(stalled), ack)
+
+        # Nothing else is published: the timer alone disconnects the socket that stopped reading.
+        await asyncio.sleep(0.1)
+        self.assertTrue(stalled.evicted.is_set())
+        self.assertEqual(hub.connection_count(), 0)
+
+    async def test_coalescing_window_batches_events_and_keeps_the_latest_read_marker(self):
+        hub = ChatRealtimeHub(InProcessChatBroker())
+        batched = ChatWsConnection(user_id=1, is_admin=False, coalesce_seconds=0.05)
+        immediate = ChatWsConnection(user_id=1, is_admin=False)
+        await hub.register(batched)
+        await hub.register(immediate)
+        marker = {"event": "read_marker_updated", "scope": "read_marker", "chat_scope": "private", "user_id": 1}
+
+        await hub.deliver({"event": "message_created", "scope": "global", "message_id": 1})
+        await hub.deliver({**marker, "peer_id": 2, "at": "first"})
+        await hub.deliver({**marker, "peer_id": 3})
+        await hub.deliver({**marker, "peer_id": 2, "at": "latest"})
+        self.assertEqual((len(batched.queue), len(immediate.queue)), (0, 4))
+
+        await asyncio.sleep(0.1)
+        self.assertEqual(len(batched.queue), 1)
+        frame = json.loads(batched.queue.popleft()[0])
+        self.assertEqual(frame["type"], "chat_events")
+        self.assertEqual([envelope["seq"] for envelope in frame["events"]], [1, 3, 4])
+        self.assertEqual(frame["events"][-1]["event"]["at"], "latest")
+
+        await hub.deliver({"event": "message_created", "scope": "global", "message_id": 2})
+        await asyncio.sleep(0.1)
+        # A window holding a single event sends the plain chat_event frame.
+        self.assertEqual(json.loads(batched.queue.popleft()[0])["type"], "chat_event")
+
+    async def test_read_markers_reach_only_the_reader_and_the_peer(self):
+        hub = ChatRealtimeHub(InProcessChatBroker())
+        connections = [
+            ChatWsConnection(user_id=user_id, is_admin=is_admin)
+            for user_id, is_admin in ((1, False), (1, False), (2, False), (3, False), (9, True))
+        ]
+        for ws_connection in connections:
+            await hub.register(ws_connection)
+
+        fan_out = []
+        for event in (
+            {"event": "read_marker_updated", "scope": "read_marker", "chat_scope": "global", "user_id": 1, "peer_id": 0},
+            {"event": "read_marker_updated", "scope": "read_marker", "chat_scope": "private", "user_id": 1, "peer_id": 2},
+            {"event": "message_created", "scope": "global", "message_id": 1},
+        ):
+            queued_before = sum(len(ws_connection.queue) for ws_connection in connections)
+            await hub.deliver(event)
+            fan_out.append(sum(len(ws_connection.queue) for ws_connection in connections) - queued_before)
+
+        self.assertEqual(fan_out, [2, 3, 5])
+
+    async def test_reconnecting_clients_replay_only_the_events_they_missed(self):
+        hub = ChatRealtimeHub(InProcessChatBroker(), replay_size=2)
+        for message_id, sender_id in ((1, 5), (2, 6), (3, 5)):
+            await hub.deliver({"event": "message_created", "scope": "private", "message_id": message_id, "sender_id": sender_id})
+
+        def _register(since, epoch=hub.epoch):
+            return hub.add_connection(
+                ChatWsConnection(user_id=5, is_admin=False), since=since, epoch=epoch
+            )
+
+        seq, missed = _register(1)
+        self.assertEqual(seq, 3)
+        self.assertEqual([(frame["seq"], frame["event"]["message_id"]) for frame in map(json.loads, missed)], [(3, 3)])
+        self.assertEqual(_register(3), (3, []))
+        self.assertEqual(_register(0), (3, None))
+        self.assertEqual(_register(1, epoch="restarted"), (3, None))
+        self.assertEqual(_register(None), (3, []))
+
+    def test_indexed_routing_matches_the_per_connection_rules(self):
+        hub = ChatRealtimeHub(InProcessChatBroker())
+        connections = [
+            ChatWsConnection(user_id=user_id, is_admin=is_admin, topics=topics)
+            for user_id, is_admin, topics in (
+                (1, False, None),
+                (1, False, frozenset({"private:2"})),
+                (2, False, frozenset({"notifications"})),
+                (2, False, frozenset({"global", "private:3"})),
+                (3, True, None),
+                (3, True, frozenset({"global"})),
+                (4, False, None),
+            )
+        ]
+        for ws_connection in connections:
+            hub.add_connection(ws_connection)
+        hub.remove_connection(connections[-1])
+        live = connections[:-1]
+
+        events = (
+            {"scope": "global"},
+            {"scope": "private", "sender_id": 1, "recipient_id": "2"},
+            {"scope": "private", "sender_id": 2},
+            {"scope": "private"},
+            {"scope": "notification", "user_id": 1},
+            {"scope": "notification", "user_id": 4},
+            {"scope": "notification", "user_id": "bogus"},
+            {"scope": "read_marker", "chat_scope": "global", "user_id": 1, "peer_id": 0},
+            {"scope": "read_marker", "chat_scope": "private", "user_id": 2, "peer_id": 1},
+        )
+        for event in events:
+            with self.subTest(event=event):
+                expected = {ws_connection for ws_connection in live if _can_receive_event(ws_connection, event)}
+                self.assertEqual(set(hub.recipients(event)), expected)
+        self.assertEqual(hub.connection_count(), 6)
+
+    def test_admins_leave_the_moderation_feed_by_unsubscribing(self):
+        hub = ChatRealtimeHub(InProcessChatBroker())
+        admin = ChatWsConnection(user_id=9, is_admin=True)
+        member = ChatWsConnection(user_id=1, is_admin=False)
+        hub.add_connection(admin)
+        hub.add_connection(member)
+        private_event = {"scope": "private", "sender_id": 1, "recipient_id": 2}
+        self.assertEqual(set(hub.recipients(private_event)), {admin, member})
+
+        self.assertEqual(hub.update_topics(admin, ["moderation"], unsubscribe=True), {"global", "private", "notifications"})
+        self.assertEqual(hub.recipients(private_event), (member,))
+        topics = hub.update_topics(member, ["moderation", "private:2", "bogus"])
+        self.assertEqual(topics, {"global", "private", "notifications", "private:2"})
+        hub.update_topics(member, ["private", "global"], unsubscribe=True)
+        self.assertEqual(hub.recipients(private_event), (member,))
+        self.assertEqual(hub.recipients({"scope": "private", "sender_id": 1, "recipient_id": 3}), ())
+        self.assertEqual(hub.recipients({"scope": "global"}), (admin,))
+
+    @patch("telegram_auth.chat_broker.connections")
+    def test_oversized_notify_payload_drops_the_embedded_message(self, connections_mock):
+        cursor = connections_mock.__getitem__.return_value.cursor.return_value.__enter__.return_value
+        event = {"event": "message_created", "scope": "global", "message_id": 1, "message": {"body": "я" * 4000}}
+
+        PostgresChatBroker().publish_sync(event)
+
+        payload = json.loads(cursor.execute.call_args.args[1][1])
+        self.assertEqual(payload, {"event": "message_created", "scope": "global", "message_id": 1})
+
+    @patch("telegram_auth.chat_broker.connections")
+    def test_notify_payload_still_too_large_without_the_message_is_dropped(self, connections_mock):
+        event = {"event": "message_created", "scope": "global", "message_id": 1, "title": "я" * 4000}
+
+        PostgresChatBroker().publish_sync(event)
+
+        connections_mock.__getitem__.return_value.cursor.assert_not_called()
+
+    @patch("telegram_auth.chat_broker.connections")
+    def test_listener_conninfo_drops_empty_values_and_django_only_options(self, connections_mock):
+        connections_mock.__getitem__.return_value.settings_dict = {
+            "NAME": "chat",
+            "USER": "app",
+            "PASSWORD": "",
+            "HOST": "db",
+            "PORT": None,
+            "OPTIONS": {"sslmode": "require", "pool": True, "isolation_level": 1, "server_side_binding": True},
+        }
+
+        self.assertEqual(
+            PostgresChatBroker()._conninfo(),
+            {"dbname": "chat", "user": "app", "host": "db", "sslmode": "require"},
+        )
+
+    async def test_dispatch_delivers_json_objects_and_skips_everything_else(self):
+        broker = PostgresChatBroker()
+        received: list[dict] = []
+
+        async def _handler(event):
+            if event.get("fail"):
+                raise RuntimeError("handler failed")
+            received.append(event)
+
+        broker._handler = _handler
+        delivered_before = REGISTRY.get_sample_value("chat_events_delivered_total")
+        for payload in ('{"event":"message_created","message_id":1}', "not json", "[1, 2]", '{"fail":true}'):
+            await broker._dispatch(payload)
+
+        self.assertEqual(received, [{"event": "message_created", "message_id": 1}])
+        self.assertEqual(REGISTRY.get_sample_value("chat_events_delivered_total") - delivered_before, 1)
+
+    async def test_broker_gap_starts_a_new_epoch_and_tells_clients_to_resync(self):
+        hub = ChatRealtimeHub(InProcessChatBroker())
+        listener = ChatWsConnection(user_id=1, is_admin=False)
+        await hub.register(listener)
+        await hub.deliver({"event": "message_created", "scope": "global", "message_id": 1})
+        old_epoch = hub.epoch
+
+        broker = PostgresChatBroker()
+        broker._on_gap = hub.resync
+        broker._report_gap()
+
+        self.assertNotEqual(hub.epoch, old_epoch)
+        self.assertEqual(
+            json.loads(listener.control.popleft()[0]),
+            {"type": "resync_required", "epoch": hub.epoch, "seq": 1},
+        )
+        _, missed = hub.add_connection(ChatWsConnection(user_id=2, is_admin=False), since=0, epoch=hub.epoch)
+        self.assertIsNone(missed)
+
+    def test_broker_backend_follows_the_database(self):
+        self.assertIsInstance(build_chat_broker("auto"), InProcessChatBroker)
+        self.assertIsInstance(build_chat_broker("postgres"), PostgresChatBroker)
+        self.assertIsInstance(build_chat_broker("inprocess"), InProcessChatBroker)
+
+
+@skipUnless(connection.vendor == "postgresql", "LISTEN/NOTIFY fan-out needs a Postgres database")
+class ChatBrokerMultiProcessTests(TransactionTestCase):
+    def _spawn_listener(self, database_url: str) -> subprocess.Popen:
+        listener = subprocess.Popen(
+            [sys.executable, "manage.py", "listen_chat_events", "--count", "1", "--timeout", "20"],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env={**os.environ, "DATABASE_URL": database_url, "CHAT_BROKER_BACKEND": "postgres"},
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        self.addCleanup(listener.kill)
+        return listener
+
+    def test_every_worker_process_receives_each_event(self):
+        settings_dict = connection.settings_dict
+        database_url = (
+            f"postgresql://{quote(settings_dict['USER'] or '')}:{quote(settings_dict['PASSWORD'] or '')}"
+            f"@{settings_dict['HOST'] or 'localhost'}:{settings_dict['PORT'] or 5432}/{settings_dict['NAME']}"
+        )
+        listeners = [self._spawn_listener(database_url) for _ in range(2)]
+        with ThreadPoolExecutor(max_workers=len(listeners)) as executor:
+            ready = [executor.submit(listener.stderr.readline) for listener in listeners]
+            for future in ready:
+                self.assertIn("Listening", future.result(timeout=20))
+
+        PostgresChatBroker().publish_sync({"event": "message_created", "scope": "global", "message_id": 99})
+
+        for listener in listeners:
+            stdout, _ = listener.communicate(timeout=20)
+            self.assertEqual(listener.returncode, 0)
+            self.assertEqual(json.loads(stdout.strip())["message_id"], 99)
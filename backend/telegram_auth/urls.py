@@ -27,6 +27,7 @@ from .views import (
     payment_proofs_collection,
     profile_avatar,
     profile_settings,
+    remnawave_webhook,
     telegram_avatar,
     telegram_login,
 )
@@ -50,6 +51,7 @@ urlpatterns = [
     path("notifications/<int:notification_id>/", notification_item, name="notification_item"),
     path("profile/settings/", profile_settings, name="profile_settings"),
     path("profile/avatar/<int:target_user_id>/", profile_avatar, name="profile_avatar"),
+    path("remnawave/webhook/", remnawave_webhook, name="remnawave_webhook"),
     path("payment-proofs/", payment_proofs_collection, name="payment_proofs_collection"),
     path("payment-proofs/<int:proof_id>/file/", payment_proof_file, name="payment_proof_file"),
     path("admin/chat/messages/", admin_chat_messages, name="admin_chat_messages"),
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import mimetypes
 import os
@@ -10,17 +11,57 @@ from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
 from django.db import IntegrityError, transaction
-from django.db.models import Count, Max, Q
-from django.http import FileResponse, HttpRequest, HttpResponse, JsonResponse
+from django.db.models import Count, Exists, Max, OuterRef, Q, Value
+from django.db.models.functions import Coalesce, Lower, NullIf, Trim
+from django.http import (
+    FileResponse,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.http.multipartparser import MultiPartParser, MultiPartParserError
 from django.utils.dateparse import parse_datetime
 from django.utils import timezone as dj_timezone
+from django.utils.http import parse_etags
 from django.views.decorators.csrf import csrf_exempt
 
+from .avatar_cache import TelegramAvatarStream, aopen_telegram_avatar
+from .avatar_prefetch import enqueue_avatar_prefetch
 from .chat_realtime import publish_chat_event
-from .models import AuthIdentity, ChatMessage, ChatModerationAction, ChatReadMarker, ChatUserProfile, PaymentProof, UserNotification
-from .remnawave_client import get_remnawave_user_sync
-from .services import get_telegram_avatar_bytes, has_telegram_config, verify_telegram_auth
+from .models import (
+    AuthIdentity,
+    ChatMessage,
+    ChatModerationAction,
+    ChatReadMarker,
+    ChatUserProfile,
+    PaymentProof,
+    RemnawaveUserSnapshot,
+    UserNotification,
+)
+from .remnawave_client import (
+    REMNAWAVE_CLIENT,
+    gather_remnawave_lookups_sync,
+    get_remnawave_user_sync,
+    get_user_by_email,
+    get_user_by_telegram_id,
+    has_cached_remnawave_user,
+    invalidate_remnawave_user,
+    refresh_remnawave_user,
+)
+from .remnawave_sync import (
+    REMNAWAVE_WEBHOOK_SIGNATURE_HEADER,
+    REMNAWAVE_WEBHOOK_TIMESTAMP_HEADER,
+    apply_remnawave_user_event,
+    discard_remnawave_entries_invalidated_elsewhere,
+    is_remnawave_mirror_fresh,
+    is_replayed_remnawave_event,
+    remnawave_event_sent_at,
+    remnawave_webhook_secret,
+    verify_remnawave_webhook,
+)
+from .services import has_telegram_config, verify_telegram_auth
 
 ALLOWED_IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".heic", ".svg"}
 MAX_FILE_SIZE_BYTES = 10 * 1024 * 1024
@@ -30,6 +71,13 @@ DEFAULT_ADMIN_USERS_PAGE_SIZE = 200
 DEFAULT_CHAT_PAGE_SIZE = 100
 MAX_CHAT_PAGE_SIZE = 200
 MAX_CHAT_MESSAGE_LENGTH = 2000
+REMNAWAVE_RESOLVE_MODE = os.getenv("REMNAWAVE_RESOLVE_MODE", "parallel").strip().lower()
+REMNAWAVE_AUTH_STALE_WHILE_REVALIDATE = os.getenv("REMNAWAVE_AUTH_STALE_WHILE_REVALIDATE", "True").lower() in (
+    "1",
+    "true",
+    "yes",
+    "on",
+)
 CHAT_RATE_LIMIT_WINDOW_SECONDS = max(1, int(os.getenv("CHAT_RATE_LIMIT_WINDOW_SECONDS", "10")))
 CHAT_RATE_LIMIT_MAX_MESSAGES = max(1, int(os.getenv("CHAT_RATE_LIMIT_MAX_MESSAGES", "8")))
 MAX_AVATAR_FILE_SIZE_BYTES = 5 * 1024 * 1024
@@ -416,12 +464,28 @@ def _merge_remnawave_users(primary: dict | None, secondary: dict | None) -> dict
     return merged
 
 
-def _resolve_remnawave_user(*, email: str | None = None, telegram_id: int | None = None) -> dict | None:
+def _resolve_remnawave_user(
+    *,
+    email: str | None = None,
+    telegram_id: int | None = None,
+    stale_while_revalidate: bool = False,
+) -> dict | None:
     if not email and telegram_id is None:
         return None
 
+    if email and telegram_id is not None and REMNAWAVE_RESOLVE_MODE == "parallel":
+        # Cached answers are served on this thread; only go through the client loop when a lookup is needed.
+        if not (stale_while_revalidate and has_cached_remnawave_user(email=email)):
+            return REMNAWAVE_CLIENT.run_sync(
+                _aresolve_remnawave_user(
+                    email=email,
+                    telegram_id=telegram_id,
+                    stale_while_revalidate=stale_while_revalidate,
+                )
+            )
+
     if email:
-        by_email_user = get_remnawave_user_sync(email=email)
+        by_email_user = get_remnawave_user_sync(email=email, stale_while_revalidate=stale_while_revalidate)
         fallback_telegram_id = by_email_user.get("telegram_id") if by_email_user else telegram_id
         by_email_photo = _normalize_optional_text(by_email_user.get("photo")) if by_email_user else None
 
@@ -432,10 +496,122 @@ def _resolve_remnawave_user(*, email: str | None = None, telegram_id: int | None
         if fallback_telegram_id is None:
             return by_email_user
 
-        by_telegram_user = get_remnawave_user_sync(telegram_id=fallback_telegram_id)
+        by_telegram_user = get_remnawave_user_sync(
+            telegram_id=fallback_telegram_id,
+            stale_while_revalidate=stale_while_revalidate,
+        )
         return _merge_remnawave_users(by_email_user, by_telegram_user)
 
-    return get_remnawave_user_sync(telegram_id=telegram_id)
+    return get_remnawave_user_sync(telegram_id=telegram_id, stale_while_revalidate=stale_while_revalidate)
+
+
+async def _aresolve_remnawave_user(
+    *,
+    email: str | None = None,
+    telegram_id: int | None = None,
+    stale_while_revalidate: bool = False,
+) -> dict | None:
+    if not email and telegram_id is None:
+        return None
+
+    if email and telegram_id is not None and REMNAWAVE_RESOLVE_MODE == "parallel":
+        return await _aresolve_remnawave_user_parallel(
+            email=email,
+            telegram_id=telegram_id,
+            stale_while_revalidate=stale_while_revalidate,
+        )
+
+    if email:
+        by_email_user = await get_user_by_email(email, stale_while_revalidate=stale_while_revalidate)
+        fallback_telegram_id = by_email_user.get("telegram_id") if by_email_user else telegram_id
+        if by_email_user and _normalize_optional_text(by_email_user.get("photo")):
+            return by_email_user
+        if fallback_telegram_id is None:
+            return by_email_user
+        by_telegram_user = await get_user_by_telegram_id(
+            fallback_telegram_id,
+            stale_while_revalidate=stale_while_revalidate,
+        )
+        return _merge_remnawave_users(by_email_user, by_telegram_user)
+
+    return await get_user_by_telegram_id(telegram_id, stale_while_revalidate=stale_while_revalidate)
+
+
+async def _aresolve_remnawave_user_parallel(
+    *,
+    email: str,
+    telegram_id: int,
+    stale_while_revalidate: bool = False,
+) -> dict | None:
+    """Same result as the sequential resolver, but the by-Telegram lookup is started speculatively.
+
+    Cancelling the speculative task stops the HTTP request as well, unless another caller is
+    waiting on the same REMNAWAVE_INFLIGHT flight, which then completes for it.
+    """
+    telegram_task = asyncio.ensure_future(
+        get_user_by_telegram_id(telegram_id, stale_while_revalidate=stale_while_revalidate)
+    )
+    try:
+        by_email_user = await get_user_by_email(email, stale_while_revalidate=stale_while_revalidate)
+    except BaseException:
+        telegram_task.cancel()
+        raise
+
+    fallback_telegram_id = by_email_user.get("telegram_id") if by_email_user else telegram_id
+    if (by_email_user and _normalize_optional_text(by_email_user.get("photo"))) or fallback_telegram_id is None:
+        telegram_task.cancel()
+        return by_email_user
+    if fallback_telegram_id != telegram_id:
+        # Remnawave links this email to another Telegram account: the speculative result is not used.
+        telegram_task.cancel()
+        by_telegram_user = await get_user_by_telegram_id(
+            fallback_telegram_id,
+            stale_while_revalidate=stale_while_revalidate,
+        )
+        return _merge_remnawave_users(by_email_user, by_telegram_user)
+    return _merge_remnawave_users(by_email_user, await telegram_task)
+
+
+def _remnawave_user_from_snapshot(snapshot: RemnawaveUserSnapshot) -> dict:
+    return {
+        "email": snapshot.email or None,
+        "telegram_id": snapshot.telegram_id,
+        "telegram_username": snapshot.telegram_username or None,
+        "photo": snapshot.photo or None,
+        "subscription_url": snapshot.subscription_url or None,
+        "raw": None,
+    }
+
+
+def _resolve_remnawave_user_for_auth(*, email: str | None, telegram_id: int | None) -> dict | None:
+    """Remnawave data for auth payloads: last known answer first, blocking only when nothing is known."""
+    # A webhook handled by another worker may have changed this user since it was cached here.
+    discard_remnawave_entries_invalidated_elsewhere(email=email, telegram_id=telegram_id)
+    if not REMNAWAVE_AUTH_STALE_WHILE_REVALIDATE:
+        return _resolve_remnawave_user(email=email, telegram_id=telegram_id)
+
+    known_in_cache = (email and has_cached_remnawave_user(email=email)) or (
+        telegram_id is not None and has_cached_remnawave_user(telegram_id=telegram_id)
+    )
+    if not known_in_cache:
+        snapshot_filter = Q(email=email) if email else Q(telegram_id=telegram_id)
+        snapshot = RemnawaveUserSnapshot.objects.filter(snapshot_filter).order_by("-fetched_at").first()
+        if snapshot is not None:
+            # Warm the cache so the next call is served from it instead of the mirror.
+            if email:
+                refresh_remnawave_user(email=email)
+            linked_telegram_id = snapshot.telegram_id if snapshot.telegram_id is not None else telegram_id
+            if linked_telegram_id is not None:
+                refresh_remnawave_user(telegram_id=linked_telegram_id)
+            return _remnawave_user_from_snapshot(snapshot)
+
+    return _resolve_remnawave_user(email=email, telegram_id=telegram_id, stale_while_revalidate=True)
+
+
+def _resolve_remnawave_users_by_email(users: list[User]) -> dict[str, dict | None]:
+    """Resolve a page of users concurrently; emails that miss the batch deadline are absent from the result."""
+    emails = {_remnawave_match_key(user) for user in users} - {""}
+    return gather_remnawave_lookups_sync({email: _aresolve_remnawave_user(email=email) for email in emails})
 
 
 def _parse_admin_ids() -> set[int]:
@@ -594,10 +770,62 @@ def _serialize_avatar_presentation(profile: ChatUserProfile | None) -> dict[str,
     }
 
 
-def _serialize_admin_user(user: User, *, online_after: datetime) -> dict:
-    normalized_email = _normalize_email(user.email or user.username or "")
-    remnawave_user = _resolve_remnawave_user(email=normalized_email) if normalized_email else None
-    subscription_url = _normalize_optional_text((remnawave_user or {}).get("subscription_url"))
+def _remnawave_match_key(user: User) -> str:
+    # Users are matched to Remnawave by email, or by login when the email is empty (email accounts log in with it).
+    return _normalize_email(user.email or user.username or "")
+
+
+def _remnawave_access_filter() -> Q:
+    # Same key and rows as _remnawave_snapshots_by_email, so the filter, the flag and the metric agree.
+    match_key = Lower(Trim(Coalesce(NullIf(OuterRef("email"), Value("")), OuterRef("username"))))
+    with_access = RemnawaveUserSnapshot.objects.exclude(subscription_url="")
+    return Q(Exists(with_access.filter(email=match_key)))
+
+
+def _remnawave_snapshots_by_email(users: list[User]) -> dict[str, RemnawaveUserSnapshot]:
+    emails = {_remnawave_match_key(user) for user in users} - {""}
+    if not emails:
+        return {}
+    snapshots: dict[str, RemnawaveUserSnapshot] = {}
+    for snapshot in RemnawaveUserSnapshot.objects.filter(email__in=emails):
+        # Several Remnawave users may share an email; as in the filter, any one with a subscription counts.
+        known = snapshots.get(snapshot.email)
+        if known is None or not known.subscription_url:
+            snapshots[snapshot.email] = snapshot
+    return snapshots
+
+
+def _remnawave_access_sources(
+    users: list[User], *, mirror_active: bool
+) -> tuple[dict[str, RemnawaveUserSnapshot] | None, dict[str, dict | None]]:
+    """Mirror rows for ``users`` while the mirror is fresh, live lookups otherwise.
+
+    A fresh mirror is authoritative: a user without a row has no Remnawave account as of the last
+    sync (or the webhooks since), exactly what the ``remnawave`` filter and the metric count.
+    """
+    if not mirror_active:
+        return None, _resolve_remnawave_users_by_email(users)
+    return _remnawave_snapshots_by_email(users), {}
+
+
+def _serialize_admin_user(
+    user: User,
+    *,
+    online_after: datetime,
+    remnawave_snapshots: dict[str, RemnawaveUserSnapshot] | None = None,
+    remnawave_users: dict[str, dict | None] | None = None,
+) -> dict:
+    match_key = _remnawave_match_key(user)
+    if remnawave_snapshots is None and remnawave_users is None:
+        remnawave_snapshots, remnawave_users = _remnawave_access_sources(
+            [user], mirror_active=is_remnawave_mirror_fresh()
+        )
+    snapshot = (remnawave_snapshots or {}).get(match_key)
+    if snapshot is not None:
+        subscription_url = snapshot.subscription_url
+    else:
+        # Lookups that missed the batch deadline are reported as "no access" for this page only.
+        subscription_url = _normalize_optional_text(((remnawave_users or {}).get(match_key) or {}).get("subscription_url"))
     has_remnawave_access = bool(subscription_url)
 
     chat_profile = ChatUserProfile.objects.filter(user_id=user.id).first()
@@ -759,6 +987,10 @@ def _upsert_chat_profile(
 
     if update_fields:
         profile.save(update_fields=update_fields + ["updated_at"])
+        if profile.telegram_id is not None and {"telegram_id", "photo"} & set(update_fields):
+            # New or re-linked Telegram account, or a new photo from the login widget: warm the avatar cache.
+            prefetch_telegram_id = profile.telegram_id
+            transaction.on_commit(lambda: enqueue_avatar_prefetch(prefetch_telegram_id))
     return profile
 
 
@@ -907,6 +1139,38 @@ def _resolve_chat_message_display_names(messages: list[ChatMessage]) -> dict[int
     }
 
 
+def _chat_recipient_marker_at(message: ChatMessage) -> datetime | None:
+    if message.scope != ChatMessage.SCOPE_PRIVATE or message.recipient_id is None:
+        return None
+    marker = ChatReadMarker.objects.filter(
+        user_id=message.recipient_id,
+        scope=ChatMessage.SCOPE_PRIVATE,
+        peer_id=message.sender_id,
+    ).first()
+    return marker.last_read_at if marker else None
+
+
+def _publish_chat_message_event(event: str, message: ChatMessage, *, peer_marker_at: datetime | None) -> None:
+    """Publish ``event`` with the message itself, so clients apply it without refetching the page."""
+    serialized = _serialize_chat_message(
+        message,
+        peer_marker_at=peer_marker_at,
+        user_display_names=_resolve_chat_message_display_names([message]),
+    )
+    # read_by_me depends on who is looking; clients derive it from their own read marker.
+    serialized.pop("read_by_me")
+    publish_chat_event(
+        {
+            "event": event,
+            "scope": message.scope,
+            "message_id": message.id,
+            "sender_id": message.sender_id,
+            "recipient_id": message.recipient_id,
+            "message": serialized,
+        }
+    )
+
+
 def _serialize_moderation_action(action: ChatModerationAction) -> dict:
     return {
         "id": action.id,
@@ -950,6 +1214,16 @@ def _touch_chat_read_marker(*, user_id: int, scope: str, peer_id: int = ChatRead
         peer_id=peer_id,
         defaults={"last_read_at": dj_timezone.now()},
     )
+    # Only the reader's own sessions and, in private chats, the peer care about a read marker.
+    publish_chat_event(
+        {
+            "event": "read_marker_updated",
+            "scope": "read_marker",
+            "chat_scope": scope,
+            "user_id": user_id,
+            "peer_id": peer_id,
+        }
+    )
 
 
 def _chat_unread_summary(user_id: int) -> dict:
@@ -1055,6 +1329,206 @@ def _parse_mutation_payload(request: HttpRequest) -> tuple[dict, JsonResponse |
     return payload, None
 
 
+def _send_chat_message(*, user_id: int, sender_name: str, payload: dict) -> tuple[dict, int]:
+    scope = str(payload.get("scope", ChatMessage.SCOPE_GLOBAL)).strip()
+    if scope not in {ChatMessage.SCOPE_GLOBAL, ChatMessage.SCOPE_PRIVATE}:
+        return {"error": "Invalid scope"}, 400
+
+    body = str(payload.get("body", "")).strip()
+    if not body:
+        return {"error": "Message body is required"}, 400
+    if len(body) > MAX_CHAT_MESSAGE_LENGTH:
+        return {"error": f"Message is too long (max {MAX_CHAT_MESSAGE_LENGTH})"}, 400
+    client_message_id = str(payload.get("client_message_id", "")).strip()[:64]
+
+    if client_message_id:
+        duplicate = ChatMessage.objects.filter(sender_id=user_id, client_message_id=client_message_id).first()
+        if duplicate is not None:
+            peer_marker = None
+            if duplicate.scope == ChatMessage.SCOPE_PRIVATE and duplicate.recipient_id is not None:
+                peer_marker = ChatReadMarker.objects.filter(
+                    user_id=duplicate.recipient_id,
+                    scope=ChatMessage.SCOPE_PRIVATE,
+                    peer_id=user_id,
+                ).first()
+            return (
+                _serialize_chat_message(
+                    duplicate,
+                    viewer_id=user_id,
+                    peer_marker_at=peer_marker.last_read_at if peer_marker else None,
+                ),
+                200,
+            )
+
+    if _chat_rate_limit_exceeded(user_id):
+        return (
+            {
+                "error": (
+                    "Too many messages. "
+                    f"Limit: {CHAT_RATE_LIMIT_MAX_MESSAGES} messages per {CHAT_RATE_LIMIT_WINDOW_SECONDS}s"
+                )
+            },
+            429,
+        )
+
+    recipient_id: int | None = None
+    recipient_username = ""
+    if scope == ChatMessage.SCOPE_PRIVATE:
+        raw_recipient_id = str(payload.get("recipient_id", "")).strip()
+        if not raw_recipient_id.isdigit():
+            return {"error": "recipient_id is required for private chat"}, 400
+        recipient_id = int(raw_recipient_id)
+        if recipient_id == user_id:
+            return {"error": "Cannot send private message to yourself"}, 400
+        recipient_username = _resolve_chat_peer_name(recipient_id)
+
+    try:
+        with transaction.atomic():
+            message = ChatMessage.objects.create(
+                scope=scope,
+                sender_id=user_id,
+                sender_username=sender_name,
+                recipient_id=recipient_id,
+                recipient_username=recipient_username,
+                client_message_id=client_message_id,
+                body=body,
+            )
+    except IntegrityError:
+        if not client_message_id:
+            return {"error": "Conflict while sending message"}, 409
+        duplicate = ChatMessage.objects.filter(sender_id=user_id, client_message_id=client_message_id).first()
+        if duplicate is None:
+            return {"error": "Conflict while sending message"}, 409
+        return _serialize_chat_message(duplicate, viewer_id=user_id), 200
+
+    peer_marker_at = _chat_recipient_marker_at(message)
+    if recipient_id is not None:
+        _create_user_notification(
+            user_id=recipient_id,
+            kind=UserNotification.KIND_CHAT,
+            title="Новое личное сообщение",
+            body=f"{sender_name}: {body[:140]}",
+            link_url="/chat",
+        )
+    response_payload = _serialize_chat_message(message, viewer_id=user_id, peer_marker_at=peer_marker_at)
+    _publish_chat_message_event("message_created", message, peer_marker_at=peer_marker_at)
+    return response_payload, 201
+
+
+def _find_manageable_chat_message(
+    message_id: int, *, user_id: int, is_admin: bool
+) -> tuple[ChatMessage | None, tuple[dict, int] | None]:
+    try:
+        message = ChatMessage.objects.get(id=message_id)
+    except ChatMessage.DoesNotExist:
+        return None, ({"error": "Message not found"}, 404)
+    if not is_admin and message.sender_id != user_id:
+        return None, ({"error": "Forbidden"}, 403)
+    return message, None
+
+
+def _edit_chat_message(
+    message: ChatMessage, *, user_id: int, is_admin: bool, actor_name: str, payload: dict
+) -> tuple[dict, int]:
+    if message.is_deleted:
+        return {"error": "Deleted message cannot be edited"}, 409
+
+    new_body = str(payload.get("body", "")).strip()
+    if not new_body:
+        return {"error": "Message body is required"}, 400
+    if len(new_body) > MAX_CHAT_MESSAGE_LENGTH:
+        return {"error": f"Message is too long (max {MAX_CHAT_MESSAGE_LENGTH})"}, 400
+    if new_body == message.body:
+        return _serialize_chat_message(message, viewer_id=user_id), 200
+
+    previous_body = message.body
+    message.body = new_body
+    message.edited_at = dj_timezone.now()
+    message.save(update_fields=["body", "edited_at"])
+
+    ChatModerationAction.objects.create(
+        message=message,
+        action=ChatModerationAction.ACTION_EDIT,
+        acted_by_user_id=user_id,
+        acted_by_username=actor_name,
+        is_admin_action=is_admin and message.sender_id != user_id,
+        previous_body=previous_body,
+        next_body=new_body,
+    )
+    response_payload = _serialize_chat_message(message, viewer_id=user_id)
+    _publish_chat_message_event("message_updated", message, peer_marker_at=_chat_recipient_marker_at(message))
+    return response_payload, 200
+
+
+def _delete_chat_message(message: ChatMessage, *, user_id: int, is_admin: bool, actor_name: str) -> tuple[dict, int]:
+    if message.is_deleted:
+        return _serialize_chat_message(message, viewer_id=user_id), 200
+
+    previous_body = message.body
+    message.is_deleted = True
+    message.deleted_at = dj_timezone.now()
+    message.deleted_by_user_id = user_id
+    message.deleted_by_admin = is_admin and message.sender_id != user_id
+    message.save(update_fields=["is_deleted", "deleted_at", "deleted_by_user_id", "deleted_by_admin"])
+
+    ChatModerationAction.objects.create(
+        message=message,
+        action=ChatModerationAction.ACTION_DELETE,
+        acted_by_user_id=user_id,
+        acted_by_username=actor_name,
+        is_admin_action=is_admin and message.sender_id != user_id,
+        previous_body=previous_body,
+        next_body="",
+    )
+    response_payload = _serialize_chat_message(message, viewer_id=user_id)
+    _publish_chat_message_event("message_deleted", message, peer_marker_at=_chat_recipient_marker_at(message))
+    return response_payload, 200
+
+
+def _mark_chat_read(*, user_id: int, payload: dict) -> tuple[dict, int]:
+    scope = str(payload.get("scope", ChatMessage.SCOPE_GLOBAL)).strip()
+    if scope not in {ChatMessage.SCOPE_GLOBAL, ChatMessage.SCOPE_PRIVATE}:
+        return {"error": "Invalid scope"}, 400
+
+    if scope == ChatMessage.SCOPE_GLOBAL:
+        _touch_chat_read_marker(user_id=user_id, scope=scope)
+        return {"ok": True}, 200
+
+    raw_peer_id = str(payload.get("peer_id", "")).strip()
+    if not raw_peer_id.isdigit():
+        return {"error": "peer_id is required for private chat"}, 400
+    peer_id = int(raw_peer_id)
+    if peer_id == user_id:
+        return {"error": "Cannot mark yourself as peer"}, 400
+    _touch_chat_read_marker(user_id=user_id, scope=scope, peer_id=peer_id)
+    return {"ok": True}, 200
+
+
+def run_chat_ws_operation(operation: str, payload: dict, *, user_id: int, is_admin: bool) -> tuple[dict, int]:
+    """Run a chat action sent over an authenticated WebSocket; same rules as the HTTP endpoints.
+
+    The socket already resolved the user, so the auth lookup and profile upsert are skipped and
+    names come from the stored chat profile.
+    """
+    if operation == "mark_read":
+        return _mark_chat_read(user_id=user_id, payload=payload)
+    actor_name = _resolve_chat_peer_name(user_id)
+    if operation == "send_message":
+        return _send_chat_message(user_id=user_id, sender_name=actor_name, payload=payload)
+    if operation not in {"edit_message", "delete_message"}:
+        return {"error": "Unknown operation"}, 400
+
+    raw_message_id = str(payload.get("message_id", "")).strip()
+    if not raw_message_id.isdigit():
+        return {"error": "message_id is required"}, 400
+    message, error = _find_manageable_chat_message(int(raw_message_id), user_id=user_id, is_admin=is_admin)
+    if message is None:
+        return error
+    if operation == "edit_message":
+        return _edit_chat_message(message, user_id=user_id, is_admin=is_admin, actor_name=actor_name, payload=payload)
+    return _delete_chat_message(message, user_id=user_id, is_admin=is_admin, actor_name=actor_name)
+
+
 def _validate_chat_display_name(display_name: str, *, user_id: int) -> JsonResponse | None:
     if len(display_name) > MAX_CHAT_DISPLAY_NAME_LENGTH:
         return JsonResponse({"error": f"Display name must be <= {MAX_CHAT_DISPLAY_NAME_LENGTH} characters"}, status=400)
@@ -1401,7 +1875,7 @@ def auth_me(request: HttpRequest) -> JsonResponse:
     resolved_user_id = auth_user.id
     resolved_email = _normalize_email(auth_user.email) if auth_user.email else email
 
-    remnawave_user = _resolve_remnawave_user(email=resolved_email, telegram_id=telegram_id)
+    remnawave_user = _resolve_remnawave_user_for_auth(email=resolved_email, telegram_id=telegram_id)
 
     resolved_auth_provider = auth_provider or ("telegram" if telegram_id is not None and not resolved_email else "email")
     _touch_user_last_login(user_id=resolved_user_id, email=resolved_email)
@@ -1484,6 +1958,8 @@ def auth_link_email(request: HttpRequest) -> JsonResponse:
     updated_user_fields.append("last_login")
     auth_user.save(update_fields=list(dict.fromkeys(updated_user_fields)))
 
+    invalidate_remnawave_user(email=current_email, telegram_id=telegram_id)
+    invalidate_remnawave_user(email=email)
     remnawave_user = _resolve_remnawave_user(email=email, telegram_id=telegram_id)
     profile = _upsert_chat_profile(
         user_id=auth_user.id,
@@ -1536,6 +2012,7 @@ def auth_link_telegram(request: HttpRequest) -> JsonResponse:
     if telegram_identity_error is not None:
         return telegram_identity_error
 
+    invalidate_remnawave_user(email=auth_user.email or None, telegram_id=telegram_id)
     remnawave_user = _resolve_remnawave_user(
         email=_normalize_email(auth_user.email) if auth_user.email else None,
         telegram_id=telegram_id,
@@ -1702,20 +2179,73 @@ def profile_avatar(request: HttpRequest, target_user_id: int) -> JsonResponse |
     return response
 
 
-def telegram_avatar(request: HttpRequest, telegram_id: int) -> HttpResponse | JsonResponse:
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison function (RFC 9110, 13.1.2).
+    candidates = parse_etags(if_none_match)
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+async def telegram_avatar(
+    request: HttpRequest,
+    telegram_id: int,
+) -> HttpResponse | JsonResponse | FileResponse | StreamingHttpResponse:
+    # Async so that cache misses wait on the Telegram pool without holding a sync worker thread.
     if request.method != "GET":
         return JsonResponse({"error": "Invalid method"}, status=405)
 
-    avatar_payload = get_telegram_avatar_bytes(telegram_id)
-    if avatar_payload is None:
+    avatar = await aopen_telegram_avatar(telegram_id)
+    if avatar is None:
         return JsonResponse({"error": "Avatar not found"}, status=404)
 
-    content, content_type = avatar_payload
-    response = HttpResponse(content, content_type=content_type)
+    if isinstance(avatar, TelegramAvatarStream):
+        # Cold avatar: relay Telegram's body chunk by chunk while it is written to the cache.
+        response = StreamingHttpResponse(avatar.chunks(), content_type=avatar.content_type)
+        if avatar.content_length is not None:
+            response["Content-Length"] = str(avatar.content_length)
+    elif _etag_matches(request.headers.get("If-None-Match", ""), avatar.etag):
+        response = HttpResponseNotModified()
+        response["ETag"] = avatar.etag
+    else:
+        try:
+            avatar_file = await asyncio.to_thread(avatar.path.open, "rb")
+            response = FileResponse(avatar_file, content_type=avatar.content_type)
+        except FileNotFoundError:
+            # Replaced by a concurrent revalidation between lookup and open.
+            return JsonResponse({"error": "Avatar not found"}, status=404)
+        response["ETag"] = avatar.etag
     response["Cache-Control"] = "public, max-age=300"
     return response
 
 
+@csrf_exempt
+def remnawave_webhook(request: HttpRequest) -> JsonResponse:
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid method"}, status=405)
+    if not remnawave_webhook_secret():
+        return JsonResponse({"error": "Webhook is not configured"}, status=503)
+    if not verify_remnawave_webhook(request.body, request.headers.get(REMNAWAVE_WEBHOOK_SIGNATURE_HEADER, "")):
+        return JsonResponse({"error": "Invalid signature"}, status=401)
+
+    try:
+        payload = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({"error": "Invalid payload"}, status=400)
+
+    # Without a send time the event is ordered by arrival and cannot be checked for replay.
+    sent_at = remnawave_event_sent_at(payload, request.headers.get(REMNAWAVE_WEBHOOK_TIMESTAMP_HEADER, ""))
+    if sent_at is not None and is_replayed_remnawave_event(sent_at):
+        return JsonResponse({"error": "Stale event"}, status=401)
+
+    event = str(payload.get("event") or "").strip()
+    raw_user = payload.get("data")
+    if not event.startswith("user.") or not isinstance(raw_user, dict):
+        return JsonResponse({"status": "ignored"}, status=202)
+
+    return JsonResponse({"status": apply_remnawave_user_event(event, raw_user, sent_at=sent_at)})
+
+
 def health_check(request: HttpRequest) -> JsonResponse:
     if request.method != "GET":
         return JsonResponse({"error": "Invalid method"}, status=405)
@@ -1906,14 +2436,6 @@ def chat_messages(request: HttpRequest) -> JsonResponse:
             messages, has_more, next_before_id = _paginate_chat_queryset(messages_query, limit=limit, before_id=before_id)
             user_display_names = _resolve_chat_message_display_names(messages)
             _touch_chat_read_marker(user_id=user_id, scope=ChatMessage.SCOPE_GLOBAL)
-            publish_chat_event(
-                {
-                    "event": "read_marker_updated",
-                    "scope": ChatMessage.SCOPE_GLOBAL,
-                    "user_id": user_id,
-                    "peer_id": ChatReadMarker.GLOBAL_PEER_ID,
-                }
-            )
             return JsonResponse(
                 {
                     "scope": scope,
@@ -1943,16 +2465,6 @@ def chat_messages(request: HttpRequest) -> JsonResponse:
         messages, has_more, next_before_id = _paginate_chat_queryset(messages_query, limit=limit, before_id=before_id)
         user_display_names = _resolve_chat_message_display_names(messages)
         _touch_chat_read_marker(user_id=user_id, scope=ChatMessage.SCOPE_PRIVATE, peer_id=peer_id)
-        publish_chat_event(
-            {
-                "event": "read_marker_updated",
-                "scope": ChatMessage.SCOPE_PRIVATE,
-                "user_id": user_id,
-                "peer_id": peer_id,
-                "sender_id": user_id,
-                "recipient_id": peer_id,
-            }
-        )
         viewer_marker = ChatReadMarker.objects.filter(
             user_id=user_id,
             scope=ChatMessage.SCOPE_PRIVATE,
@@ -1990,105 +2502,8 @@ def chat_messages(request: HttpRequest) -> JsonResponse:
     except json.JSONDecodeError:
         return JsonResponse({"error": "Invalid JSON"}, status=400)
 
-    scope = str(payload.get("scope", ChatMessage.SCOPE_GLOBAL)).strip()
-    if scope not in {ChatMessage.SCOPE_GLOBAL, ChatMessage.SCOPE_PRIVATE}:
-        return JsonResponse({"error": "Invalid scope"}, status=400)
-
-    body = str(payload.get("body", "")).strip()
-    if not body:
-        return JsonResponse({"error": "Message body is required"}, status=400)
-    if len(body) > MAX_CHAT_MESSAGE_LENGTH:
-        return JsonResponse({"error": f"Message is too long (max {MAX_CHAT_MESSAGE_LENGTH})"}, status=400)
-    client_message_id = str(payload.get("client_message_id", "")).strip()[:64]
-
-    if client_message_id:
-        duplicate = ChatMessage.objects.filter(sender_id=user_id, client_message_id=client_message_id).first()
-        if duplicate is not None:
-            peer_marker = None
-            if duplicate.scope == ChatMessage.SCOPE_PRIVATE and duplicate.recipient_id is not None:
-                peer_marker = ChatReadMarker.objects.filter(
-                    user_id=duplicate.recipient_id,
-                    scope=ChatMessage.SCOPE_PRIVATE,
-                    peer_id=user_id,
-                ).first()
-            return JsonResponse(
-                _serialize_chat_message(
-                    duplicate,
-                    viewer_id=user_id,
-                    peer_marker_at=peer_marker.last_read_at if peer_marker else None,
-                )
-            )
-
-    if _chat_rate_limit_exceeded(user_id):
-        return JsonResponse(
-            {
-                "error": (
-                    "Too many messages. "
-                    f"Limit: {CHAT_RATE_LIMIT_MAX_MESSAGES} messages per {CHAT_RATE_LIMIT_WINDOW_SECONDS}s"
-                )
-            },
-            status=429,
-        )
-
-    recipient_id: int | None = None
-    recipient_username = ""
-    if scope == ChatMessage.SCOPE_PRIVATE:
-        raw_recipient_id = str(payload.get("recipient_id", "")).strip()
-        if not raw_recipient_id.isdigit():
-            return JsonResponse({"error": "recipient_id is required for private chat"}, status=400)
-        recipient_id = int(raw_recipient_id)
-        if recipient_id == user_id:
-            return JsonResponse({"error": "Cannot send private message to yourself"}, status=400)
-        recipient_username = _resolve_chat_peer_name(recipient_id)
-
-    try:
-        with transaction.atomic():
-            message = ChatMessage.objects.create(
-                scope=scope,
-                sender_id=user_id,
-                sender_username=sender_name,
-                recipient_id=recipient_id,
-                recipient_username=recipient_username,
-                client_message_id=client_message_id,
-                body=body,
-            )
-    except IntegrityError:
-        if not client_message_id:
-            return JsonResponse({"error": "Conflict while sending message"}, status=409)
-        duplicate = ChatMessage.objects.filter(sender_id=user_id, client_message_id=client_message_id).first()
-        if duplicate is None:
-            return JsonResponse({"error": "Conflict while sending message"}, status=409)
-        return JsonResponse(_serialize_chat_message(duplicate, viewer_id=user_id))
-
-    peer_marker = None
-    if recipient_id is not None:
-        peer_marker = ChatReadMarker.objects.filter(
-            user_id=recipient_id,
-            scope=ChatMessage.SCOPE_PRIVATE,
-            peer_id=user_id,
-        ).first()
-        _create_user_notification(
-            user_id=recipient_id,
-            kind=UserNotification.KIND_CHAT,
-            title="Новое личное сообщение",
-            body=f"{sender_name}: {body[:140]}",
-            link_url="/chat",
-        )
-    payload = _serialize_chat_message(
-        message,
-        viewer_id=user_id,
-        peer_marker_at=peer_marker.last_read_at if peer_marker else None,
-    )
-    publish_chat_event(
-        {
-            "event": "message_created",
-            "scope": message.scope,
-            "message_id": message.id,
-            "sender_id": message.sender_id,
-            "recipient_id": message.recipient_id,
-        }
-    )
-    return JsonResponse(payload, status=201)
+    response_payload, status = _send_chat_message(user_id=user_id, sender_name=sender_name, payload=payload)
+    return JsonResponse(response_payload, status=status)
 
 
 @csrf_exempt
@@ -2102,15 +2517,11 @@ def chat_message_item(request: HttpRequest, message_id: int) -> JsonResponse:
     if request.method not in {"PATCH", "DELETE"}:
         return JsonResponse({"error": "Invalid method"}, status=405)
 
-    try:
-        message = ChatMessage.objects.get(id=message_id)
-    except ChatMessage.DoesNotExist:
-        return JsonResponse({"error": "Message not found"}, status=404)
-
     is_admin = _is_admin_identity(user_id, telegram_id)
-    can_manage = is_admin or message.sender_id == user_id
-    if not can_manage:
-        return JsonResponse({"error": "Forbidden"}, status=403)
+    message, error = _find_manageable_chat_message(message_id, user_id=user_id, is_admin=is_admin)
+    if message is None:
+        error_payload, status = error
+        return JsonResponse(error_payload, status=status)
 
     profile = _upsert_chat_profile(
         user_id=user_id,
@@ -2134,74 +2545,13 @@ def chat_message_item(request: HttpRequest, message_id: int) -> JsonResponse:
             payload = json.loads(request.body)
         except json.JSONDecodeError:
             return JsonResponse({"error": "Invalid JSON"}, status=400)
-
-        if message.is_deleted:
-            return JsonResponse({"error": "Deleted message cannot be edited"}, status=409)
-
-        new_body = str(payload.get("body", "")).strip()
-        if not new_body:
-            return JsonResponse({"error": "Message body is required"}, status=400)
-        if len(new_body) > MAX_CHAT_MESSAGE_LENGTH:
-            return JsonResponse({"error": f"Message is too long (max {MAX_CHAT_MESSAGE_LENGTH})"}, status=400)
-        if new_body == message.body:
-            return JsonResponse(_serialize_chat_message(message, viewer_id=user_id))
-
-        previous_body = message.body
-        message.body = new_body
-        message.edited_at = dj_timezone.now()
-        message.save(update_fields=["body", "edited_at"])
-
-        ChatModerationAction.objects.create(
-            message=message,
-            action=ChatModerationAction.ACTION_EDIT,
-            acted_by_user_id=user_id,
-            acted_by_username=actor_name,
-            is_admin_action=is_admin and message.sender_id != user_id,
-            previous_body=previous_body,
-            next_body=new_body,
-        )
-        payload = _serialize_chat_message(message, viewer_id=user_id)
-        publish_chat_event(
-            {
-                "event": "message_updated",
-                "scope": message.scope,
-                "message_id": message.id,
-                "sender_id": message.sender_id,
-                "recipient_id": message.recipient_id,
-            }
+        response_payload, status = _edit_chat_message(
+            message, user_id=user_id, is_admin=is_admin, actor_name=actor_name, payload=payload
         )
-        return JsonResponse(payload)
+        return JsonResponse(response_payload, status=status)
 
-    if message.is_deleted:
-        return JsonResponse(_serialize_chat_message(message, viewer_id=user_id))
-
-    previous_body = message.body
-    message.is_deleted = True
-    message.deleted_at = dj_timezone.now()
-    message.deleted_by_user_id = user_id
-    message.deleted_by_admin = is_admin and message.sender_id != user_id
-    message.save(update_fields=["is_deleted", "deleted_at", "deleted_by_user_id", "deleted_by_admin"])
-
-    ChatModerationAction.objects.create(
-        message=message,
-        action=ChatModerationAction.ACTION_DELETE,
-        acted_by_user_id=user_id,
-        acted_by_username=actor_name,
-        is_admin_action=is_admin and message.sender_id != user_id,
-        previous_body=previous_body,
-        next_body="",
-    )
-    payload = _serialize_chat_message(message, viewer_id=user_id)
-    publish_chat_event(
-        {
-            "event": "message_deleted",
-            "scope": message.scope,
-            "message_id": message.id,
-            "sender_id": message.sender_id,
-            "recipient_id": message.recipient_id,
-        }
-    )
-    return JsonResponse(payload)
+    response_payload, status = _delete_chat_message(message, user_id=user_id, is_admin=is_admin, actor_name=actor_name)
+    return JsonResponse(response_payload, status=status)
 
 
 @csrf_exempt
@@ -2219,40 +2569,8 @@ def chat_read_marker(request: HttpRequest) -> JsonResponse:
     except json.JSONDecodeError:
         return JsonResponse({"error": "Invalid JSON"}, status=400)
 
-    scope = str(payload.get("scope", ChatMessage.SCOPE_GLOBAL)).strip()
-    if scope not in {ChatMessage.SCOPE_GLOBAL, ChatMessage.SCOPE_PRIVATE}:
-        return JsonResponse({"error": "Invalid scope"}, status=400)
-
-    if scope == ChatMessage.SCOPE_GLOBAL:
-        _touch_chat_read_marker(user_id=user_id, scope=scope)
-        publish_chat_event(
-            {
-                "event": "read_marker_updated",
-                "scope": ChatMessage.SCOPE_GLOBAL,
-                "user_id": user_id,
-                "peer_id": ChatReadMarker.GLOBAL_PEER_ID,
-            }
-        )
-        return JsonResponse({"ok": True})
-
-    raw_peer_id = str(payload.get("peer_id", "")).strip()
-    if not raw_peer_id.isdigit():
-        return JsonResponse({"error": "peer_id is required for private chat"}, status=400)
-    peer_id = int(raw_peer_id)
-    if peer_id == user_id:
-        return JsonResponse({"error": "Cannot mark yourself as peer"}, status=400)
-    _touch_chat_read_marker(user_id=user_id, scope=scope, peer_id=peer_id)
-    publish_chat_event(
-        {
-            "event": "read_marker_updated",
-            "scope": ChatMessage.SCOPE_PRIVATE,
-            "user_id": user_id,
-            "peer_id": peer_id,
-            "sender_id": user_id,
-            "recipient_id": peer_id,
-        }
-    )
-    return JsonResponse({"ok": True})
+    response_payload, status = _mark_chat_read(user_id=user_id, payload=payload)
+    return JsonResponse(response_payload, status=status)
 
 
 def chat_unread(request: HttpRequest) -> JsonResponse:
@@ -2516,11 +2834,17 @@ def admin_users(request: HttpRequest) -> JsonResponse:
         pending_user_ids = PaymentProof.objects.filter(status=PaymentProof.STATUS_PENDING).values_list("user_id", flat=True)
         users_queryset = users_queryset.filter(id__in=pending_user_ids)
 
+    remnawave_mirror_active = is_remnawave_mirror_fresh()
+    if filter_name == "remnawave" and remnawave_mirror_active:
+        users_queryset = users_queryset.filter(_remnawave_access_filter())
+
     filtered_total = users_queryset.count()
-    if filter_name == "remnawave":
+    if filter_name == "remnawave" and not remnawave_mirror_active:
+        # Without the mirror, access can only be checked with live lookups.
         candidate_users = list(users_queryset[:1000])
+        remnawave_users = _resolve_remnawave_users_by_email(candidate_users)
         serialized_candidates = [
-            _serialize_admin_user(user, online_after=online_after)
+            _serialize_admin_user(user, online_after=online_after, remnawave_users=remnawave_users)
             for user in candidate_users
         ]
         remnawave_items = [item for item in serialized_candidates if item["has_remnawave_access"]]
@@ -2528,9 +2852,21 @@ def admin_users(request: HttpRequest) -> JsonResponse:
         filtered_total = len(remnawave_items)
     else:
         users = list(users_queryset[offset : offset + limit])
-        items = [_serialize_admin_user(user, online_after=online_after) for user in users]
+        remnawave_snapshots, remnawave_users = _remnawave_access_sources(users, mirror_active=remnawave_mirror_active)
+        items = [
+            _serialize_admin_user(
+                user,
+                online_after=online_after,
+                remnawave_snapshots=remnawave_snapshots,
+                remnawave_users=remnawave_users,
+            )
+            for user in users
+        ]
 
-    remnawave_access_users = sum(1 for item in items if item["has_remnawave_access"])
+    if remnawave_mirror_active:
+        remnawave_access_users = User.objects.filter(_remnawave_access_filter()).count()
+    else:
+        remnawave_access_users = sum(1 for item in items if item["has_remnawave_access"])
     online_users = User.objects.filter(last_login__gte=online_after).count()
     users_without_password = User.objects.filter(password__startswith="!").count()
     today_start = dj_timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
@@ -2606,6 +2942,8 @@ def admin_update_user_credentials(request: HttpRequest, target_user_id: int) ->
         return parse_error
 
     profile, _ = ChatUserProfile.objects.get_or_create(user_id=target_user_id)
+    previous_emails = {user.email, user.username, profile.email}
+    previous_telegram_id = profile.telegram_id
 
     uploaded_avatar = uploaded_files.get("avatar")
     remove_avatar_raw = payload.get("remove_avatar")
@@ -2756,6 +3094,11 @@ def admin_update_user_credentials(request: HttpRequest, target_user_id: int) ->
         user.save(update_fields=list(dict.fromkeys(updated_user_fields)))
     if updated_profile_fields:
         profile.save(update_fields=list(dict.fromkeys(updated_profile_fields + ["updated_at"])))
+    if {"email", "username"} & set(updated_user_fields) or {"email", "telegram_id"} & set(updated_profile_fields):
+        for changed_email in previous_emails | {user.email, profile.email}:
+            invalidate_remnawave_user(email=changed_email or None)
+        invalidate_remnawave_user(telegram_id=previous_telegram_id)
+        invalidate_remnawave_user(telegram_id=profile.telegram_id)
     if update_login or update_password or update_profile_data or uploaded_avatar is not None or remove_avatar:
         _create_user_notification(
             user_id=target_user_id,
@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+from typing import Any
+from urllib.parse import unquote
+
+from aiohttp import web
+
+
+class RemnawaveStubServer:
+    """Minimal local Remnawave API used by benchmarks and tests.
+
+    Runs an aiohttp server on its own thread and records how many requests and
+    distinct TCP connections it has served.
+    """
+
+    def __init__(self, users: list[dict[str, Any]] | None = None, *, latency_seconds: float = 0.0) -> None:
+        self.users: list[dict[str, Any]] = list(users or [])
+        self.latency_seconds = latency_seconds
+        self.requests: Counter[str] = Counter()
+        self._peers: set[tuple] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._runner: web.AppRunner | None = None
+        self.port: int | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def request_count(self) -> int:
+        return sum(self.requests.values())
+
+    @property
+    def connection_count(self) -> int:
+        return len(self._peers)
+
+    def reset_stats(self) -> None:
+        self.requests.clear()
+        self._peers.clear()
+
+    def env(self) -> dict[str, str]:
+        return {
+            "REMNAWAVE_BASE_URL": self.base_url,
+            "REMNAWAVE_TOKEN": "stub-token",
+            "REMNAWAVE_COOKIE": "session=stub",
+            "REMNAWAVE_SSL_VERIFY": "False",
+        }
+
+    async def _track(self, request: web.Request, kind: str) -> None:
+        self.requests[kind] += 1
+        if request.transport is not None:
+            # Client ephemeral ports identify TCP connections: keep-alive reuse keeps the same peer.
+            self._peers.add(tuple(request.transport.get_extra_info("peername") or ()))
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+
+    async def _by_email(self, request: web.Request) -> web.Response:
+        await self._track(request, "by-email")
+        email = unquote(request.match_info["email"]).strip().lower()
+        for user in self.users:
+            if str(user.get("email") or "").lower() == email:
+                return web.json_response({"response": user})
+        return web.json_response({"message": "User not found"}, status=404)
+
+    async def _by_telegram_id(self, request: web.Request) -> web.Response:
+        await self._track(request, "by-telegram-id")
+        telegram_id = request.match_info["telegram_id"]
+        matches = [user for user in self.users if str(user.get("telegramId")) == telegram_id]
+        if not matches:
+            return web.json_response({"message": "User not found"}, status=404)
+        return web.json_response({"response": matches})
+
+    async def _list_users(self, request: web.Request) -> web.Response:
+        await self._track(request, "list")
+        start = int(request.query.get("start", "0"))
+        size = int(request.query.get("size", "25"))
+        return web.json_response(
+            {"response": {"users": self.users[start : start + size], "total": len(self.users)}}
+        )
+
+    def _build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/api/users", self._list_users)
+        app.router.add_get("/api/users/by-email/{email}", self._by_email)
+        app.router.add_get("/api/users/by-telegram-id/{telegram_id}", self._by_telegram_id)
+        return app
+
+    async def _start_server(self) -> None:
+        self._runner = web.AppRunner(self._build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        server = site._server  # noqa: SLF001 - aiohttp does not expose the bound port otherwise.
+        self.port = server.sockets[0].getsockname()[1]
+
+    def start(self) -> "RemnawaveStubServer":
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def _run() -> None:
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self._start_server())
+            ready.set()
+            loop.run_forever()
+
+        self._loop = loop
+        self._thread = threading.Thread(target=_run, name="remnawave-stub", daemon=True)
+        self._thread.start()
+        if not ready.wait(10):
+            raise RuntimeError("Remnawave stub server did not start")
+        return self
+
+    def stop(self) -> None:
+        if self._loop is None or self._thread is None:
+            return
+        if self._runner is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+        self._loop.close()
+        self._loop = None
+        self._thread = None
+
+    def __enter__(self) -> "RemnawaveStubServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+def build_stub_user(index: int, *, with_telegram: bool = True, traffic_history_days: int = 0) -> dict[str, Any]:
+    now = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+    user: dict[str, Any] = {
+        "uuid": f"00000000-0000-4000-8000-{index:012d}",
+        "shortUuid": f"short{index}",
+        "username": f"user_{index}",
+        "email": f"user{index}@example.com",
+        "telegramId": 700000000 + index if with_telegram else None,
+        "status": "ACTIVE",
+        "subscriptionUrl": f"https://sub.example.com/{index}",
+        "createdAt": now,
+        "updatedAt": now,
+    }
+    if traffic_history_days:
+        # Shape of a full Remnawave user object with traffic statistics, as returned by the panel.
+        user.update(
+            {
+                "trafficLimitBytes": 0,
+                "trafficLimitStrategy": "NO_RESET",
+                "expireAt": now,
+                "description": "",
+                "hwidDeviceLimit": 3,
+                "lastConnectedNode": {"connectedAt": now, "nodeName": "node-1", "countryCode": "NL"},
+                "activeInternalSquads": [
+                    {"uuid": f"00000000-0000-4000-9000-{squad:012d}", "name": f"squad-{squad}"} for squad in range(5)
+                ],
+                "happ": {"cryptoLink": f"happ://crypt/{index}"},
+                "userTraffic": {
+                    "usedTrafficBytes": 123456789,
+                    "lifetimeUsedTrafficBytes": 987654321,
+                    "onlineAt": now,
+                    "firstConnectedAt": now,
+                    "dailyUsage": [
+                        {
+                            "date": f"day-{day}",
+                            "nodeUuid": f"00000000-0000-4000-a000-{day % 7:012d}",
+                            "uploadBytes": day * 1024,
+                            "downloadBytes": day * 4096,
+                        }
+                        for day in range(traffic_history_days)
+                    ],
+                },
+            }
+        )
+    return user
@@ -1,40 +1,102 @@
-import { useEffect, useRef, useState } from 'react'
+import { useCallback, useEffect, useRef, useState } from 'react'
 import type { AuthUser } from '../types/auth'
+import type { ChatRealtimeMessage } from '../types/chat'
 
 const RECONNECT_BASE_DELAY_MS = 1_000
 const RECONNECT_MAX_DELAY_MS = 15_000
+const OPERATION_TIMEOUT_MS = 10_000
+// Bursts arrive as one chat_events frame; the pages debounce their refetches for longer anyway.
+const REALTIME_COALESCE_MS = 100
 
 export interface ChatRealtimeEvent {
   event: string
-  scope: 'global' | 'private' | string
+  scope: 'global' | 'private' | 'notification' | 'read_marker' | string
+  chat_scope?: 'global' | 'private' | string
   message_id?: number
   sender_id?: number
   recipient_id?: number | null
   user_id?: number
   peer_id?: number
+  message?: ChatRealtimeMessage
   at?: string
 }
 
+export type ChatOperation = 'send_message' | 'edit_message' | 'delete_message' | 'mark_read'
+
+export interface ChatOperationResult {
+  status: number
+  data?: unknown
+  error?: string
+}
+
 interface ChatRealtimeEnvelope {
   type: string
   event?: ChatRealtimeEvent
+  events?: ChatRealtimeEnvelope[]
+  epoch?: string
+  seq?: number
   ts?: string
+  request_id?: string
+  status?: number
+  data?: unknown
+  error?: string
+}
+
+interface PendingOperation {
+  resolve: (result: ChatOperationResult) => void
+  reject: (error: Error) => void
+  timer: number
 }
 
-function buildChatWsUrl(user: AuthUser): string {
+interface ChatRealtimeCursor {
+  epoch: string
+  seq: number
+}
+
+function buildChatWsUrl(user: AuthUser, cursor: ChatRealtimeCursor | null, topics: readonly string[] | null): string {
   const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:'
   const url = new URL('/ws/chat/', window.location.origin)
   url.protocol = protocol
   url.searchParams.set('user_id', String(user.id))
+  url.searchParams.set('coalesce_ms', String(REALTIME_COALESCE_MS))
   if (user.email) {
     url.searchParams.set('email', user.email)
   }
   if (typeof user.telegram_id === 'number') {
     url.searchParams.set('telegram_id', String(user.telegram_id))
   }
+  if (topics) {
+    url.searchParams.set('topics', topics.join(','))
+  }
+  if (cursor) {
+    // Resume after the last seen event; the server replays the gap or answers resync_required.
+    url.searchParams.set('epoch', cursor.epoch)
+    url.searchParams.set('since', String(cursor.seq))
+  }
   return url.toString()
 }
 
+function sendTopicChanges(socket: WebSocket, previousKey: string, nextKey: string): void {
+  const previous = previousKey ? previousKey.split(',') : []
+  const next = nextKey ? nextKey.split(',') : []
+  const removed = previous.filter((topic) => !next.includes(topic))
+  const added = next.filter((topic) => !previous.includes(topic))
+  if (removed.length > 0) {
+    socket.send(JSON.stringify({ type: 'unsubscribe', topics: removed }))
+  }
+  if (added.length > 0) {
+    socket.send(JSON.stringify({ type: 'subscribe', topics: added }))
+  }
+}
+
+function rejectPendingOperations(pending: Map<string, PendingOperation>, reason: string): void {
+  for (const operation of pending.values()) {
+    window.clearTimeout(operation.timer)
+    operation.reject(new Error(reason))
+  }
+  pending.clear()
+}
+
 function reconnectDelay(attempt: number): number {
   const exponential = RECONNECT_BASE_DELAY_MS * 2 ** Math.min(attempt, 6)
   return Math.min(RECONNECT_MAX_DELAY_MS, exponential)
@@ -44,14 +106,45 @@ export function useChatRealtime(
   user: AuthUser | null,
   enabled: boolean,
   onEvent: (event: ChatRealtimeEvent) => void,
-): { isConnected: boolean } {
+  onResync?: () => void,
+  topics?: readonly string[],
+): {
+  isConnected: boolean
+  sendOperation: (operation: ChatOperation, payload: Record<string, unknown>) => Promise<ChatOperationResult>
+} {
   const [isConnected, setIsConnected] = useState(false)
   const onEventRef = useRef(onEvent)
+  const onResyncRef = useRef(onResync)
+  // Without topics the server sends everything this user may see.
+  const topicsKey = topics ? [...topics].sort().join(',') : null
+  const topicsKeyRef = useRef(topicsKey)
+  const socketRef = useRef<WebSocket | null>(null)
+  const subscribedKeyRef = useRef<string | null>(null)
+  const pendingRef = useRef(new Map<string, PendingOperation>())
+  const operationCounterRef = useRef(0)
 
   useEffect(() => {
     onEventRef.current = onEvent
   }, [onEvent])
 
+  useEffect(() => {
+    onResyncRef.current = onResync
+  }, [onResync])
+
+  useEffect(() => {
+    topicsKeyRef.current = topicsKey
+    const socket = socketRef.current
+    const subscribedKey = subscribedKeyRef.current
+    if (!socket || socket.readyState !== WebSocket.OPEN || topicsKey === null || subscribedKey === null) {
+      return
+    }
+    // Switch the open socket over instead of reconnecting; new sockets pass their topics in the URL.
+    if (topicsKey !== subscribedKey) {
+      sendTopicChanges(socket, subscribedKey, topicsKey)
+      subscribedKeyRef.current = topicsKey
+    }
+  }, [topicsKey])
+
   useEffect(() => {
     if (!enabled || !user) {
       return
@@ -61,16 +154,27 @@ export function useChatRealtime(
     let reconnectTimer: number | null = null
     let reconnectAttempt = 0
     let isUnmounted = false
+    let cursor: ChatRealtimeCursor | null = null
 
     const connect = () => {
       if (isUnmounted) {
         return
       }
 
-      socket = new WebSocket(buildChatWsUrl(user))
+      const connectTopicsKey = topicsKeyRef.current
+      socket = new WebSocket(
+        buildChatWsUrl(user, cursor, connectTopicsKey === null ? null : connectTopicsKey.split(',')),
+      )
+      socketRef.current = socket
 
       socket.onopen = () => {
         reconnectAttempt = 0
+        subscribedKeyRef.current = connectTopicsKey
+        const latestTopicsKey = topicsKeyRef.current
+        if (socket && connectTopicsKey !== null && latestTopicsKey !== null && latestTopicsKey !== connectTopicsKey) {
+          sendTopicChanges(socket, connectTopicsKey, latestTopicsKey)
+          subscribedKeyRef.current = latestTopicsKey
+        }
         setIsConnected(true)
       }
 
@@ -88,8 +192,36 @@ export function useChatRealtime(
           socket?.send(JSON.stringify({ type: 'ping', ts: payload.ts ?? null }))
           return
         }
-        if (payload.type === 'chat_event' && payload.event) {
-          onEventRef.current(payload.event)
+        if (payload.type === 'ready' && payload.epoch && typeof payload.seq === 'number') {
+          cursor = { epoch: payload.epoch, seq: payload.seq }
+          return
+        }
+        if ((payload.type === 'ack' || payload.type === 'error') && payload.request_id) {
+          const pending = pendingRef.current.get(payload.request_id)
+          if (pending) {
+            pendingRef.current.delete(payload.request_id)
+            window.clearTimeout(pending.timer)
+            pending.resolve({ status: payload.status ?? 500, data: payload.data, error: payload.error })
+          }
+          return
+        }
+        if (payload.type === 'resync_required' || payload.type === 'events_missed') {
+          if (payload.type === 'resync_required' && payload.epoch && typeof payload.seq === 'number') {
+            // The server started a new epoch (e.g. its broker reconnected): resume from it next time.
+            cursor = { epoch: payload.epoch, seq: payload.seq }
+          }
+          onResyncRef.current?.()
+          return
+        }
+        const envelopes = payload.type === 'chat_events' ? (payload.events ?? []) : [payload]
+        for (const envelope of envelopes) {
+          if (envelope.type !== 'chat_event' || !envelope.event) {
+            continue
+          }
+          if (cursor && typeof envelope.seq === 'number') {
+            cursor = { ...cursor, seq: Math.max(cursor.seq, envelope.seq) }
+          }
+          onEventRef.current(envelope.event)
         }
       }
 
@@ -99,6 +231,7 @@ export function useChatRealtime(
 
       socket.onclose = () => {
         setIsConnected(false)
+        rejectPendingOperations(pendingRef.current, 'Chat socket closed')
         if (isUnmounted) {
           return
         }
@@ -115,7 +248,9 @@ export function useChatRealtime(
 
     return () => {
       isUnmounted = true
+      socketRef.current = null
       setIsConnected(false)
+      rejectPendingOperations(pendingRef.current, 'Chat socket closed')
       if (reconnectTimer !== null) {
         window.clearTimeout(reconnectTimer)
       }
@@ -123,5 +258,26 @@ export function useChatRealtime(
     }
   }, [enabled, user])
 
-  return { isConnected }
+  // Rejects when the socket is not open or gives no answer in time; callers fall back to HTTP.
+  const sendOperation = useCallback(
+    (operation: ChatOperation, payload: Record<string, unknown>) =>
+      new Promise<ChatOperationResult>((resolve, reject) => {
+        const socket = socketRef.current
+        if (!socket || socket.readyState !== WebSocket.OPEN) {
+          reject(new Error('Chat socket is not connected'))
+          return
+        }
+        operationCounterRef.current += 1
+        const requestId = `op-${operationCounterRef.current}`
+        const timer = window.setTimeout(() => {
+          pendingRef.current.delete(requestId)
+          reject(new Error('Chat socket request timed out'))
+        }, OPERATION_TIMEOUT_MS)
+        pendingRef.current.set(requestId, { resolve, reject, timer })
+        socket.send(JSON.stringify({ ...payload, type: operation, request_id: requestId }))
+      }),
+    [],
+  )
+
+  return { isConnected, sendOperation }
 }
@@ -5,6 +5,7 @@ import { buildAuthHeaders } from '../utils/auth'
 import { useChatRealtime, type ChatRealtimeEvent } from './useChatRealtime'
 
 const DEFAULT_NOTIFICATION_POLL_MS = 15000
+const NOTIFICATION_TOPICS = ['notifications']
 
 export function useNotifications(user: AuthUser | null, enabled: boolean = true) {
   const [items, setItems] = useState<UserNotification[]>([])
@@ -58,7 +59,7 @@ export function useNotifications(user: AuthUser | null, enabled: boolean = true)
     [scheduleRefresh],
   )
 
-  useChatRealtime(user, enabled && Boolean(user), handleRealtimeEvent)
+  useChatRealtime(user, enabled && Boolean(user), handleRealtimeEvent, scheduleRefresh, NOTIFICATION_TOPICS)
 
   useEffect(() => {
     if (!user || !enabled) {
@@ -12,6 +12,7 @@ import { getAvatarImageStyle } from '../utils/avatar'
 
 const REFRESH_INTERVAL_MS = 30_000
 const CHAT_REALTIME_DEBOUNCE_MS = 180
+const MODERATION_TOPICS = ['global', 'moderation']
 
 const DEFAULT_METRICS: AdminUsersMetrics = {
   total_users: 0,
@@ -265,7 +266,13 @@ export default function Admin() {
     [activeTab, scheduleAdminChatRefresh],
   )
 
-  useChatRealtime(user, Boolean(user && isAdminUser(user) && activeTab === 'moderation'), handleAdminRealtimeEvent)
+  useChatRealtime(
+    user,
+    Boolean(user && isAdminUser(user) && activeTab === 'moderation'),
+    handleAdminRealtimeEvent,
+    scheduleAdminChatRefresh,
+    MODERATION_TOPICS,
+  )
 
   useEffect(() => {
     const storedUser = getStoredUser()
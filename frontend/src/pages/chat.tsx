@@ -1,10 +1,15 @@
 import type { FormEvent, SyntheticEvent } from 'react'
 import { useCallback, useEffect, useMemo, useRef, useState } from 'react'
 import { useNavigate } from 'react-router'
-import { useChatRealtime, type ChatRealtimeEvent } from '../hooks/useChatRealtime'
+import {
+  useChatRealtime,
+  type ChatOperation,
+  type ChatOperationResult,
+  type ChatRealtimeEvent,
+} from '../hooks/useChatRealtime'
 import { useChatUnreadPing } from '../hooks/useChatUnreadPing'
 import type { AuthUser } from '../types/auth'
-import type { ChatMessageItem, ChatMessagesResponse, ChatScope, ChatUserItem } from '../types/chat'
+import type { ChatMessageItem, ChatMessagesResponse, ChatRealtimeMessage, ChatScope, ChatUserItem } from '../types/chat'
 import { isAdminUser } from '../utils/admin'
 import { buildAuthHeaders, clearStoredAuth, getStoredUser, refreshStoredAuthUser, withStoredAvatarVersion } from '../utils/auth'
 import { getAvatarImageStyle } from '../utils/avatar'
@@ -13,6 +18,9 @@ const DEFAULT_AVATAR =
   'https://lh3.googleusercontent.com/aida-public/AB6AXuD7QfEnuqRCntNYH9h2Vpo3jzR2BMfMqxHuHq-ivlguZcwzF_lfmadLZHf4vT8CfrKoIUNDPR1MmHqWK_suVK1pQOJXx0sSYBdAc3HCdZbWyuwNnuAj95xWWZilTRSMiKUfTt-6lFPSIvaV577Wik1oYO_ONDLJYuA5yaDJJSU7PwQfDQftZAILVh17O3KQr1s3dq56Z1g5mUvalbeTkomtJfUowYTnX-9km8Hdzb5Wm8IyfcVbawTAHqT3EkFdUrXJHLDkkTopp-E'
 const REALTIME_REFRESH_DEBOUNCE_MS = 180
 const FALLBACK_SYNC_INTERVAL_MS = 45_000
+// Private events keep unread counts current in both views; global ones matter only while it is open.
+const GLOBAL_VIEW_TOPICS = ['global', 'private']
+const PRIVATE_VIEW_TOPICS = ['private']
 
 function getAvatarUrl(photo?: string): string {
   const normalized = withStoredAvatarVersion(photo)
@@ -84,6 +92,28 @@ function parseOptionalNumber(value: unknown): number | null {
   return null
 }
 
+function applyRealtimeMessage(
+  previous: ChatMessageItem[],
+  message: ChatRealtimeMessage,
+  isNew: boolean,
+): ChatMessageItem[] {
+  const index = previous.findIndex((item) => item.id === message.id)
+  if (index !== -1) {
+    const next = [...previous]
+    next[index] = { ...previous[index], ...message }
+    return next
+  }
+  if (!isNew) {
+    // Edits and deletions of messages outside the loaded page do not matter here.
+    return previous
+  }
+  const next = [...previous, { ...message, read_by_me: false }]
+  if (previous.length > 0 && previous[previous.length - 1].id > message.id) {
+    next.sort((left, right) => left.id - right.id)
+  }
+  return next
+}
+
 export default function Chat() {
   const navigate = useNavigate()
   const [user, setUser] = useState<AuthUser | null>(() => getStoredUser())
@@ -285,13 +315,44 @@ export default function Chat() {
         return
       }
 
+      // Message events carry the message itself; apply it in place unless a search filter needs the server.
+      const isMessageEvent = event.event.startsWith('message_')
+      const delta = isMessageEvent && !messageSearch.trim() ? event.message : undefined
+      const applyOrRefresh = (target: { users?: boolean }) => {
+        if (delta) {
+          setMessages((previous) => applyRealtimeMessage(previous, delta, event.event === 'message_created'))
+          if (target.users) {
+            scheduleRealtimeRefresh(target)
+          }
+        } else {
+          scheduleRealtimeRefresh({ ...target, messages: true })
+        }
+      }
+
       if (event.scope === 'global') {
-        if (scope === 'global') {
-          scheduleRealtimeRefresh({ messages: true })
+        // Global read markers do not change how global messages are shown.
+        if (scope === 'global' && isMessageEvent) {
+          applyOrRefresh({})
         }
         return
       }
 
+      if (event.scope === 'read_marker') {
+        // Only private read markers change what this page shows: unread counts and read receipts.
+        if (event.chat_scope !== 'private') {
+          return
+        }
+        const readerId = parseOptionalNumber(event.user_id)
+        const peerId = parseOptionalNumber(event.peer_id)
+        const isCurrentDialog =
+          scope === 'private' &&
+          selectedPeerId !== null &&
+          [readerId, peerId].includes(user.id) &&
+          [readerId, peerId].includes(selectedPeerId)
+        scheduleRealtimeRefresh({ users: true, messages: isCurrentDialog })
+        return
+      }
+
       if (event.scope !== 'private') {
         return
       }
@@ -305,12 +366,26 @@ export default function Chat() {
         participants.includes(user.id) &&
         participants.includes(selectedPeerId)
 
+      if (isCurrentDialog && isMessageEvent) {
+        applyOrRefresh({ users: true })
+        return
+      }
       scheduleRealtimeRefresh({ users: true, messages: isCurrentDialog })
     },
-    [scheduleRealtimeRefresh, scope, selectedPeerId, user],
+    [messageSearch, scheduleRealtimeRefresh, scope, selectedPeerId, user],
   )
 
-  useChatRealtime(user, true, handleRealtimeEvent)
+  const handleRealtimeResync = useCallback(() => {
+    scheduleRealtimeRefresh({ users: true, messages: true })
+  }, [scheduleRealtimeRefresh])
+
+  const { sendOperation } = useChatRealtime(
+    user,
+    true,
+    handleRealtimeEvent,
+    handleRealtimeResync,
+    scope === 'global' ? GLOBAL_VIEW_TOPICS : PRIVATE_VIEW_TOPICS,
+  )
 
   useEffect(() => {
     const currentUser = userRef.current
@@ -418,6 +493,23 @@ export default function Chat() {
   const telegramId = typeof user.telegram_id === 'number' ? user.telegram_id : null
   const avatarImageStyle = getAvatarImageStyle(user)
 
+  async function requestChatOperation(
+    operation: ChatOperation,
+    payload: Record<string, unknown>,
+    fallback: () => Promise<Response>,
+  ): Promise<ChatOperationResult> {
+    try {
+      return await sendOperation(operation, payload)
+    } catch {
+      // No open socket or no answer: the HTTP API applies the same rules, and sends stay deduplicated by client_message_id.
+      const response = await fallback()
+      if (response.ok) {
+        return { status: response.status, data: await response.json() }
+      }
+      return { status: response.status, error: await parseApiError(response, '') }
+    }
+  }
+
   async function handleSendMessage(event: FormEvent<HTMLFormElement>) {
     event.preventDefault()
     if (!user) {
@@ -443,20 +535,22 @@ export default function Chat() {
       if (scope === 'private' && selectedPeerId !== null) {
         payload.recipient_id = selectedPeerId
       }
-      const response = await fetch('/api/chat/messages/', {
-        method: 'POST',
-        headers: {
-          ...buildAuthHeaders(user),
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify(payload),
-      })
-      if (response.status === 401 || response.status === 403) {
+      const result = await requestChatOperation('send_message', payload, () =>
+        fetch('/api/chat/messages/', {
+          method: 'POST',
+          headers: {
+            ...buildAuthHeaders(user),
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify(payload),
+        }),
+      )
+      if (result.status === 401 || result.status === 403) {
         handleUnauthorized()
         return
       }
-      if (!response.ok) {
-        setError(await parseApiError(response, 'Не удалось отправить сообщение'))
+      if (result.status >= 400) {
+        setError(result.error || 'Не удалось отправить сообщение')
         return
       }
       setMessageText('')
@@ -483,20 +577,22 @@ export default function Chat() {
       return
     }
     try {
-      const response = await fetch(`/api/chat/messages/${messageId}/`, {
-        method: 'PATCH',
-        headers: {
-          ...buildAuthHeaders(user),
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ body }),
-      })
-      if (response.status === 401 || response.status === 403) {
+      const result = await requestChatOperation('edit_message', { message_id: messageId, body }, () =>
+        fetch(`/api/chat/messages/${messageId}/`, {
+          method: 'PATCH',
+          headers: {
+            ...buildAuthHeaders(user),
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify({ body }),
+        }),
+      )
+      if (result.status === 401 || result.status === 403) {
         handleUnauthorized()
         return
       }
-      if (!response.ok) {
-        setError(await parseApiError(response, 'Не удалось обновить сообщение'))
+      if (result.status >= 400) {
+        setError(result.error || 'Не удалось обновить сообщение')
         return
       }
       setEditingMessageId(null)
@@ -512,16 +608,18 @@ export default function Chat() {
       return
     }
     try {
-      const response = await fetch(`/api/chat/messages/${messageId}/`, {
-        method: 'DELETE',
-        headers: buildAuthHeaders(user),
-      })
-      if (response.status === 401 || response.status === 403) {
+      const result = await requestChatOperation('delete_message', { message_id: messageId }, () =>
+        fetch(`/api/chat/messages/${messageId}/`, {
+          method: 'DELETE',
+          headers: buildAuthHeaders(user),
+        }),
+      )
+      if (result.status === 401 || result.status === 403) {
         handleUnauthorized()
         return
       }
-      if (!response.ok) {
-        setError(await parseApiError(response, 'Не удалось удалить сообщение'))
+      if (result.status >= 400) {
+        setError(result.error || 'Не удалось удалить сообщение')
         return
       }
       await loadMessages({ appendOlder: false, silent: true })
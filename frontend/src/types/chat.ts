@@ -17,6 +17,9 @@ export interface ChatMessageItem {
   created_at: string
 }
 
+// Realtime events carry the message without read_by_me, which depends on the viewer.
+export type ChatRealtimeMessage = Omit<ChatMessageItem, 'read_by_me'>
+
 export interface ChatUserItem {
   user_id: number
   username: string